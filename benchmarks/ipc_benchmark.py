@@ -0,0 +1,675 @@
+#!/usr/bin/env python2
+# This file is part of browser, and contains the ipc benchmark.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Measure how long tab commands take to get to a plug process and back.
+
+A private dbus-daemon is started so other sessions don't disturb the
+numbers, then a browserplug.py process is started on it the same way the
+main window starts one.  If gtk or webkit can't be used a stub plug with the
+same methods and signals, but no browser view, is started instead.
+
+The results are printed, or written to the --output file, as json:
+
+    {
+        "transport": "dbus",
+        "view": "webkit",
+        "results": {
+            "load_uri": {"count": 200, "p50_ms": 0.41, ...},
+            "get_history": {...},
+            "progress": {...},
+            "print_message": {...}
+        },
+        ...
+    }
+
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import platform
+import tempfile
+import subprocess
+from time import time, sleep
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'webbrowser'))
+
+import glib
+import dbus
+import dbus.service
+import dbus.mainloop.glib
+
+from plug_ipc import ipc_bus, IPCServer, IPCConnection, socket_path
+from tab_state import TabState
+from defaults import UPDATE_PROGRESS
+
+# The socket id the benchmark tab uses.
+SOCKET_ID = 0
+
+# How long to wait for a plug to start, a load to finish or the messages
+# to arrive.
+START_TIMEOUT = 30
+WAIT_TIMEOUT = 10
+
+# The page loaded by the benchmark.  It logs count console messages and
+# then an end marker.
+BENCH_PAGE = """<html><head><title>ipc benchmark</title></head><body>
+<script type="text/javascript">
+var match = /count=(\\d+)/.exec(location.search);
+var count = match ? parseInt(match[1]) : 0;
+for (var i = 0; i < count; i++) {
+    console.log('bench-line ' + i);
+}
+if (count) {
+    console.log('bench-end');
+}
+</script></body></html>
+"""
+
+# The stub plug sends messages in batches of this size like PlugSender.
+STUB_BATCH_SIZE = 200
+
+STUB_PLUG_INTERFACE = 'com.browser.plug%d' % os.getpid()
+STUB_TAB_INTERFACE = 'com.browser.tab%d' % os.getpid()
+STUB_MAIN_INTERFACE = 'com.browser.main%d' % os.getppid()
+
+
+class StubReceiver(dbus.service.Object):
+    """ StubReceiver -> The PlugReceiver methods used by the benchmark,
+    answered without a browser view.
+
+    """
+
+    def __init__(self, bus, sender):
+        """ StubReceiver(bus, sender) -> Export the methods on bus and send
+        the signals a load causes with sender.
+
+        """
+
+        dbus.service.Object.__init__(self, bus, '/bplug%d' % os.getpid())
+
+        self._sender = sender
+        self._state = TabState()
+
+    @dbus.service.method(dbus_interface=STUB_PLUG_INTERFACE,
+            in_signature='x')
+    def set_socket_id(self, socket_id):
+        """ set_socket_id(socket_id) -> Nothing to embed.
+
+        """
+
+        pass
+
+    @dbus.service.method(dbus_interface=STUB_PLUG_INTERFACE,
+                        in_signature='su', out_signature='s')
+    def load_uri(self, uri, socket_id):
+        """ load_uri(uri, socket_id) -> Add uri to the history and send the
+        progress and console messages a load of the benchmark page would.
+
+        """
+
+        state = self._state
+        state.history_list = state.history_list[:state.back_length + 1]
+        state.history_list.append(('ipc benchmark', uri))
+        state.back_length = len(state.history_list) - 1
+
+        match = re.search(r'count=(\d+)', uri)
+        count = int(match.group(1)) if match else 0
+        glib.idle_add(self._sender.send_load, count, socket_id)
+        return uri
+
+    @dbus.service.method(dbus_interface=STUB_PLUG_INTERFACE,
+            in_signature='ux', out_signature='s')
+    def get_history(self, socket_id, index=2):
+        """ get_history(socket_id, index=2) -> Return the history as a json
+        string.
+
+        """
+
+        return self._state.get_history(index)
+
+    @dbus.service.method(dbus_interface=STUB_PLUG_INTERFACE,
+            in_signature='u', out_signature='b')
+    def exit(self, socket_id):
+        """ exit(socket_id) -> Quit the stub plug.
+
+        """
+
+        glib.idle_add(self._sender.quit)
+        return True
+
+
+class StubSender(dbus.service.Object):
+    """ StubSender -> The PlugSender signals used by the benchmark.
+
+    """
+
+    def __init__(self, bus, main_loop):
+        """ StubSender(bus, main_loop) -> Send signals on bus.
+
+        """
+
+        dbus.service.Object.__init__(self, bus,
+                '/bplug_sender%d' % os.getpid())
+
+        self._main_loop = main_loop
+        self._pid = os.getpid()
+        self.connection_list = []
+
+    def emit(self, signal_name, *args):
+        """ emit(signal_name, *args) -> Send a signal over the socket if the
+        benchmark is connected, otherwise over dbus.
+
+        """
+
+        if self.connection_list:
+            for connection in self.connection_list:
+                connection.emit_signal(signal_name, args)
+        else:
+            getattr(self, signal_name)(*args)
+
+    def send_load(self, count, socket_id):
+        """ send_load(count, socket_id) -> Send the updates and messages of
+        a page load.
+
+        """
+
+        for progress in (0.0, 0.1, 0.5, 1.0):
+            self.emit('send_update', progress, '', False, False,
+                    UPDATE_PROGRESS, socket_id)
+
+        message_list = ['console message: line 3: bench-line %d (id )' % i
+                for i in xrange(count)]
+        if count:
+            message_list.append('console message: line 8: bench-end (id )')
+
+        for i in xrange(0, len(message_list), STUB_BATCH_SIZE):
+            self.emit('print_message_batch', [('browserplug %d: %s' % \
+                    (self._pid, message), 32, '38;5;196') for message in
+                message_list[i:i + STUB_BATCH_SIZE]])
+
+        return False
+
+    def quit(self):
+        """ quit -> Stop the main loop.
+
+        """
+
+        self._main_loop.quit()
+        return False
+
+    @dbus.service.signal(dbus_interface=STUB_MAIN_INTERFACE,
+            signature='a(sus)')
+    def print_message_batch(self, message_list):
+        """ print_message_batch(message_list) -> Send a batch of messages.
+
+        """
+
+        pass
+
+    @dbus.service.signal(dbus_interface=STUB_TAB_INTERFACE,
+            signature='dsbbuu')
+    def send_update(self, progress, hover_uri, can_go_back, can_go_forward,
+            mask, socket_id):
+        """ send_update(progress, hover_uri, can_go_back, can_go_forward,
+        mask, socket_id) -> Send a combined tab update.
+
+        """
+
+        pass
+
+
+def run_stub_plug(transport):
+    """ run_stub_plug(transport) -> Run a stub plug until it is told to
+    exit.
+
+    """
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.SessionBus()
+    bus_name = dbus.service.BusName(STUB_PLUG_INTERFACE, bus)
+
+    main_loop = glib.MainLoop()
+    sender = StubSender(bus, main_loop)
+    receiver = StubReceiver(bus, sender)
+
+    def call_method(method_name, args):
+        method = getattr(receiver, method_name, None)
+        if not getattr(method, '_dbus_is_method', False):
+            raise AttributeError("no method %s" % method_name)
+        return method(*args)
+
+    def connection_closed(connection):
+        if connection in sender.connection_list:
+            sender.connection_list.remove(connection)
+
+    def new_connection(sock):
+        connection = IPCConnection(sock, method_func=call_method,
+                close_func=connection_closed)
+        connection.emit_signal('hello', ('/main_browserbenchmark',))
+        sender.connection_list.append(connection)
+
+    server = None
+    if transport == 'socket':
+        server = IPCServer(socket_path(os.getpid()), new_connection)
+
+    main_loop.run()
+
+    if server:
+        server.close()
+
+
+def percentiles(time_list):
+    """ percentiles(time_list) -> Return a dictionary of the count, min,
+    mean, median, 90th, 99th percentile and max of time_list in
+    milliseconds.
+
+    """
+
+    if not time_list:
+        return {'count': 0}
+
+    time_list = sorted(time_list)
+    count = len(time_list)
+
+    def rank(percent):
+        index = int(round(percent / 100.0 * count + 0.5)) - 1
+        return time_list[min(max(index, 0), count - 1)] * 1000
+
+    return {
+            'count': count,
+            'min_ms': time_list[0] * 1000,
+            'mean_ms': sum(time_list) / count * 1000,
+            'p50_ms': rank(50),
+            'p90_ms': rank(90),
+            'p99_ms': rank(99),
+            'max_ms': time_list[-1] * 1000,
+            }
+
+
+def can_use_webkit():
+    """ can_use_webkit -> Return True if a real browser view can be made.
+
+    """
+
+    if not os.environ.get('DISPLAY'):
+        return False
+    try:
+        import gtk
+        import webkit
+    except (ImportError, RuntimeError):
+        return False
+    return True
+
+
+class IPCBenchmark(object):
+    """ IPCBenchmark -> Start a plug on a private bus and time the messages
+    sent to and from it.
+
+    """
+
+    def __init__(self, transport='dbus', stub=False, verbose=False):
+        """ IPCBenchmark(transport='dbus', stub=False, verbose=False) ->
+        Benchmark a plug using transport.  If stub is True, or webkit can't
+        be used, a stub plug is used.
+
+        """
+
+        self._transport = transport
+        self._stub = stub or not can_use_webkit()
+        self._verbose = verbose
+
+        self._path = os.path.dirname(os.path.abspath(__file__))
+        self._temp_dir = tempfile.mkdtemp(prefix='ipc_benchmark')
+        self._page_uri = 'file://%s/bench.html' % self._temp_dir
+
+        self._daemon = None
+        self._plug = None
+        self._bus = None
+        self._proxy = None
+
+        self._progress_list = []
+        self._message_list = []
+        self._suppressed = 0
+
+    def _start_daemon(self):
+        """ _start_daemon -> Start a private dbus-daemon and point this
+        process and its children at it.
+
+        """
+
+        self._daemon = subprocess.Popen(['dbus-daemon', '--session',
+            '--nofork', '--print-address'], stdout=subprocess.PIPE)
+        address = self._daemon.stdout.readline().strip()
+        if not address:
+            raise RuntimeError("dbus-daemon did not start")
+        os.environ['DBUS_SESSION_BUS_ADDRESS'] = address
+
+        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+        self._bus = dbus.SessionBus()
+
+    def _start_plug(self):
+        """ _start_plug -> Start the plug and connect to it once it is on
+        the bus.
+
+        """
+
+        if self._stub:
+            plug_cmd = [sys.executable, os.path.abspath(__file__),
+                    '--stub-plug', '--transport', self._transport]
+        else:
+            plug_cmd = [sys.executable, os.path.join(self._path, os.pardir,
+                'webbrowser', 'browserplug.py'), 'benchmark',
+                self._transport]
+
+        output = None if self._verbose else open(os.devnull, 'w')
+        self._plug = subprocess.Popen(plug_cmd, stdout=output,
+                stderr=output)
+        pid = self._plug.pid
+
+        plug_name = 'com.browser.plug%d' % pid
+        deadline = time() + START_TIMEOUT
+        while not self._bus.name_has_owner(plug_name):
+            if self._plug.poll() is not None or time() > deadline:
+                raise RuntimeError("plug did not start")
+            sleep(0.05)
+
+        if self._transport == 'socket':
+            while not os.path.exists(socket_path(pid)):
+                if time() > deadline:
+                    raise RuntimeError("plug socket did not appear")
+                sleep(0.05)
+            self._proxy = ipc_bus.get_object(pid)
+            ipc_bus.add_signal_receiver(self._receive_update,
+                    'send_update', pid=pid)
+            ipc_bus.add_signal_receiver(self._receive_print_message_batch,
+                    'print_message_batch', pid=pid)
+        else:
+            self._proxy = dbus.Interface(self._bus.get_object(plug_name,
+                '/bplug%d' % pid), plug_name)
+            self._bus.add_signal_receiver(self._receive_update,
+                    'send_update', dbus_interface='com.browser.tab%d' % pid)
+            self._bus.add_signal_receiver(self._receive_print_message_batch,
+                    'print_message_batch',
+                    dbus_interface='com.browser.main%d' % os.getpid())
+
+        self._proxy.set_socket_id(SOCKET_ID)
+
+    def _stop(self):
+        """ _stop -> Stop the plug and the dbus-daemon, and remove the temp
+        files.
+
+        """
+
+        if self._plug and self._plug.poll() is None:
+            try:
+                self._proxy.exit(SOCKET_ID)
+            except Exception:
+                pass
+            for i in xrange(50):
+                if self._plug.poll() is not None:
+                    break
+                sleep(0.1)
+            else:
+                self._plug.kill()
+            self._plug.wait()
+
+        if self._daemon:
+            self._daemon.terminate()
+            self._daemon.wait()
+
+        shutil.rmtree(self._temp_dir, True)
+
+    def _receive_update(self, progress, hover_uri, can_go_back,
+            can_go_forward, mask, socket_id):
+        """ _receive_update(...) -> Record when a progress update arrives.
+
+        """
+
+        if mask & UPDATE_PROGRESS:
+            self._progress_list.append((time(), progress))
+
+    def _receive_print_message_batch(self, message_list):
+        """ _receive_print_message_batch(message_list) -> Record when the
+        benchmark page's messages arrive.
+
+        """
+
+        now = time()
+        for message, color, data_color in message_list:
+            if 'bench-' in message:
+                self._message_list.append((now, message))
+            else:
+                match = re.search(r'(\d+) console messages suppressed',
+                        message)
+                if match:
+                    self._suppressed += int(match.group(1))
+
+    def _wait(self, check_func, timeout=WAIT_TIMEOUT):
+        """ _wait(check_func, timeout=WAIT_TIMEOUT) -> Run the main loop
+        until check_func returns True or timeout seconds pass.  Returns
+        whether check_func returned True.
+
+        """
+
+        context = glib.main_context_default()
+        wake_id = glib.timeout_add(20, lambda: True)
+        deadline = time() + timeout
+        try:
+            while not check_func():
+                if time() > deadline:
+                    return False
+                context.iteration(True)
+        finally:
+            glib.source_remove(wake_id)
+        return True
+
+    def _time_call(self, method_name, *args):
+        """ _time_call(method_name, *args) -> Call method_name on the plug
+        and return how long the call took, or None if it failed.
+
+        """
+
+        method = getattr(self._proxy, method_name)
+        start = time()
+        try:
+            method(*args)
+        except Exception as err:
+            if self._verbose:
+                print("Error calling %s: %s" % (method_name, err))
+            return None
+        return time() - start
+
+    def _run_loads(self, iterations):
+        """ _run_loads(iterations) -> Load the page iterations times, timing
+        each load_uri call and how long until its load finished.
+
+        """
+
+        call_list = []
+        finish_list = []
+        errors = 0
+        signals = 0
+        start = time()
+
+        for i in xrange(iterations):
+            self._progress_list = []
+            load_start = time()
+            call_time = self._time_call('load_uri', '%s?count=0&load=%d' % \
+                    (self._page_uri, i), SOCKET_ID)
+            if call_time is None:
+                errors += 1
+                continue
+            call_list.append(call_time)
+
+            finished = lambda: any(progress >= 1.0 for stamp, progress in
+                    self._progress_list)
+            if self._wait(finished):
+                finish_list.append(min(stamp for stamp, progress in
+                    self._progress_list if progress >= 1.0) - load_start)
+            else:
+                errors += 1
+            signals += len(self._progress_list)
+
+        elapsed = time() - start
+
+        load_uri = percentiles(call_list)
+        load_uri['errors'] = errors
+        progress = percentiles(finish_list)
+        progress['signals'] = signals
+        progress['signals_per_second'] = signals / elapsed if elapsed else 0
+        return load_uri, progress
+
+    def _run_history(self, iterations):
+        """ _run_history(iterations) -> Time iterations get_history calls.
+
+        """
+
+        call_list = []
+        errors = 0
+        for i in xrange(iterations):
+            call_time = self._time_call('get_history', SOCKET_ID, 2)
+            if call_time is None:
+                errors += 1
+            else:
+                call_list.append(call_time)
+
+        get_history = percentiles(call_list)
+        get_history['errors'] = errors
+        return get_history
+
+    def _run_messages(self, count):
+        """ _run_messages(count) -> Load a page that logs count messages
+        and time how fast they arrive.
+
+        """
+
+        self._message_list = []
+        self._suppressed = 0
+
+        start = time()
+        self._time_call('load_uri', '%s?count=%d' % (self._page_uri, count),
+                SOCKET_ID)
+        complete = self._wait(lambda: len(self._message_list) + \
+                self._suppressed > count)
+        if self._message_list:
+            elapsed = self._message_list[-1][0] - start
+        else:
+            elapsed = time() - start
+
+        received = len(self._message_list)
+        return {
+                'count': count + 1,
+                'received': received,
+                'suppressed': self._suppressed,
+                'complete': complete,
+                'first_ms': (self._message_list[0][0] - start) * 1000 if \
+                        received else None,
+                'seconds': elapsed,
+                'messages_per_second': received / elapsed if elapsed else 0,
+                }
+
+    def run(self, iterations, message_count):
+        """ run(iterations, message_count) -> Run the benchmark and return
+        the results as a dictionary.
+
+        """
+
+        with open(os.path.join(self._temp_dir, 'bench.html'), 'w') as page:
+            page.write(BENCH_PAGE)
+
+        try:
+            self._start_daemon()
+            self._start_plug()
+
+            # Warm the plug up so the first load isn't counted.
+            self._time_call('load_uri', '%s?count=0' % self._page_uri,
+                    SOCKET_ID)
+            self._wait(lambda: self._progress_list and \
+                    self._progress_list[-1][1] >= 1.0)
+
+            load_uri, progress = self._run_loads(iterations)
+            get_history = self._run_history(iterations)
+            print_message = self._run_messages(message_count)
+        finally:
+            self._stop()
+
+        return {
+                'time': time(),
+                'host': platform.node(),
+                'python': platform.python_version(),
+                'transport': self._transport,
+                'view': 'stub' if self._stub else 'webkit',
+                'iterations': iterations,
+                'results': {
+                    'load_uri': load_uri,
+                    'get_history': get_history,
+                    'progress': progress,
+                    'print_message': print_message,
+                    },
+                }
+
+
+def main(args):
+    """ main(args) -> Parse args and run the benchmark.
+
+    """
+
+    opts = OptionParser("usage: %prog [options]")
+    opts.add_option("-n", "--iterations", action="store", type="int",
+            dest="iterations", default=200,
+            help="Number of load_uri and get_history calls")
+    opts.add_option("-m", "--messages", action="store", type="int",
+            dest="messages", default=2000,
+            help="Number of console messages to send")
+    opts.add_option("-t", "--transport", action="store", type="choice",
+            choices=['dbus', 'socket'], dest="transport", default='dbus',
+            help="Plug transport, dbus or socket")
+    opts.add_option("-s", "--stub", action="store_true", dest="stub",
+            default=False, help="Use a stub plug without a browser view")
+    opts.add_option("-o", "--output", action="store", type="string",
+            dest="output", default='', help="Write the results to a file")
+    opts.add_option("-v", "--verbose", action="store_true", dest="verbose",
+            default=False, help="Show the plug's output")
+    opts.add_option("--stub-plug", action="store_true", dest="stub_plug",
+            default=False, help="Run as the stub plug")
+
+    options, args = opts.parse_args(args)
+
+    if options.stub_plug:
+        run_stub_plug(options.transport)
+        return 0
+
+    benchmark = IPCBenchmark(options.transport, options.stub,
+            options.verbose)
+    result_dict = benchmark.run(options.iterations, options.messages)
+
+    result_str = json.dumps(result_dict, indent=4, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            output_file.write(result_str + '\n')
+    else:
+        print(result_str)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
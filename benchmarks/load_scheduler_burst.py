@@ -0,0 +1,196 @@
+#!/usr/bin/env python2
+# This file is part of browser, and contains the load scheduler burst check.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Check that a burst of restored tabs is loaded a few at a time.
+
+Reopening every closed tab or pasting a list of tabs queues a load for each
+of them on the LoadScheduler at once, the same way the main window does.
+The tabs are stand-ins that finish loading after a random delay, so no plug
+or browser view is needed.  The most loads running at once, and how long
+the burst took, are printed, and the exit status is 1 if more than
+--max-loads ran at once or a load never finished.
+
+"""
+
+import os
+import sys
+import random
+from time import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'webbrowser'))
+
+import glib
+
+from load_scheduler import LoadScheduler, MAX_LOADS
+
+# How long to wait for the whole burst to load.
+WAIT_TIMEOUT = 60
+
+
+class BurstTab(object):
+    """ BurstTab -> A tab that finishes loading after a random delay.
+
+    """
+
+    def __init__(self, index):
+        """ BurstTab(index) -> A tab with no handlers yet.
+
+        """
+
+        self.index = index
+
+        # handler id: callback of each 'load-finished' handler.
+        self._handler_dict = {}
+        self._next_id = 1
+
+    def connect(self, signal, callback):
+        """ connect(signal, callback) -> Call callback(tab) when the load
+        finishes.
+
+        """
+
+        handler_id = self._next_id
+        self._next_id += 1
+        self._handler_dict[handler_id] = callback
+        return handler_id
+
+    def disconnect(self, handler_id):
+        """ disconnect(handler_id) -> Forget a handler.
+
+        """
+
+        self._handler_dict.pop(handler_id, None)
+
+    def finish(self):
+        """ finish -> Tell the handlers the load has finished.
+
+        """
+
+        for callback in self._handler_dict.values():
+            callback(self)
+        return False
+
+
+class Burst(object):
+    """ Burst -> Queue count loads and record how many run at once.
+
+    """
+
+    def __init__(self, count, max_loads, min_ms, max_ms):
+        """ Burst(count, max_loads, min_ms, max_ms) -> A burst of count loads
+        that take between min_ms and max_ms each.
+
+        """
+
+        self._count = count
+        self._min_ms = min_ms
+        self._max_ms = max_ms
+        self._scheduler = LoadScheduler(lambda: False, max_loads)
+
+        self.running = 0
+        self.max_running = 0
+        self.started = 0
+        self.finished = 0
+        self.duration = 0.0
+
+    def run(self, main_loop):
+        """ run(main_loop) -> Queue the burst, and quit main_loop when every
+        load has finished.
+
+        """
+
+        self._main_loop = main_loop
+        self._start_time = time()
+        for index in xrange(self._count):
+            tab = BurstTab(index)
+            self._scheduler.add(tab, self._get_start_func(tab))
+        return False
+
+    def _get_start_func(self, tab):
+        """ _get_start_func(tab) -> Return the start_func the scheduler
+        calls to start the load of tab, like the main window's start_load.
+
+        """
+
+        def start_load(wait):
+            self.started += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            glib.timeout_add(random.randint(self._min_ms, self._max_ms),
+                    self._finish_load, tab)
+            return True
+
+        return start_load
+
+    def _finish_load(self, tab):
+        """ _finish_load(tab) -> Finish the load of tab, and quit when it
+        was the last.
+
+        """
+
+        self.running -= 1
+        self.finished += 1
+        tab.finish()
+        if self.finished == self._count:
+            self.duration = time() - self._start_time
+            self._main_loop.quit()
+        return False
+
+
+def main():
+    """ Run the burst and check it.
+
+    """
+
+    opts = OptionParser("usage: %prog [options]")
+    opts.add_option("-n", "--tabs", action="store", type="int", dest="tabs",
+            default=40, help="How many tabs to restore at once")
+    opts.add_option("-m", "--max-loads", action="store", type="int",
+            dest="max_loads", default=MAX_LOADS,
+            help="How many loads the scheduler runs at once")
+    opts.add_option("--min-ms", action="store", type="int", dest="min_ms",
+            default=5, help="Shortest load in milliseconds")
+    opts.add_option("--max-ms", action="store", type="int", dest="max_ms",
+            default=50, help="Longest load in milliseconds")
+    options, args = opts.parse_args()
+
+    main_loop = glib.MainLoop()
+    burst = Burst(options.tabs, options.max_loads, options.min_ms,
+            options.max_ms)
+    glib.idle_add(burst.run, main_loop)
+    glib.timeout_add_seconds(WAIT_TIMEOUT, main_loop.quit)
+    main_loop.run()
+
+    print("%d tabs, %d started, %d finished, at most %d loading at once "
+            "(limit %d), %.2f s" % (options.tabs, burst.started,
+                burst.finished, burst.max_running, options.max_loads,
+                burst.duration))
+
+    if burst.max_running > options.max_loads:
+        print("FAIL: more than %d loads ran at once" % options.max_loads)
+        return 1
+    if burst.finished != options.tabs:
+        print("FAIL: %d loads never finished" % \
+                (options.tabs - burst.finished))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
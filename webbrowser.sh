@@ -26,4 +26,4 @@ then
     cp $DOC_PATH/{block.uri,movie.uri} $CONFIG_PATH
 fi
 
-exec $PYTHON $BROWSER_PATH/browser.py "$@"
+exec $PYTHON $BROWSER_PATH/launcher.py "$@"
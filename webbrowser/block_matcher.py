@@ -0,0 +1,755 @@
+# This file is part of browser, and contains an indexed uri rule matcher.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" An indexed matcher for block lists.
+
+Each rule in a block list is a case insensitive regular expression that is
+searched for anywhere in a uri.  Instead of joining all the rules into one
+big alternation the rules are split into three groups:
+
+    host rules      Lines of the form '||example.com' block that host and
+                    all of its sub-domains.  They are kept in a set and
+                    checked by walking the labels of the uri's host.
+    literal rules   Rules that are plain strings (after removing escapes)
+                    are found with one pass of an Aho-Corasick automaton.
+                    Regular expressions that contain a literal run of at
+                    least MIN_GUARD_LENGTH characters are only run when the
+                    automaton finds that run in the uri.
+    regex rules     Whatever is left is joined into one small alternation.
+
+A uri is blocked if any rule matches, which is the same verdict the old
+'(rule1|rule2|...)' pattern gave.
+
+"""
+
+import os
+import re
+import mmap
+import zlib
+import fcntl
+import struct
+import sre_parse
+import sre_constants
+
+# Shortest literal run that is used to guard a regular expression.
+MIN_GUARD_LENGTH = 3
+
+# Prefix used for host rules in block lists.
+HOST_PREFIX = '||'
+
+
+def read_rules(filename):
+    """ read_rules(filename) -> Return a list of the rules in filename
+    skipping blank lines and comments.
+
+    """
+
+    rule_list = []
+    with open(filename, 'r') as rule_file:
+        for line in rule_file.readlines():
+            if line[0] != '#' and line.strip():
+                rule_list.append(line.strip())
+
+    return rule_list
+
+
+def split_host(uri):
+    """ split_host(uri) -> Return the lowercase host part of uri or an
+    empty string if it doesn't have one.
+
+    """
+
+    start = uri.find('://')
+    if start == -1:
+        return ''
+    start += 3
+    end = len(uri)
+    for char in '/?#':
+        index = uri.find(char, start)
+        if index != -1 and index < end:
+            end = index
+    host = uri[start:end]
+    host = host[host.rfind('@') + 1:]
+    if host.startswith('['):
+        # IPv6 address.
+        return host[:host.find(']') + 1].lower()
+    return host.split(':', 1)[0].lower()
+
+
+def classify_rule(rule):
+    """ classify_rule(rule) -> Return a tuple (kind, literal) describing
+    how rule can be matched.  Kind is one of 'host', 'literal', 'guarded'
+    or 'regex' and literal is the host, the literal string, or the literal
+    run guarding the regex.  Raises re.error if rule is not valid.
+
+    """
+
+    if rule.startswith(HOST_PREFIX):
+        return ('host', rule[len(HOST_PREFIX):].strip('.').lower())
+
+    parsed = sre_parse.parse(rule, re.I)
+
+    to_char = unichr if isinstance(rule, unicode) else chr
+
+    literal_runs = [[]]
+    for op, value in parsed:
+        if op == sre_constants.LITERAL:
+            literal_runs[-1].append(to_char(value))
+        else:
+            literal_runs.append([])
+
+    if len(literal_runs) == 1:
+        return ('literal', ''.join(literal_runs[0]).lower())
+
+    longest = max(literal_runs, key=len)
+    if len(longest) >= MIN_GUARD_LENGTH:
+        return ('guarded', ''.join(longest).lower())
+
+    return ('regex', '')
+
+
+class LiteralAutomaton(object):
+    """ LiteralAutomaton -> An Aho-Corasick automaton that finds every
+    literal from a set in one pass over a string.
+
+    """
+
+    def __init__(self, literal_list=()):
+        """ LiteralAutomaton(literal_list) -> Build an automaton that finds
+        the literals in literal_list.
+
+        """
+
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+
+        for literal in literal_list:
+            self.add(literal)
+        self.build()
+
+    def __len__(self):
+        """ Return the number of states.
+
+        """
+
+        return len(self._goto)
+
+    def add(self, literal):
+        """ add(literal) -> Add literal to the automaton.  build has to be
+        called after all the literals have been added.
+
+        """
+
+        if not literal:
+            return
+
+        state = 0
+        for char in literal:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[state][char] = next_state
+            state = next_state
+        if literal not in self._out[state]:
+            self._out[state] += (literal,)
+
+    def build(self):
+        """ build -> Compute the failure links breadth first.
+
+        """
+
+        queue = list(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        index = 0
+        while index < len(queue):
+            state = queue[index]
+            index += 1
+            for char, next_state in self._goto[state].iteritems():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                if fail == next_state:
+                    fail = 0
+                self._fail[next_state] = fail
+                self._out[next_state] += self._out[fail]
+
+    def iter_matches(self, text):
+        """ iter_matches(text) -> Yield each literal found in text as soon
+        as it is found.
+
+        """
+
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                for literal in out[state]:
+                    yield literal
+
+
+class BlockMatcher(object):
+    """ BlockMatcher -> Match uris against a list of block rules.
+
+    """
+
+    def __init__(self, rule_list=()):
+        """ BlockMatcher(rule_list) -> Index the rules in rule_list.
+        Rules that are not valid regular expressions are skipped and
+        listed in the errors attribute.
+
+        """
+
+        self.errors = []
+
+        self._hosts = {}
+        self._literals = {}
+        self._guarded = {}
+        regex_list = []
+
+        for rule in rule_list:
+            try:
+                kind, literal = classify_rule(rule)
+                if kind in ('guarded', 'regex'):
+                    compiled = re.compile(rule, re.I)
+            except (re.error, sre_constants.error, OverflowError) as err:
+                self.errors.append((rule, str(err)))
+                continue
+
+            if kind == 'host':
+                self._hosts.setdefault(literal, rule)
+            elif kind == 'literal':
+                self._literals.setdefault(literal, rule)
+            elif kind == 'guarded':
+                self._guarded.setdefault(literal, []).append((compiled, rule))
+            else:
+                regex_list.append(rule)
+
+        literal_set = set(self._literals)
+        literal_set.update(self._guarded)
+        self._automaton = LiteralAutomaton(literal_set)
+
+        self._regex_list = regex_list
+        if regex_list:
+            self._regex = re.compile('|'.join(['(?:%s)' % i \
+                    for i in regex_list]), re.I)
+        else:
+            self._regex = None
+
+    def __len__(self):
+        """ Return the number of rules that were indexed.
+
+        """
+
+        return len(self._hosts) + len(self._literals) + \
+                sum([len(i) for i in self._guarded.itervalues()]) + \
+                len(self._regex_list)
+
+    def get_counts(self):
+        """ get_counts -> Return a dictionary with the number of rules in
+        each group.
+
+        """
+
+        return {
+                'host': len(self._hosts),
+                'literal': len(self._literals),
+                'guarded': sum([len(i) for i in self._guarded.itervalues()]),
+                'regex': len(self._regex_list),
+                }
+
+    def search(self, uri):
+        """ search(uri) -> Return the first rule that matches uri or None.
+
+        """
+
+        if self._hosts:
+            host = split_host(uri)
+            while host:
+                rule = self._hosts.get(host)
+                if rule:
+                    return rule
+                host = host.partition('.')[2]
+
+        checked = set()
+        for literal in self._automaton.iter_matches(uri.lower()):
+            rule = self._literals.get(literal)
+            if rule:
+                return rule
+            if literal in checked:
+                continue
+            checked.add(literal)
+            for compiled, rule in self._guarded.get(literal, ()):
+                if compiled.search(uri):
+                    return rule
+
+        if self._regex:
+            match = self._regex.search(uri)
+            if match:
+                for rule in self._regex_list:
+                    if re.search(rule, uri, re.I):
+                        return rule
+                return match.group()
+
+        return None
+
+
+# Binary index layout.  Every number is little endian and every string is
+# an (offset, length) pair into the string table at the end of the file.
+INDEX_MAGIC = 'WBBLKIDX'
+INDEX_VERSION = 1
+
+# magic, version, source size, source mtime, rule count, then the count and
+# offset of each table: states, edge chars, edge targets, outputs, literals,
+# guards, host slots, regex rules, strings.
+_HEADER = struct.Struct('<8sIQdI' + 'II' * 9)
+
+# fail state, first edge, edge count, first output, output count
+_STATE = struct.Struct('<IIIII')
+
+# rule string offset and length (0 for guard only literals), first guard,
+# guard count
+_LITERAL = struct.Struct('<IIII')
+
+# hash, host string offset and length
+_HOST = struct.Struct('<III')
+
+_STRING = struct.Struct('<II')
+_UINT = struct.Struct('<I')
+
+
+def _host_hash(host):
+    """ _host_hash(host) -> Return the unsigned crc32 of host.
+
+    """
+
+    return zlib.crc32(host) & 0xffffffff
+
+
+class _StringTable(object):
+    """ _StringTable -> Collect strings for the index string table.
+
+    """
+
+    def __init__(self):
+        """ Create an empty string table.
+
+        """
+
+        self._offset = 0
+        self._string_list = []
+        self._string_dict = {}
+
+    def add(self, string):
+        """ add(string) -> Add string and return its (offset, length).
+
+        """
+
+        if isinstance(string, unicode):
+            string = string.encode('utf-8')
+        if string not in self._string_dict:
+            self._string_dict[string] = (self._offset, len(string))
+            self._string_list.append(string)
+            self._offset += len(string)
+        return self._string_dict[string]
+
+    def dumps(self):
+        """ dumps -> Return the string table as one string.
+
+        """
+
+        return ''.join(self._string_list)
+
+
+def write_index(matcher, filename, source_filename):
+    """ write_index(matcher, filename, source_filename) -> Write the rules
+    indexed by matcher to filename.  The size and mtime of source_filename
+    are stored so a stale index can be detected.
+
+    """
+
+    strings = _StringTable()
+
+    literal_list = sorted(set(matcher._literals) | set(matcher._guarded))
+    literal_id = dict([(literal, i) for i, literal in \
+            enumerate(literal_list)])
+
+    # Flatten the automaton.
+    automaton = matcher._automaton
+    state_data = []
+    edge_chars = []
+    edge_targets = []
+    out_list = []
+    for state, goto in enumerate(automaton._goto):
+        edge_list = sorted(goto.iteritems())
+        out = [literal_id[i] for i in automaton._out[state]]
+        state_data.append(_STATE.pack(automaton._fail[state], 
+            len(edge_chars), len(edge_list), len(out_list), len(out)))
+        for char, target in edge_list:
+            edge_chars.append(char)
+            edge_targets.append(_UINT.pack(target))
+        out_list.extend([_UINT.pack(i) for i in out])
+
+    literal_data = []
+    guard_data = []
+    for literal in literal_list:
+        if literal in matcher._literals:
+            offset, length = strings.add(matcher._literals[literal])
+        else:
+            offset, length = (0, 0)
+        guard_list = matcher._guarded.get(literal, ())
+        literal_data.append(_LITERAL.pack(offset, length, len(guard_data), 
+            len(guard_list)))
+        for compiled, rule in guard_list:
+            guard_data.append(_STRING.pack(*strings.add(rule)))
+
+    # Open addressed hash table of host rules at most half full.
+    slot_count = 1
+    while slot_count < len(matcher._hosts) * 2:
+        slot_count *= 2
+    slot_list = [None] * slot_count
+    for host in matcher._hosts:
+        slot = _host_hash(host) & (slot_count - 1)
+        while slot_list[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slot_list[slot] = _HOST.pack(_host_hash(host), *strings.add(host))
+    host_data = [i or _HOST.pack(0, 0, 0) for i in slot_list]
+
+    regex_data = [_STRING.pack(*strings.add(i)) for i in matcher._regex_list]
+
+    table_list = [
+            (len(state_data), ''.join(state_data)),
+            (len(edge_chars), ''.join(edge_chars)),
+            (len(edge_targets), ''.join(edge_targets)),
+            (len(out_list), ''.join(out_list)),
+            (len(literal_data), ''.join(literal_data)),
+            (len(guard_data), ''.join(guard_data)),
+            (len(host_data), ''.join(host_data)),
+            (len(regex_data), ''.join(regex_data)),
+            ]
+    string_data = strings.dumps()
+    table_list.append((len(string_data), string_data))
+
+    header_list = []
+    offset = _HEADER.size
+    for count, data in table_list:
+        header_list.extend((count, offset))
+        offset += len(data)
+
+    source_stat = os.stat(source_filename)
+    header = _HEADER.pack(INDEX_MAGIC, INDEX_VERSION, source_stat.st_size, 
+            source_stat.st_mtime, len(matcher), *header_list)
+
+    # Write to a temporary file and rename it so readers never see a
+    # partial index.
+    temp_filename = '%s.%d' % (filename, os.getpid())
+    with open(temp_filename, 'wb') as index_file:
+        index_file.write(header)
+        for count, data in table_list:
+            index_file.write(data)
+    os.rename(temp_filename, filename)
+
+
+def index_is_current(filename, source_filename):
+    """ index_is_current(filename, source_filename) -> Return True if the
+    index in filename was built from the current source_filename.
+
+    """
+
+    try:
+        source_stat = os.stat(source_filename)
+        with open(filename, 'rb') as index_file:
+            header = _HEADER.unpack(index_file.read(_HEADER.size))
+    except (OSError, IOError, struct.error):
+        return False
+
+    return header[:4] == (INDEX_MAGIC, INDEX_VERSION, source_stat.st_size, 
+            source_stat.st_mtime)
+
+
+def update_index(rule_filename, index_filename):
+    """ update_index(rule_filename, index_filename) -> Rebuild the index
+    if rule_filename has changed since it was built.  Returns a list of
+    (rule, error) tuples for rules that were skipped, or an empty list if
+    the index was already current.
+
+    """
+
+    if index_is_current(index_filename, rule_filename):
+        return []
+
+    # Only let one process build the index.  Any others wait here and
+    # then find it current.
+    with open('%s.lock' % index_filename, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if index_is_current(index_filename, rule_filename):
+                return []
+            matcher = BlockMatcher(read_rules(rule_filename))
+            write_index(matcher, index_filename, rule_filename)
+            return matcher.errors
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class MappedBlockMatcher(object):
+    """ MappedBlockMatcher -> Match uris against a block rule index that is
+    memory mapped read-only, so every process shares one copy of it.
+
+    """
+
+    def __init__(self, filename):
+        """ MappedBlockMatcher(filename) -> Map the index in filename.
+        Raises ValueError if it is not a valid index.
+
+        """
+
+        self.errors = []
+        self.filename = filename
+
+        with open(filename, 'rb') as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0, 
+                    access=mmap.ACCESS_READ)
+
+        if len(self._map) < _HEADER.size:
+            raise ValueError("%s is not a block index" % filename)
+
+        header = _HEADER.unpack_from(self._map, 0)
+        if header[:2] != (INDEX_MAGIC, INDEX_VERSION):
+            raise ValueError("%s is not a block index" % filename)
+
+        self.source_size, self.source_mtime, self._rule_count = header[2:5]
+        (self._state_count, self._states, self._edge_count, self._edges, 
+                self._target_count, self._targets, self._out_count, 
+                self._outs, self._literal_count, self._literals, 
+                self._guard_count, self._guards, self._host_count, 
+                self._hosts, self._regex_count, self._regexes, 
+                self._string_size, self._strings) = header[5:]
+
+        # Transitions from the root state are used for almost every
+        # character so keep them in a dictionary.
+        fail, first, count, out, out_count = self._state(0)
+        self._root = {}
+        for i in xrange(first, first + count):
+            self._root[self._map[self._edges + i]] = _UINT.unpack_from(
+                    self._map, self._targets + i * _UINT.size)[0]
+
+        self._compiled = {}
+
+        regex_list = [self._string(self._regexes + i * _STRING.size) \
+                for i in xrange(self._regex_count)]
+        self._regex_list = regex_list
+        if regex_list:
+            self._regex = re.compile('|'.join(['(?:%s)' % i \
+                    for i in regex_list]), re.I)
+        else:
+            self._regex = None
+
+    def __len__(self):
+        """ Return the number of rules that were indexed.
+
+        """
+
+        return self._rule_count
+
+    def close(self):
+        """ close -> Unmap the index.
+
+        """
+
+        self._map.close()
+
+    def is_current(self, source_filename):
+        """ is_current(source_filename) -> Return True if the mapped index
+        was built from the current source_filename.
+
+        """
+
+        try:
+            source_stat = os.stat(source_filename)
+        except OSError:
+            return False
+
+        return (self.source_size, self.source_mtime) == \
+                (source_stat.st_size, source_stat.st_mtime)
+
+    def _state(self, state):
+        """ _state(state) -> Return the record of state.
+
+        """
+
+        return _STATE.unpack_from(self._map, self._states + \
+                state * _STATE.size)
+
+    def _string(self, position):
+        """ _string(position) -> Return the string referenced by the
+        (offset, length) pair at position.
+
+        """
+
+        offset, length = _STRING.unpack_from(self._map, position)
+        offset += self._strings
+        return self._map[offset:offset + length]
+
+    def _find_host(self, host):
+        """ _find_host(host) -> Return True if host is a host rule.
+
+        """
+
+        host_hash = _host_hash(host)
+        mask = self._host_count - 1
+        slot = host_hash & mask
+        while True:
+            slot_hash, offset, length = _HOST.unpack_from(self._map, 
+                    self._hosts + slot * _HOST.size)
+            if not length:
+                return False
+            if slot_hash == host_hash:
+                offset += self._strings
+                if self._map[offset:offset + length] == host:
+                    return True
+            slot = (slot + 1) & mask
+
+    def _iter_literals(self, text):
+        """ _iter_literals(text) -> Yield the id of each literal found in
+        text.
+
+        """
+
+        mapped = self._map
+        find = mapped.find
+        unpack_state = _STATE.unpack_from
+        unpack_uint = _UINT.unpack_from
+        state_size = _STATE.size
+        uint_size = _UINT.size
+        states = self._states
+        edges = self._edges
+        targets = self._targets - edges * uint_size
+        root = self._root
+        state = 0
+        record = None
+        for char in text:
+            while state:
+                start = edges + record[1]
+                index = find(char, start, start + record[2])
+                if index != -1:
+                    state = unpack_uint(mapped, 
+                            targets + index * uint_size)[0]
+                    break
+                state = record[0]
+                if state:
+                    record = unpack_state(mapped, 
+                            states + state * state_size)
+            else:
+                state = root.get(char, 0)
+            if state:
+                record = unpack_state(mapped, states + state * state_size)
+                if record[4]:
+                    for literal in struct.unpack_from('<%dI' % record[4], 
+                            mapped, self._outs + record[3] * _UINT.size):
+                        yield literal
+
+    def search(self, uri):
+        """ search(uri) -> Return the first rule that matches uri or None.
+
+        """
+
+        if isinstance(uri, unicode):
+            uri = uri.encode('utf-8')
+
+        if self._host_count > 1:
+            host = split_host(uri)
+            while host:
+                if self._find_host(host):
+                    return '%s%s' % (HOST_PREFIX, host)
+                host = host.partition('.')[2]
+
+        checked = set()
+        for literal in self._iter_literals(uri.lower()):
+            if literal in checked:
+                continue
+            checked.add(literal)
+            offset, length, first, count = _LITERAL.unpack_from(self._map, 
+                    self._literals + literal * _LITERAL.size)
+            if length:
+                offset += self._strings
+                return self._map[offset:offset + length]
+            for guard in xrange(first, first + count):
+                compiled = self._compiled.get(guard)
+                if not compiled:
+                    rule = self._string(self._guards + guard * _STRING.size)
+                    compiled = self._compiled[guard] = re.compile(rule, re.I)
+                if compiled.search(uri):
+                    return compiled.pattern
+
+        if self._regex:
+            match = self._regex.search(uri)
+            if match:
+                for rule in self._regex_list:
+                    if re.search(rule, uri, re.I):
+                        return rule
+                return match.group()
+
+        return None
+
+
+# Matchers already mapped in this process keyed by index filename.
+_matcher_dict = {}
+
+
+def load_matcher(rule_filename, index_filename, log_func=None):
+    """ load_matcher(rule_filename, index_filename, log_func=None) ->
+    Return a matcher for the rules in rule_filename using the index in
+    index_filename, rebuilding it first if the rules have changed.  The
+    mapped index is shared by every caller in this process.  Skipped rules
+    are passed to log_func.
+
+    """
+
+    matcher = _matcher_dict.get(index_filename)
+    if matcher and matcher.is_current(rule_filename):
+        return matcher
+
+    try:
+        errors = update_index(rule_filename, index_filename)
+        matcher = MappedBlockMatcher(index_filename)
+    except (OSError, IOError, ValueError, mmap.error) as err:
+        # Fall back to an in memory matcher if the index can't be used.
+        if log_func:
+            log_func("Unable to use block index %s: %s" % \
+                    (index_filename, err))
+        matcher = BlockMatcher(read_rules(rule_filename))
+        errors = matcher.errors
+    else:
+        _matcher_dict[index_filename] = matcher
+
+    if log_func:
+        for rule, err in errors:
+            log_func("Skipping bad block rule %s: %s" % (rule, err))
+
+    return matcher
@@ -26,11 +26,13 @@ share on external application, or they can each be separate applications.
 
 import os
 import sys
+import signal
 import json
 import subprocess
-from optparse import OptionParser
+from time import time
 
 import gtk
+import glib
 import dbus
 import dbus.service
 import dbus.mainloop.glib
@@ -40,8 +42,43 @@ from browser_classes import BrowserBase, ProfileManager, MSGCOLOR
 from browser_dbus import BrowserSock
 from browser_dbus import BrowserReceiver
 from browser_nodbus import BrowserTab
+from log_levels import log_registry
+from plug_ipc import ipc_bus
+from plug_pool import PlugPool, POOL_SIZE
+from plug_zygote import PlugZygote
+from process_policy import ProcessPolicy, PROCESS_COUNT, MEMORY_LIMIT
+from process_policy import history_uri, history_item, get_rss
+from plug_freezer import PlugFreezer, METHOD_AUTO
+from plug_supervisor import PlugSupervisor
+from load_scheduler import LoadScheduler, MAX_LOADS
+from plug_monitor import PlugMonitor, SAMPLE_INTERVAL, ACTION_WARN
+from plug_monitor import ACTION_DISCARD, ACTION_RESTART, get_age
+from startup_profile import startup_profile, summary_list, monotonic
+from launcher import get_options
 from defaults import APP_NAME, MAIN_INTERFACE_NAME
 
+startup_profile.mark('imports')
+
+# How often, in seconds, to look for tabs to discard.
+DISCARD_INTERVAL = 60
+
+# How often, in seconds, to look for plugs to freeze.
+FREEZE_INTERVAL = 10
+
+# Seconds a restarted plug has to exit before it is killed.
+RESTART_KILL_DELAY = 5
+
+# How often, in seconds, to look for plugs to recycle.
+RECYCLE_INTERVAL = 60
+
+# Milliseconds to wait after the last tab is restored before loading the
+# most recent ones.
+RESTORE_SETTLE_DELAY = 500
+
+# Seconds to wait after the first paint for the plug to send its startup
+# phases.
+PLUG_PHASE_WAIT = 2
+
 class Browser(BrowserBase):
     """ Main browser handles starting and exiting and opening and closing
     tabs.  It also handles the downloads, debug terminal, and bookmarks.
@@ -51,6 +88,12 @@ class Browser(BrowserBase):
     # Make a global of the dbus interface name used to open new tabs
     INTERFACE = "com.browser.main%d"
 
+    # The zygote that forks plugs for every window.
+    plug_zygote = None
+
+    # The scheduler that starts the background loads of every window.
+    load_scheduler = None
+
     def __init__(self, bus=None, uri=None, profile='default', width=1213, 
             height=628):
         """ Browser(bus=None, uri=None, profile='default', width=1213, 
@@ -63,12 +106,29 @@ class Browser(BrowserBase):
         super(Browser, self).__init__(uri=uri, profile=profile, width=width, 
                 height=height)
 
+        # Talk to the plugs over dbus or a unix socket.
+        BrowserSock.transport = self._config.get_setting('plug-transport', 
+                'dbus')
+
+        # Watch the plugs start, and restart the ones that crash.
+        self._plug_supervisor = PlugSupervisor(self._plug_timed_out)
+
+        # oldpid: the tabs of a crashed plug waiting to be restarted.
+        self._restart_dict = {}
+
+        # Crashed tabs that are not restarted until their uri is out of
+        # quarantine.
+        self._quarantine_list = []
+
         # Connect the dbus receiver to allow opening new tabs from external
         # tabs.
         if bus:
             self._receiver = BrowserReceiver(bus, '/main_browser%s' % id(self))
             self._receiver.connect('get-socket-id', self._get_socket_id)
 
+            # Send log level changes to the plugs.
+            log_registry.add_callback(self._receiver.log_levels_changed)
+
             # Connect dbus to bus.
             self._connect_dbus(bus)
             self._bus = bus
@@ -78,10 +138,6 @@ class Browser(BrowserBase):
         self._proxy = os.environ.get('http_proxy', '')
         os.environ['http_proxy'] = ''
 
-        # This dictionary is used to keep track of which tabs have died
-        # so it can restart connected tabs properly.
-        self._died_dict = {}
-
         # A dictionary to match closed pids with their replacement pid.
         self._closed_pid_dict = {}
 
@@ -101,10 +157,101 @@ class Browser(BrowserBase):
                 #stdout=subprocess.PIPE).communicate()[0].strip()
         self._pyexec = sys.executable
 
+        # Decide which process each new external tab goes in.
+        self._process_policy = ProcessPolicy(
+                self._config.get_setting('process-policy', 'per-tab'),
+                self._config.get_setting('process-count', PROCESS_COUNT),
+                self._config.get_setting('process-memory-limit', 
+                    MEMORY_LIMIT))
+
+        # Discard external tabs that have not been used for a while.  The
+        # idle time is in minutes, and 0 turns discarding off.
+        self._discard_time = self._config.get_setting('discard-idle-time', 
+                0) * 60
+        self._discard_states = self._config.get_setting('discard-tab-states',
+                'MH')
+        self._reclaimed = 0
+        self._discard_id = None
+        if self._discard_time > 0:
+            self._discard_id = glib.timeout_add_seconds(DISCARD_INTERVAL, 
+                    self._check_discard, priority=glib.PRIORITY_LOW)
+
+        # Freeze plugs whose tabs have all been in the background for the
+        # freeze grace time.
+        self._plug_freezer = None
+        self._freeze_id = None
+        self._hidden_time = 0
+        if self._config.get_setting('freeze-plugs', False):
+            self._plug_freezer = PlugFreezer(
+                    self._config.get_setting('freeze-method', METHOD_AUTO))
+            self._freeze_time = self._config.get_setting('freeze-grace-time',
+                    60)
+            self._freeze_id = glib.timeout_add_seconds(FREEZE_INTERVAL, 
+                    self._check_freeze, priority=glib.PRIORITY_LOW)
+            self._window.connect('window-state-event', 
+                    self._window_state_changed)
+
+        # Watch the memory and cpu used by each plug.  The rss limit is in
+        # megabytes and the cpu limit in percent of a cpu, and 0 turns a
+        # limit off.  An interval of 0 turns the monitor off.
+        self._plug_monitor = None
+        self._monitor_id = None
+        monitor_interval = self._config.get_setting('monitor-interval', 
+                SAMPLE_INTERVAL)
+        if monitor_interval > 0:
+            self._plug_monitor = PlugMonitor(
+                    self._config.get_setting('monitor-rss-limit', 0),
+                    self._config.get_setting('monitor-cpu-limit', 0),
+                    self._config.get_setting('monitor-action', ACTION_WARN))
+            self._monitor_id = glib.timeout_add_seconds(monitor_interval, 
+                    self._check_usage, priority=glib.PRIORITY_LOW)
+
+        # Restore external tabs as placeholders that load when they are
+        # first selected, except for the restore load count most recently
+        # restored ones.
+        self._lazy_restore = self._config.get_setting('lazy-restore', True)
+        self._restore_load_count = self._config.get_setting(
+                'restore-load-count', 0)
+        self._placeholder_list = []
+        self._placeholder_id = None
+
+        # Load background tabs a few at a time.
+        if not Browser.load_scheduler:
+            Browser.load_scheduler = LoadScheduler(foreground_loading, 
+                    self._config.get_setting('max-background-loads', 
+                        MAX_LOADS))
+
+        # Move the tabs of plugs that have grown too big, or run too long,
+        # into new plugs.  The rss limit is in megabytes and the age in
+        # minutes, and 0 turns a limit off.
+        self._recycle_rss = self._config.get_setting('recycle-rss-limit', 
+                0) * 1024 * 1024
+        self._recycle_age = self._config.get_setting('recycle-age', 0) * 60
+        self._recycle_id = None
+        if self._recycle_rss > 0 or self._recycle_age > 0:
+            self._recycle_id = glib.timeout_add_seconds(RECYCLE_INTERVAL, 
+                    self._check_recycle, priority=glib.PRIORITY_LOW)
+
+        # Fork plugs from a zygote that has already imported the modules
+        # that don't use gtk.
+        if not Browser.plug_zygote and \
+                self._config.get_setting('plug-zygote', True):
+            Browser.plug_zygote = PlugZygote(self._pyexec, self._path)
+            Browser.plug_zygote.start()
+
+        # Keep plugs started and waiting so new external tabs open faster.
+        self._plug_pool = None
+        if bus:
+            self._plug_pool = PlugPool(bus, self._start_plug,
+                    self._config.get_setting('plug-pool-size', POOL_SIZE))
+            self._plug_pool.start()
+
         if uri:
             # Open a tab if there was a uri given.
             self.do_open_tab(uri=uri)
 
+        startup_profile.mark('browser-init')
+
         #self._window.set_colormap(self._window.get_screen().get_rgba_colormap())
     
     def _connect_dbus(self, bus, disconnect=False):
@@ -116,6 +263,9 @@ class Browser(BrowserBase):
 
         bus_receiver_dict = {
                 'print_message_signal': self._receive_print_message,
+                'print_message_batch': self._receive_print_message_batch,
+                'plug_ready': self._plug_supervisor.plug_ready,
+                'startup_phases': self._receive_startup_phases,
                 }
 
         for signal_name, handler_func in bus_receiver_dict.iteritems():
@@ -124,27 +274,17 @@ class Browser(BrowserBase):
                         dbus_interface=Browser.INTERFACE % os.getpid(), 
                         signal_name=signal_name,
                         path='/bplug_sender%s' % id(self))
+                ipc_bus.remove_signal_receiver(handler_func, signal_name, 
+                        path='/main_browser%s' % id(self))
             else:
                 bus.add_signal_receiver(handler_func, 
                         dbus_interface=Browser.INTERFACE % os.getpid(), 
                         signal_name=signal_name,
                         path='/bplug_sender%s' % id(self))
 
-    def _clean_died_dict(self, pid):
-        """ _clean_died_dict(pid) -> Clean the dictionary of dead tabs of
-        tab pid.  If a tab dies its old and new pids are stored in the 
-        died_dict.  This function cleans already restarted tabs out of
-        that dictionary.
-
-        """
-
-        if pid in self._died_dict.values():
-            # The pid has died.
-            for oldpid, newpid in self._died_dict.iteritems():
-                if pid == newpid:
-                    # When pid == newpid than oldpid should be removed
-                    self._died_dict.pop(oldpid)
-                    break
+                # Plugs connected by socket send their messages that way.
+                ipc_bus.add_signal_receiver(handler_func, signal_name, 
+                        path='/main_browser%s' % id(self))
 
     def _receive_print_message(self, message, color, data_color):
         """ _receive_print_message(message, color, data_color) -> Log message
@@ -156,6 +296,34 @@ class Browser(BrowserBase):
 
         self.print_message(message, color, data_color)
 
+    def _receive_print_message_batch(self, message_list):
+        """ _receive_print_message_batch(message_list) -> Log each
+        (message, color, data_color) in message_list to the debug console.
+
+        """
+
+        for message, color, data_color in message_list:
+            self.print_message(message, color, data_color)
+
+    def _receive_startup_phases(self, pid, phases_str):
+        """ _receive_startup_phases(pid, phases_str) -> Add the startup
+        phases plug pid sent as a json list of [name, seconds] to the startup
+        profile.
+
+        """
+
+        try:
+            phase_list = json.loads(phases_str)
+        except ValueError as err:
+            self.print_message("main: bad startup phases from plug %d: %s" % \
+                    (pid, err), MSGCOLOR, '38;5;96')
+            return
+
+        self.print_message("main: plug %d started in %.0f ms" % (pid, 
+            sum(seconds for name, seconds in phase_list if not 
+                name.startswith('task ')) * 1000), MSGCOLOR)
+        startup_profile.add_plug(phase_list)
+
     def _get_socket_id(self, receiver, pid):
         """ _get_socket_id(receiver, pid) -> Open a new tab for the external 
         tab with a pid of 'pid'.  This function returns the socket id of the 
@@ -169,24 +337,116 @@ class Browser(BrowserBase):
             
     def _browser_plug_died(self, browsebox, oldpid):
         """ _browser_plug_died(browsebox, oldpid) -> When an external tab's
-        browser dies this function is called to start a new one.  The old
-        pid is associated with the new pid in the died_dict so any tabs that
-        share the same pid can be restarted properly.
+        browser dies its tab is restarted, with the other tabs of the same
+        plug, after the supervisor's restart delay.  Tabs showing a
+        quarantined uri are left until it is out of quarantine.
+
+        """
+
+        if self._plug_freezer:
+            self._plug_freezer.forget(oldpid)
+
+        # The tabs that still have the pid were all in the plug.
+        uri = browsebox.get_uri()
+        self._plug_supervisor.add_crash(oldpid, [tab.get_uri() for tab in
+            self._browser_book.get_children() if type(tab) == BrowserSock 
+            and not tab.is_discarded() and tab.get_pid() == oldpid])
+        if self._plug_supervisor.is_quarantined(uri):
+            self._quarantine_list.append(browsebox)
+            self._browser_book.set_tab_text(browsebox, '%s (crashed)' % \
+                    browsebox.get_title())
+            self.print_message("main: %s keeps crashing its plug, not "
+                    "restarting it" % uri, MSGCOLOR, '38;5;96')
+            return
+
+        if oldpid not in self._restart_dict:
+            delay = self._plug_supervisor.get_restart_delay(oldpid)
+            self._restart_dict[oldpid] = []
+            if delay:
+                self.print_message("main: restarting plug %d in %d seconds"
+                        % (oldpid, delay), MSGCOLOR)
+
+            # The other tabs of the plug are told it died before this runs.
+            glib.timeout_add(int(delay * 1000), self._restart_crashed, 
+                    oldpid, priority=glib.PRIORITY_LOW)
+        self._restart_dict[oldpid].append(browsebox)
+
+    def _restart_crashed(self, oldpid):
+        """ _restart_crashed(oldpid) -> Start a new plug for the open tabs
+        of crashed plug oldpid.
 
         """
 
-        newpid = self._died_dict.get(oldpid, None)
-        newpid = self.setup_plug(browsebox, pid=newpid, died=True)
-        self._died_dict[oldpid] = newpid
-        self._clean_died_dict(oldpid)
+        tab_list = [tab for tab in self._restart_dict.pop(oldpid, []) if 
+                tab in self._browser_book.get_children()]
+
+        newpid = None
+        for tab in tab_list:
+            newpid = self.setup_plug(tab, newpid)
+
+        self._plug_supervisor.plug_restarted(oldpid, newpid, 
+                [tab.get_uri() for tab in tab_list])
+        self._process_policy.replace_process(oldpid, newpid)
+        if newpid:
+            self.print_message("main: restarted plug %d as plug %d" % \
+                    (oldpid, newpid), MSGCOLOR)
+            for line in self._plug_supervisor.get_stats_list():
+                self.print_message("main: %s" % line, MSGCOLOR)
+        return False
+
+    def _plug_timed_out(self, pid):
+        """ _plug_timed_out(pid) -> Restart the tabs waiting for plug pid,
+        which was killed for not starting in time.
+
+        """
+
+        for tab in self._browser_book.get_children():
+            if type(tab) == BrowserSock and tab.get_pid() == pid and \
+                    not tab.is_discarded():
+                self._browser_plug_died(tab, pid)
+
+    def _restart_quarantined(self, tab):
+        """ _restart_quarantined(tab) -> Restart crashed tab in a new plug
+        if its uri is out of quarantine.
+
+        """
+
+        if self._plug_supervisor.is_quarantined(tab.get_uri()):
+            return
+
+        self._quarantine_list.remove(tab)
+        self._browser_book.set_tab_text(tab, tab.get_title())
+        oldpid = tab.get_pid()
+        self._restart_dict.setdefault(oldpid, []).append(tab)
+        self._restart_crashed(oldpid)
 
     def do_browser_closed(self, browsebox):
         """ do_browser_closed(browsebox) -> Clean up after a tab is closed.
 
         """
 
-        if type(browsebox) == BrowserSock:
-            self._clean_died_dict(browsebox.get_pid())
+        Browser.load_scheduler.remove(browsebox)
+
+        if type(browsebox) == BrowserSock and browsebox.is_discarded():
+            if browsebox in self._quarantine_list:
+                self._quarantine_list.remove(browsebox)
+        elif type(browsebox) == BrowserSock:
+            pid = browsebox.get_pid()
+            if browsebox in self._quarantine_list:
+                self._quarantine_list.remove(browsebox)
+
+            shared = [tab for tab in self._browser_book.get_children() 
+                    if tab != browsebox and type(tab) == BrowserSock and 
+                    tab.get_pid() == pid]
+            if not shared:
+                self._plug_supervisor.forget(pid)
+
+            # Let the plug see that it was told to close.
+            if self._plug_freezer:
+                if shared:
+                    self._plug_freezer.thaw(pid)
+                else:
+                    self._plug_freezer.forget(pid)
         else:
             self.print_message("main: tab closed", MSGCOLOR)
 
@@ -215,47 +475,126 @@ class Browser(BrowserBase):
 
         """
 
-        tabcmd = [self._pyexec, '%s/browserplug.py' % self._path, '%s' % id(self)]
         env_dict = os.environ
         if not self._no_proxy:
             env_dict['http_proxy'] = self._proxy
             self._no_proxy = True
+
+        start = monotonic()
+        if Browser.plug_zygote:
+            pid = Browser.plug_zygote.fork_plug('%s' % id(self), 
+                    BrowserSock.transport, {
+                        'http_proxy': env_dict.get('http_proxy', ''),
+                        'BROWSER_MAIN_PID': str(os.getpid()),
+                        })
+            if pid:
+                env_dict['http_proxy'] = ''
+                self.print_message("main: forked plug %d from the zygote" % \
+                        pid, MSGCOLOR)
+                self._plug_supervisor.plug_started(pid)
+                startup_profile.add_task('plug-spawn', monotonic() - start)
+                return pid
+
+        tabcmd = [self._pyexec, '%s/browserplug.py' % self._path, 
+                '%s' % id(self), BrowserSock.transport]
         bplug = subprocess.Popen(tabcmd, env=env_dict)
         env_dict['http_proxy'] = ''
+        self._plug_supervisor.plug_started(bplug.pid)
+        startup_profile.add_task('plug-spawn', monotonic() - start)
 
         return bplug.pid
 
-    def setup_plug(self, browsebox, pid=None, died=False):
-        """ setup_plug(browsebox, pid=None, died=False) -> Setup a plug to
-        embed in a tab.  If the pid is set then the plug is started and it
-        just needs to start a new browser instance to embed.  Otherwise start
-        a new plug.
+    def setup_plug(self, browsebox, pid=None):
+        """ setup_plug(browsebox, pid=None) -> Setup a plug to embed in a
+        tab.  If the pid is set then the plug is started and it just needs
+        to start a new browser instance to embed.  Otherwise start a new
+        plug.  Returns the pid of the plug.
 
         """
 
+        pooled = False
+        if not pid and self._no_proxy and self._plug_pool:
+            # A plug from the pool has already sent its pid, so it has to
+            # be set up here.
+            pid = self._plug_pool.take()
+            pooled = bool(pid)
+
+        if pooled or not pid:
+            self._time_first_paint(browsebox, pooled)
+
+        if pid and self._plug_freezer:
+            # The process policy can share a plug that was frozen with its
+            # background tabs.
+            self._plug_freezer.thaw(pid)
+
         if not pid:
             pid = self._start_plug()
-        elif not died:
-            while True:
-                try:
-                    browsebox.setup_socket(pid)
-                    break
-                except:
-                    pass
+        elif self._plug_supervisor.is_ready(pid):
+            # It won't send its pid again, so set up the socket now.
+            # Otherwise the tab sets it up when the pid is sent.
+            try:
+                browsebox.setup_socket(pid)
+            except Exception as err:
+                self.print_message("main: unable to set up plug %d: %s" % \
+                        (pid, err), MSGCOLOR, '38;5;96')
         browsebox.set_pid(pid)
 
         return pid
 
+    def _time_first_paint(self, browsebox, pooled):
+        """ _time_first_paint(browsebox, pooled) -> Log how long it takes
+        for the plug to show up in browsebox, and whether it came from the
+        plug pool.
+
+        """
+
+        start = time()
+
+        def plug_added(browsebox):
+            browsebox.disconnect(handler_id)
+            seconds = time() - start
+            self.print_message("main: first paint after %.0f ms (plug pool "
+                    "%s)" % (seconds * 1000, 'hit' if pooled else 'miss'),
+                    MSGCOLOR)
+
+            # The first tab to paint ends startup, once its plug has had
+            # time to send its phases.
+            if not startup_profile.is_finished():
+                startup_profile.mark('first-paint')
+                glib.timeout_add_seconds(PLUG_PHASE_WAIT, 
+                        self._finish_startup, priority=glib.PRIORITY_LOW)
+
+            if self._plug_pool:
+                self._plug_pool.add_first_paint(pooled, seconds)
+                for stats_str in self._plug_pool.get_stats_list():
+                    self.print_message("main: %s" % stats_str, MSGCOLOR)
+
+        handler_id = browsebox.connect('browser-plug-added', plug_added)
+
     def new_tab_plug(self, uri=None, pid=None, popup=False, history_str='', 
-            history_index=1):
+            history_index=1, background=False):
         """ new_tab_plug(uri=None, pid=None, popup=False, history_str='', 
-        history_index=1) -> Start a new  external tab.  Open a shared tab if 
-        pid is set. If set, load history item of index 'history_index' or uri 
-        if set.  history_str is a string containing the history to copy to 
-        the new tab.
+        history_index=1, background=False) -> Start a new  external tab.  
+        Open a shared tab if pid is set. If set, load history item of index 
+        'history_index' or uri if set.  history_str is a string containing 
+        the history to copy to the new tab.  If background is True the tab 
+        is loaded when the load scheduler has room.
 
         """
 
+        # Load tabs opened in bulk when the scheduler has room.  Tabs the
+        # user opens one at a time load at once.
+        if background and uri and not pid and not popup:
+            browsebox = self.new_placeholder_tab(history_str, uri=uri)
+            self._queue_load(browsebox)
+            return browsebox
+
+        policy_uri = uri or history_uri(history_str)
+        new_process = not pid
+        if new_process:
+            pid = self._choose_pid(policy_uri)
+            new_process = not pid
+
         browsebox = BrowserSock(popup=popup, uri=uri, 
                 history_str=history_str, history_index=history_index,
                 profile=self._profile)
@@ -268,21 +607,398 @@ class Browser(BrowserBase):
             browsebox.connect(signal, callback)
 
         self.do_new_tab(browsebox, uri, popup)
-        self.setup_plug(browsebox, pid)
+        pid = self.setup_plug(browsebox, pid)
+        if new_process:
+            self._process_policy.add_process(pid, policy_uri)
 
         self.print_message("main socket_id: %d" % browsebox.get_socket_id(), 
                 MSGCOLOR)
 
         return browsebox
 
+    def new_placeholder_tab(self, history_str, pid=0, icon=None, uri=None):
+        """ new_placeholder_tab(history_str, pid=0, icon=None, uri=None) ->
+        Add an external tab that shows the title of the current item of
+        history_str, or uri, and icon, but doesn't start a plug until it is
+        selected or its load is started.  pid is the plug the tab was saved
+        from.
+
+        """
+
+        browsebox = BrowserSock(uri=uri, history_str=history_str, 
+                profile=self._profile)
+        browsebox.connect('browser-plug-died', self._browser_plug_died)
+        browsebox.set_placeholder(pid)
+
+        title, saved_uri = history_item(history_str)
+        browsebox.set_title(title or saved_uri or uri)
+        if icon:
+            browsebox.set_icon(icon)
+
+        self.do_new_tab(browsebox, popup=True)
+
+        return browsebox
+
+    def _queue_load(self, tab):
+        """ _queue_load(tab) -> Give placeholder tab a plug when the load
+        scheduler has room.
+
+        """
+
+        def start_load(wait):
+            if tab not in self._browser_book.get_children() or \
+                    not self._restore_tab(tab):
+                return False
+
+            self.print_message("main: started background load of %s after "
+                    "%.1f s" % (tab.get_uri(), wait), MSGCOLOR)
+            for line in Browser.load_scheduler.get_stats_list():
+                self.print_message("main: %s" % line, MSGCOLOR)
+            return True
+
+        Browser.load_scheduler.add(tab, start_load)
+
+    def _load_placeholders(self):
+        """ _load_placeholders -> Load the most recently restored
+        placeholder tabs, up to the restore load count.
+
+        """
+
+        self._placeholder_id = None
+        tab_list = [tab for tab in self._placeholder_list if tab in 
+                self._browser_book.get_children() and tab.is_discarded()]
+        self._placeholder_list = []
+
+        if self._restore_load_count > 0:
+            for tab in tab_list[-self._restore_load_count:]:
+                self._queue_load(tab)
+
+        self.print_message("main: restored %d tabs, %d waiting to be "
+                "selected" % (len(tab_list), self._get_discard_count()), 
+                MSGCOLOR)
+        return False
+
+    def _choose_pid(self, uri):
+        """ _choose_pid(uri) -> Ask the process policy which process a tab
+        loading uri should share.  Returns None for a new process.
+
+        """
+
+        pid = self._process_policy.choose_pid(uri, self._get_plug_tab_list())
+        if pid:
+            self.print_message("main: %s process policy put %s in plug %d" % \
+                    (self._process_policy.policy, uri, pid), MSGCOLOR)
+        return pid
+
+    def _get_plug_tab_list(self):
+        """ _get_plug_tab_list -> Return a list of the (pid, uri) of each
+        external tab in this window.
+
+        """
+
+        return [(tab.get_pid(), tab.get_uri()) for tab in 
+                self._browser_book.get_children() if type(tab) == BrowserSock
+                and not tab.is_discarded()]
+
+    def _check_discard(self):
+        """ _check_discard -> Discard the external tabs that have not been
+        used for the discard idle time, if their tab state allows it.
+
+        """
+
+        for tab in self._browser_book.get_children():
+            if type(tab) != BrowserSock or tab == self._current_tab:
+                continue
+            if tab.is_discarded() or \
+                    tab.get_idle_time() < self._discard_time:
+                continue
+            if self._browser_book.get_tab_state(tab) in self._discard_states:
+                self._discard_tab(tab)
+
+        return True
+
+    def _discard_tab(self, tab):
+        """ _discard_tab(tab) -> Close the browser view of tab, keeping a
+        placeholder with its title, icon and history.
+
+        """
+
+        pid = tab.get_pid()
+
+        # It has to answer to be discarded.
+        if self._plug_freezer:
+            self._plug_freezer.thaw(pid)
+
+        # The memory is only given back if no other tab uses the process.
+        shared = [i for i, uri in self._get_plug_tab_list() if i == pid][1:]
+        rss = 0 if shared else get_rss(pid)
+
+        def discarded():
+            self._reclaimed += rss
+            self._browser_book.set_tab_text(tab, '%s (discarded)' % \
+                    tab.get_title())
+            self.print_message("main: discarded %s (plug %d, %.1f MB), %d "
+                    "tabs discarded, %.1f MB reclaimed" % (tab.get_uri(), 
+                        pid, rss / 1048576.0, self._get_discard_count(), 
+                        self._reclaimed / 1048576.0), MSGCOLOR)
+
+        tab.discard(discarded)
+
+    def _restore_tab(self, tab):
+        """ _restore_tab(tab) -> Give a discarded tab a new browser view
+        and restore its history.  Returns False if it wasn't discarded.
+
+        """
+
+        if not tab.restore():
+            return False
+
+        uri = tab.get_uri() or history_uri(tab.get_history_str())
+        pid = self._choose_pid(uri)
+        new_process = not pid
+        pid = self.setup_plug(tab, pid)
+        if new_process:
+            self._process_policy.add_process(pid, uri)
+
+        self.print_message("main: restored %s in plug %d, %d tabs "
+                "discarded" % (uri, pid, self._get_discard_count()), MSGCOLOR)
+        return True
+
+    def _get_discard_count(self):
+        """ _get_discard_count -> Return the number of discarded tabs.
+
+        """
+
+        return len([tab for tab in self._browser_book.get_children() if 
+            type(tab) == BrowserSock and tab.is_discarded()])
+
+    def _check_freeze(self):
+        """ _check_freeze -> Freeze the plugs whose tabs have all been in
+        the background for the freeze grace time.  The current tab is in the
+        background while the window is minimized.
+
+        """
+
+        now = time()
+        window_hidden = self._hidden_time and \
+                now - self._hidden_time >= self._freeze_time
+
+        # pid: whether all of its tabs are idle.
+        idle_dict = {}
+        for tab in self._browser_book.get_children():
+            if type(tab) != BrowserSock or tab.is_discarded():
+                continue
+            pid = tab.get_pid()
+            if not pid:
+                continue
+            if tab == self._current_tab:
+                idle = window_hidden
+            else:
+                idle = tab.get_idle_time() >= self._freeze_time
+            idle_dict[pid] = idle_dict.get(pid, True) and idle
+
+        for pid, idle in idle_dict.iteritems():
+            if idle and self._plug_freezer.freeze(pid):
+                self.print_message("main: froze plug %d with %s, %d plugs "
+                        "frozen" % (pid, self._plug_freezer.get_method(), 
+                            len(self._plug_freezer.get_frozen())), MSGCOLOR)
+
+        self._plug_freezer.clean()
+        return True
+
+    def _check_usage(self):
+        """ _check_usage -> Sample the memory and cpu used by each plug,
+        show it on its tabs, and act on the plugs that are over their
+        limits.
+
+        """
+
+        # A frozen plug uses no cpu, so sampling it doesn't hurt.
+        tab_list = [tab for tab in self._browser_book.get_children() if 
+                type(tab) == BrowserSock]
+        pid_list = [pid for pid, uri in self._get_plug_tab_list() if pid]
+        over_list = self._plug_monitor.sample(set(pid_list))
+
+        for tab in tab_list:
+            if tab.is_discarded():
+                tab.set_usage(None)
+            else:
+                tab.set_usage(self._plug_monitor.get_usage(tab.get_pid()))
+
+        # Only log the plugs that went over or back under a limit.
+        if log_registry.is_enabled('monitor'):
+            for line in self._plug_monitor.get_stats_list(
+                    self._plug_monitor.get_changed_list()):
+                self.print_message("main: %s" % line, MSGCOLOR, '38;5;30')
+
+        for pid in over_list:
+            self._usage_over_limit(pid)
+
+        return True
+
+    def _usage_over_limit(self, pid):
+        """ _usage_over_limit(pid) -> Warn about, discard the background
+        tabs of, or restart plug pid, which is over its limits.
+
+        """
+
+        rss, cpu = self._plug_monitor.get_usage(pid)
+        action = self._plug_monitor.action
+        self.print_message("main: plug %d is over its limits (%.1f MB, "
+                "%.0f%% cpu), action: %s" % (pid, rss / 1048576.0, cpu, 
+                    action), MSGCOLOR, '38;5;96')
+
+        tab_list = [tab for tab in self._browser_book.get_children() if 
+                type(tab) == BrowserSock and not tab.is_discarded() and 
+                tab.get_pid() == pid]
+
+        if action == ACTION_DISCARD:
+            background_list = [tab for tab in tab_list if 
+                    tab != self._current_tab]
+            if not background_list:
+                self.print_message("main: plug %d has no background tabs "
+                        "to discard" % pid, MSGCOLOR)
+            for tab in background_list:
+                self._discard_tab(tab)
+        elif action == ACTION_RESTART and tab_list:
+            self._restart_plug(pid, tab_list)
+
+    def _restart_plug(self, pid, tab_list, reason='restarted'):
+        """ _restart_plug(pid, tab_list, reason='restarted') -> Move the
+        tabs in tab_list out of plug pid into one new plug, keeping their
+        history, and kill pid if it doesn't exit once they have all left.
+        reason is logged.
+
+        """
+
+        if self._plug_freezer:
+            self._plug_freezer.thaw(pid)
+
+        waiting_list = tab_list[:]
+        moved_list = []
+
+        def kill_plug():
+            if os.path.exists('/proc/%d' % pid):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            if self._plug_freezer:
+                self._plug_freezer.forget(pid)
+            if self._plug_monitor:
+                self._plug_monitor.forget(pid)
+            self._plug_supervisor.forget(pid)
+            return False
+
+        def move_tabs():
+            newpid = None
+            for tab in moved_list:
+                # It was restored already if it was switched to.
+                if tab.restore():
+                    newpid = self.setup_plug(tab, newpid)
+            self._process_policy.replace_process(pid, newpid)
+
+            self.print_message("main: %s plug %d, moved %d tabs to plug %s"
+                    % (reason, pid, len(moved_list), newpid), MSGCOLOR)
+            glib.timeout_add_seconds(RESTART_KILL_DELAY, kill_plug, 
+                    priority=glib.PRIORITY_LOW)
+
+        def discarded(tab):
+            moved_list.append(tab)
+            waiting_list.remove(tab)
+            if not waiting_list:
+                move_tabs()
+
+        for tab in tab_list:
+            if not tab.discard(lambda tab=tab: discarded(tab)):
+                waiting_list.remove(tab)
+                if not waiting_list and moved_list:
+                    move_tabs()
+
+    def _check_recycle(self):
+        """ _check_recycle -> Recycle a plug that is over the recycle rss
+        limit or age.  Plugs showing the current tab are left until it is
+        switched away from, and only one plug is recycled at a time.
+
+        """
+
+        # pid: the tabs it shows.
+        tab_dict = {}
+        for tab in self._browser_book.get_children():
+            if type(tab) == BrowserSock and not tab.is_discarded() and \
+                    tab.get_pid():
+                tab_dict.setdefault(tab.get_pid(), []).append(tab)
+
+        for pid, tab_list in tab_dict.iteritems():
+            if self._current_tab in tab_list:
+                continue
+
+            rss = get_rss(pid)
+            age = get_age(pid) or 0
+            if self._recycle_rss > 0 and rss > self._recycle_rss:
+                reason = "recycled (%.1f MB)" % (rss / 1048576.0)
+            elif self._recycle_age > 0 and age > self._recycle_age:
+                reason = "recycled (%.0f minutes old)" % (age / 60)
+            else:
+                continue
+
+            self._restart_plug(pid, tab_list, reason)
+            break
+
+        return True
+
+    def _thaw_tab(self, tab):
+        """ _thaw_tab(tab) -> Thaw the plug of tab if it is frozen.
+
+        """
+
+        if self._plug_freezer and self._plug_freezer.thaw(tab.get_pid()):
+            self.print_message("main: thawed plug %d, %d plugs frozen" % \
+                    (tab.get_pid(), len(self._plug_freezer.get_frozen())), 
+                    MSGCOLOR)
+
+    def _window_state_changed(self, window, event):
+        """ _window_state_changed(window, event) -> Remember when the
+        window was minimized, and thaw the current tab when it is shown
+        again.
+
+        """
+
+        if event.new_window_state & gtk.gdk.WINDOW_STATE_ICONIFIED:
+            if not self._hidden_time:
+                self._hidden_time = time()
+        else:
+            self._hidden_time = 0
+            if type(self._current_tab) == BrowserSock:
+                self._thaw_tab(self._current_tab)
+
+    def do_tab_switched(self, old_tab, new_tab):
+        """ do_tab_switched(old_tab, new_tab) -> Mark both tabs as used,
+        and restore new_tab if it was discarded.
+
+        """
+
+        if type(old_tab) == BrowserSock:
+            old_tab.set_used()
+        if type(new_tab) == BrowserSock:
+            new_tab.set_used()
+            self._thaw_tab(new_tab)
+            if new_tab.is_discarded():
+                # A selected tab doesn't wait for the load scheduler.
+                Browser.load_scheduler.remove(new_tab)
+                self._restore_tab(new_tab)
+            elif new_tab in self._quarantine_list:
+                self._restart_quarantined(new_tab)
+
     def do_open_tab(self, flags=0, tab=None, uri=None, popup=False, 
             pid=None, history_str='', history_index=1, button=None,
-            tab_type=None):
+            tab_type=None, background=False):
         """ do_open_tab(flags=0, tab=None, uri=None, popup=False, 
-        pid=None, history_str='', history_index=1 tab_type=None) ->
-        Open a new tab.  If flags indecates that alt was held than a tab
-        of a different type than tab will be opened.  Load uri in the new tab
-        or history item history_index.
+        pid=None, history_str='', history_index=1 tab_type=None,
+        background=False) -> Open a new tab.  If flags indecates that alt 
+        was held than a tab of a different type than tab will be opened.  
+        Load uri in the new tab or history item history_index.  If 
+        background is True an external tab waits for the load scheduler.
 
         """
 
@@ -322,9 +1038,13 @@ class Browser(BrowserBase):
                         history_str=history_str, history_index=history_index) 
             else:
                 if gtk.gdk.MOD4_MASK & flags:
+                    # The proxy is used by the next plug started, so it
+                    # can't wait.
                     self._no_proxy = False
+                    background = False
                 new_tab = self.new_tab_plug(uri=uri, pid=pid, popup=popup, 
-                        history_str=history_str, history_index=history_index) 
+                        history_str=history_str, history_index=history_index,
+                        background=background) 
         else:
             if gtk.gdk.MOD1_MASK & flags or gtk.gdk.MOD4_MASK & flags:
                 if gtk.gdk.MOD4_MASK & flags:
@@ -357,12 +1077,36 @@ class Browser(BrowserBase):
         history_str = json.dumps(hist_list)
         tab_index = int(tab_dict['index'])
 
-        if tab_pid:
+        # Only the tabs of the last session restored together wait to be
+        # selected, a single reopened or pasted tab loads straight away.
+        session = tab_dict.get('session', False) and \
+                tab_dict.get('bulk', False)
+        lazy_mask = gtk.gdk.SHIFT_MASK | gtk.gdk.MOD1_MASK | gtk.gdk.MOD4_MASK
+        if tab_pid and session and self._lazy_restore and \
+                not flags & lazy_mask:
+            browsebox = self.new_placeholder_tab(history_str, int(tab_pid), 
+                    tab_dict.get('icon', None))
+
+            # Load the most recent ones once they have all been restored.
+            self._placeholder_list.append(browsebox)
+            if self._placeholder_id:
+                glib.source_remove(self._placeholder_id)
+            self._placeholder_id = glib.timeout_add(RESTORE_SETTLE_DELAY, 
+                    self._load_placeholders, priority=glib.PRIORITY_LOW)
+        elif tab_pid and tab_dict.get('bulk', False) and \
+                not flags & lazy_mask:
+            # Load a list of reopened or pasted tabs a few at a time.
+            browsebox = self.new_placeholder_tab(history_str, int(tab_pid), 
+                    tab_dict.get('icon', None))
+            self._queue_load(browsebox)
+        elif tab_pid:
             pid = None
             tab_pid = int(tab_pid)
             new_pid = self._closed_pid_dict.get(tab_pid, None)
             for tab in self._browser_book.get_children():
-                if hasattr(tab, 'get_pid'):
+                # Placeholders keep the pid they were saved with.
+                if hasattr(tab, 'get_pid') and not (type(tab) == BrowserSock
+                        and tab.is_discarded()):
                     if tab.get_pid() == tab_pid:
                         pid = tab_pid
                         break
@@ -386,6 +1130,41 @@ class Browser(BrowserBase):
         """
 
         self._connect_dbus(self._bus, disconnect=True)
+        log_registry.remove_callback(self._receiver.log_levels_changed)
+
+        if self._plug_pool:
+            self._plug_pool.close()
+
+        self._plug_supervisor.close()
+
+        if self._placeholder_id:
+            glib.source_remove(self._placeholder_id)
+
+        for tab in self._browser_book.get_children():
+            Browser.load_scheduler.remove(tab)
+
+        if self._discard_id:
+            glib.source_remove(self._discard_id)
+
+        if self._plug_monitor:
+            glib.source_remove(self._monitor_id)
+
+        if self._recycle_id:
+            glib.source_remove(self._recycle_id)
+
+        # Don't leave any plugs stopped.
+        if self._plug_freezer:
+            glib.source_remove(self._freeze_id)
+            self._plug_freezer.thaw_all()
+
+        # Stop the zygote with the last window.
+        if Browser.plug_zygote and len(Browser.window_set) <= 1:
+            Browser.plug_zygote.stop()
+            Browser.plug_zygote = None
+
+        if len(Browser.window_set) <= 1:
+            Browser.load_scheduler.close()
+            Browser.load_scheduler = None
 
     def do_create_window(self, browsebox=None, uri=None):
         """ Create a new window.
@@ -398,6 +1177,17 @@ class Browser(BrowserBase):
 
         return create_window(self._bus, uri=uri)
 
+def foreground_loading():
+    """ foreground_loading -> Return True if the current tab of any window
+    is loading.
+
+    """
+
+    for window in Browser.window_set:
+        if window._current_tab and window._current_tab.is_loading():
+            return True
+    return False
+
 def create_window(bus, uri=None, profile='default'):
     """ Create a new window.
 
@@ -413,34 +1203,33 @@ def load_uri(uri):
     window = tuple(Browser.window_set)[-1]
     window.new_tab(uri=uri)
 
-def get_options():
-    """ Get the command line arguments.
+def main(options=None):
+    """ main(options=None) -> Start the browser with the command line
+    options, or send the uri to the browser already running in the profile.
 
     """
 
-    opts = OptionParser("usage: %prog [options] [Address/Search Phrase]")
-    opts.add_option("-u", "--uri", action="store", type="string", dest="uri", 
-            default='', help="Load uri")
-    opts.add_option("-p", "--profile", action="store", type="string", dest="profile", 
-            default='default', help="Set profile")
+    if not options:
+        options = get_options()
 
-    options, args = opts.parse_args()
-    if args and not options.uri:
-        options.uri = ' '.join(args)
+    if options.startup_summary:
+        print('\n'.join(summary_list('%s/%s/%s/startup_history' % \
+                (glib.get_user_config_dir(), APP_NAME, options.profile))))
+        return
 
-    return options
-
-if __name__ == "__main__":
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
     main_bus = dbus.SessionBus()
     main_bus_name = dbus.service.BusName(MAIN_INTERFACE_NAME, main_bus)
 
     profile_bus = dbus.SessionBus()
     profile_bus_name = dbus.service.BusName('com.browser.main', profile_bus)
-
-    options = get_options()
+    startup_profile.mark('dbus')
 
     with ProfileManager(profile_bus, options.__dict__, load_uri) as profile:
         if profile._pid_file:
+            startup_profile.mark('profile-manager')
             create_window(main_bus, uri=options.uri, 
                     profile=options.profile).run()
+
+if __name__ == "__main__":
+    main()
@@ -54,19 +54,28 @@ import urllib
 import dbus.service
 
 import bookmarks
-from classes import SpinnerIcon, SearchMenu
+from classes import SpinnerIcon, SearchMenu, Config
 from tab_classes import BrowserTabs, TerminalTabs, TabList
 from file_watch import FileWatcher
+from block_matcher import update_index
+from log_sink import LogSink, MAX_SIZE, BACKUP_COUNT
+from log_levels import log_registry
 from embed_sock import EmbedApp
 from download_classes import DownloadManager
 from functions import redirect_warnings
 from plugin_loader import Plugins
 from findbar import FindBar
+from tab_state import TabState
+from startup_profile import startup_profile
 from defaults import APP_NAME
 
 # Set the global message sender-name color.
 MSGCOLOR = 34
 
+# Seconds after the main loop starts to stop timing startup if no tab has
+# painted.
+STARTUP_TIMEOUT = 60
+
 class BrowserTabBase(gtk.VBox):
     """ BrowserTabBase -> The browser tab base class. 
     
@@ -94,6 +103,8 @@ class BrowserTabBase(gtk.VBox):
                     gobject.TYPE_STRING)),
             'hover-uri': (gobject.SIGNAL_RUN_LAST, 
                 gobject.TYPE_NONE, (gobject.TYPE_STRING,)),
+            'load-finished': (gobject.SIGNAL_RUN_LAST, 
+                gobject.TYPE_NONE, ()),
             }
 
     def __init__(self, popup=False, uri=None, history_str='', 
@@ -119,6 +130,9 @@ class BrowserTabBase(gtk.VBox):
         self._page_loading = False
         self._history_str = history_str
         self._favicon_lock = threading.Lock()
+
+        # The last state snapshot received from the browser view.
+        self._state = TabState()
         self._protocol_pat = re.compile(
                 '^(about:|http://|https://|file://|ftp://|javascript:|mailto:)', re.I)
         self._type = None
@@ -277,6 +291,29 @@ class BrowserTabBase(gtk.VBox):
 
         return self._uri
 
+    def get_state(self):
+        """ get_state() -> Returns the last state snapshot received from
+        the browser view.
+
+        """
+
+        return self._state
+
+    def set_state(self, version, state_str):
+        """ set_state(version, state_str) -> Update the state snapshot if
+        version is newer than the one we have, and refresh the history menu
+        if the history changed.
+
+        """
+
+        if not self._state.update(version, state_str):
+            return
+
+        history_str = self._state.get_history()
+        if history_str != self._history_str:
+            self._history_str = history_str
+            self.populate_history_menu()
+
     def get_title(self):
         """ get_title() -> returns tab title 
         
@@ -471,6 +508,7 @@ class BrowserTabBase(gtk.VBox):
             # If this is the active tab then grab the focus.
             if self.active_tab:
                 self.take_focus()
+            self.emit('load-finished')
         else:
             # Show progress and working icon when the page is loading.
             if not self._spinner_icon.is_spinning():
@@ -1329,13 +1367,15 @@ class BrowserTabBase(gtk.VBox):
 
         pass
 
-    def do_find(self, find_string, match_case, find_direction, wrap_find):
-        """ do_find(find_string, match_case, find_direction, wrap_find) -> To
-        be implemented by inheritor. 
+    def do_find(self, find_string, match_case, find_direction, wrap_find, 
+            callback):
+        """ do_find(find_string, match_case, find_direction, wrap_find, 
+        callback) -> To be implemented by inheritor.  callback should be 
+        called with whether the text was found.
         
         """
 
-        pass
+        callback(False)
 
     def find_on_page(self, find_bar=None, find_string=None, direction='next'):
         """ find_on_page(widget) -> Find text on the page.  Depending on what
@@ -1355,8 +1395,15 @@ class BrowserTabBase(gtk.VBox):
                 highlight)
 
         # Find 'find_string' on page
-        found = self.do_find(find_string, self._find_bar.get_match_case(), 
-                direction != 'previous', self._find_bar.get_wrap())
+        self.do_find(find_string, self._find_bar.get_match_case(), 
+                direction != 'previous', self._find_bar.get_wrap(), 
+                self._find_done)
+
+    def _find_done(self, found):
+        """ _find_done(found) -> Show whether the text was found in the
+        find bar.
+
+        """
 
         if not found:
             # Set stop icon when no text is found
@@ -1379,6 +1426,9 @@ class BrowserBase(gobject.GObject):
     # A set of all the browser windows open.
     window_set = set()
 
+    # The log file writer shared by all the windows, if logging to a file.
+    log_sink = None
+
     def __init__(self, uri=None, profile='default', width=1213, height=628):
         """ BrowserBase(uri=None, profile='default', width=1213, 
         height=628) -> Browser base class.
@@ -1394,10 +1444,18 @@ class BrowserBase(gobject.GObject):
         self._profile = profile
         self._tabs_file = '%s/%s/%s/browser_tabs' % \
                 (glib.get_user_config_dir(), APP_NAME, profile)
+        self._startup_file = '%s/%s/%s/startup_history' % \
+                (glib.get_user_config_dir(), APP_NAME, profile)
 
         SearchMenu._profile_path = '%s/%s/%s' % \
                 (glib.get_user_config_dir(), APP_NAME, profile)
 
+        # Setup a configuration.
+        self._config = Config('%s/%s/%s/browser.conf' % \
+                (glib.get_user_config_dir(), APP_NAME, profile))
+
+        startup_profile.mark('base-init')
+
         # Save stdout.
         self._stdout = sys.stdout
 
@@ -1477,6 +1535,8 @@ class BrowserBase(gobject.GObject):
         else:
             self._file_watcher = None
 
+        startup_profile.mark('widgets')
+
     def _setup_term_book(self):
         """ _setup_term_book() -> Creates terminal tabs and adds debug terminal
         and download manager to it. 
@@ -1598,15 +1658,24 @@ class BrowserBase(gobject.GObject):
             # Set debug terminal to default visibility
             self._term_book.set_property('visible', False)
 
+            startup_profile.mark('show-window')
+
             # Start file watcher.
             if self._file_watcher:
                 self._file_watcher.start()
 
+            # Compile the block list once for every tab and plug process.
+            index_thread = threading.Thread(target=self._update_block_index)
+            index_thread.daemon = True
+            index_thread.start()
+
             # Load plugins.
             self._plugins.load_list('%s/plugins' % self._path, 'main')
+            startup_profile.mark('plugins')
 
             # Restore tabs from tab restore file.
-            self._tab_manager.import_list(self._tabs_file)
+            self._tab_manager.import_list(self._tabs_file, session=True)
+            startup_profile.mark('tab-list')
 
             if addtab:
                 # Open a new tab if no tabs are open.
@@ -1621,10 +1690,35 @@ class BrowserBase(gobject.GObject):
 
             BrowserBase.window_set.add(self)
 
+            # Log messages to a file if enabled in the config.
+            if not BrowserBase.log_sink and \
+                    self._config.get_setting('log-file', False):
+                BrowserBase.log_sink = LogSink('%s/%s/%s/browser.log' % \
+                        (glib.get_user_config_dir(), APP_NAME, self._profile),
+                        self._config.get_setting('log-file-size', MAX_SIZE),
+                        self._config.get_setting('log-file-count', 
+                            BACKUP_COUNT))
+                BrowserBase.log_sink.start()
+
+            # Stop timing startup if no tab paints.
+            if not startup_profile.is_finished():
+                glib.idle_add(startup_profile.mark, 'main-loop')
+                glib.timeout_add_seconds(STARTUP_TIMEOUT, 
+                        self._finish_startup, priority=glib.PRIORITY_LOW)
+
             if len(BrowserBase.window_set) == 1:
                 gobject.threads_init()
                 gtk.main()
 
+    def _finish_startup(self):
+        """ _finish_startup -> Stop timing startup and add it to the startup
+        history.
+
+        """
+
+        startup_profile.finish(self._startup_file)
+        return False
+
     def exit(self, window):
         """ exit(window) -> Called to exit the browser.  Cleans up
         implementation independent parts of the browser. 
@@ -1665,6 +1759,11 @@ class BrowserBase(gobject.GObject):
             pass
 
         if len(BrowserBase.window_set) == 0:
+            # Write the rest of the log.
+            if BrowserBase.log_sink:
+                BrowserBase.log_sink.stop()
+                BrowserBase.log_sink = None
+
             # Quit the main loop
             gtk.main_quit()
 
@@ -1734,6 +1833,29 @@ class BrowserBase(gobject.GObject):
 
         self.print_message(*args)
 
+    def _update_block_index(self):
+        """ _update_block_index -> Rebuild the block list index in the 
+        profile directory if block.uri has changed.  The tab ad blocker 
+        maps this index instead of compiling the rules itself.
+
+        """
+
+        config_path = '%s/%s' % (glib.get_user_config_dir(), APP_NAME)
+        rule_filename = '%s/block.uri' % config_path
+        if not os.path.isfile(rule_filename):
+            return
+
+        try:
+            errors = update_index(rule_filename, '%s/%s/block.idx' % \
+                    (config_path, self._profile))
+        except Exception as err:
+            errors = [(rule_filename, err)]
+
+        for rule, err in errors:
+            glib.idle_add(self.print_message, 
+                    "Skipping bad block rule %s: %s" % (rule, err), 
+                    MSGCOLOR, '38;5;96')
+
     def print_message(self, message, color=0, data_color=''): 
         """ print_message(message, color=0, data_color='') -> Print messages
         to the debug terminal. 
@@ -1745,9 +1867,12 @@ class BrowserBase(gobject.GObject):
             self.stdout_print_message(message, color, data_color)
 
         # Log the message to a file.
-        #with open('browser-%d.log' % os.getpid(), 'a') as log_file:
-            #log_file.write(message)
-            #log_file.flush()
+        if BrowserBase.log_sink:
+            source, _, text = message.partition(':')
+            if not text:
+                source, text = 'main', message
+            BrowserBase.log_sink.write(source, 
+                    log_registry.get_category(data_color), text.strip())
 
     def do_receive_embed_mime_uri(self, mimetype, uri, handler_cmd_str):
         """ do_receive_embed_mime_uri(embedmimetype, uri) -> Handle received 
@@ -1829,10 +1954,12 @@ class BrowserBase(gobject.GObject):
             self.print_message("received download uri: %s" % uri, MSGCOLOR)
 
     def do_open_tab(self, flags=0, tab=None, uri=None, popup=False, 
-            pid=None, history_str='', history_index=1, button=None):
+            pid=None, history_str='', history_index=1, button=None,
+            background=False):
         """ do_open_tab(flags=0, tab=None, uri=None, popup=False, 
-        pid=None, history_str='', history_index=1) -> Open a new tab based on
-        the arguments given.  To be implemented by inheritor. 
+        pid=None, history_str='', history_index=1, background=False) -> Open
+        a new tab based on the arguments given.  To be implemented by 
+        inheritor. 
         
         """
 
@@ -1880,7 +2007,7 @@ class BrowserBase(gobject.GObject):
 
             """
 
-            self.do_open_tab(flags=flags, tab=tab, uri=uri)
+            self.do_open_tab(flags=flags, tab=tab, uri=uri, background=True)
             return False
 
         for bookmark in bookmarks.get_bookmark_list_sorted(folder, 
@@ -1947,7 +2074,9 @@ class BrowserBase(gobject.GObject):
         
         """
 
+        old_tab = self._current_tab
         self._current_tab = browser_book.get_property(property.name)
+        self.do_tab_switched(old_tab, self._current_tab)
 
     def _browser_book_paste_tab(self, browser_book, tab, flags):
         """ _browser_book.paste_tab(browser_book, tab, flags) -> Paste the 
@@ -1960,10 +2089,12 @@ class BrowserBase(gobject.GObject):
         try:
             index = self._browser_book.page_num(tab) + 1
             #for info_str in tab_str.split('\n'): 
-            for info_list in json.loads(tab_str):
+            info_list_list = json.loads(tab_str)
+            for info_list in info_list_list:
                 #info_list = json.loads(info_str)
                 glib.idle_add(self.do_restore_tab, 
-                        {'info_list':info_list, 'index':index}, flags)
+                        {'info_list':info_list, 'index':index, 
+                            'bulk':len(info_list_list) > 1}, flags)
                 index += 1
         except:
             pass
@@ -2160,6 +2291,14 @@ class BrowserBase(gobject.GObject):
 
         pass
 
+    def do_tab_switched(self, old_tab, new_tab):
+        """ do_tab_switched(old_tab, new_tab) -> Called when the current
+        tab changes from old_tab to new_tab.  To be implemented by inheritor.
+
+        """
+
+        pass
+
     def _copy_text_key_pressed(self, accels=None, window=None, keyval=None, 
             flags=None):
         """ _copy_text_key_pressed() -> Copy text when copy keyboard shortcut
@@ -25,6 +25,7 @@ import os
 import sys
 import json
 import subprocess
+from time import time
 from optparse import OptionParser
 
 import gtk
@@ -36,7 +37,14 @@ import dbus.mainloop.glib
 import dbus.gobject_service
 
 from browser_classes import BrowserTabBase, BrowserBase, MSGCOLOR
-from defaults import APP_NAME, MAIN_INTERFACE_NAME
+from log_levels import log_registry
+from tab_state import TabState
+from plug_ipc import ipc_bus, IPCError
+from defaults import APP_NAME, MAIN_INTERFACE_NAME, UPDATE_PROGRESS
+from defaults import UPDATE_HOVER_URI, UPDATE_BACK_FORWARD
+
+# How long to wait for a plug to answer a call, in seconds.
+PLUG_CALL_TIMEOUT = 5
 
 class BrowserSock(BrowserTabBase):
     """ BrowserSock -> A tab that uses a socket to embed a browser.
@@ -46,9 +54,15 @@ class BrowserSock(BrowserTabBase):
     # Define the interface used to comunicate over dbus.
     INTERFACE = "com.browser.tab%d"
 
+    # How to talk to the plugs, 'dbus' or 'socket'.  Over a socket dbus is
+    # only used for the plug to announce its pid.
+    transport = 'dbus'
+
     __gsignals__ = {
             'browser-plug-died' : (gobject.SIGNAL_RUN_LAST, 
                 gobject.TYPE_NONE, (gobject.TYPE_LONG,)),
+            'browser-plug-added' : (gobject.SIGNAL_RUN_LAST, 
+                gobject.TYPE_NONE, ()),
             }
 
     def __init__(self, popup=False, uri=None, history_str='', 
@@ -76,6 +90,8 @@ class BrowserSock(BrowserTabBase):
                 'send_new_tab' : self._receive_new_tab,
                 'send_download_uri': self._receive_download_uri,
                 'send_embed_mime_uri' : self._receive_embed_mime_uri,
+                'send_state' : self._receive_state,
+                'send_update' : self._receive_update,
                 }
 
         self._type = 'BrowserSock'
@@ -84,6 +100,19 @@ class BrowserSock(BrowserTabBase):
         self._plug = None
         self._socket_id = None
         self._died = False
+        self._closed = False
+
+        # A discarded tab has closed its browser view to save memory, and
+        # gets a new one when it is next used.
+        self._discarded = False
+        self._used_time = time()
+
+        # How many discarded plugs are still embedded.  Their plug-removed
+        # can come after the tab was restored, and isn't a crash.
+        self._exit_count = 0
+
+        # The (rss in bytes, cpu percent) of the plug, set by the monitor.
+        self._usage = None
 
         # Setup the socket to embed the external browser in.
         self._socket = gtk.Socket()
@@ -102,36 +131,65 @@ class BrowserSock(BrowserTabBase):
 
         self._socket.grab_focus()
 
+    def _call_plug(self, method_name, *args, **kwargs):
+        """ _call_plug(method_name, *args, callback=None, 
+        timeout=PLUG_CALL_TIMEOUT) -> Call method_name on the plug without
+        waiting for it.  If callback is given it is called with the result,
+        or with no arguments if the call fails or takes longer than timeout
+        seconds.  Returns False if there is no plug to call.
+
+        """
+
+        callback = kwargs.get('callback', None)
+        timeout = kwargs.get('timeout', PLUG_CALL_TIMEOUT)
+
+        def reply_handler(*result):
+            if callback:
+                callback(*result)
+
+        def error_handler(err):
+            self.print_message("browsebox: %s failed: %s" % (method_name, 
+                err), MSGCOLOR, '38;5;96')
+            if callback:
+                callback()
+
+        if not self._plug:
+            return False
+
+        try:
+            getattr(self._plug, method_name)(*args, 
+                    reply_handler=reply_handler, 
+                    error_handler=error_handler, timeout=timeout)
+        except Exception as err:
+            error_handler(err)
+            return False
+
+        return True
+
     def print_page(self):
         """ print_page -> Tells the browser to print the current page.
 
         """
 
-        self._plug.print_page(self._socket_id, 
-                reply_handler=lambda *args:None,
-                error_handler=lambda *args:None)
+        self._call_plug('print_page', self._socket_id)
 
     def refresh_page(self):
         """ refresh_page -> Reload the current page.
 
         """
 
-        self._plug.reload(self.get_socket_id(), 
-                reply_handler=lambda *args:None,
-                error_handler=lambda *args:None)
+        self._call_plug('reload', self.get_socket_id())
 
     def stop_loading(self):
         """ stop_loading -> Stop the current page from loading.
 
         """
 
-        if self._plug:
-            self._plug.stop_loading(self.get_socket_id(), 
-                    reply_handler=lambda *args:None, 
-                    error_handler=lambda *args:None)
+        self._call_plug('stop_loading', self.get_socket_id())
 
     def do_close(self):
-        """ do_close -> Disconnect and close the external browser.
+        """ do_close -> Disconnect and close the external browser.  The plug
+        is told to close without waiting for it, so the tab always closes.
 
         """
 
@@ -139,91 +197,177 @@ class BrowserSock(BrowserTabBase):
             # First diconnect the signal handler so it doesn't try to handle
             # signals when the browser is closed.
             self._disconnect_receiver()
-            try:
-                ret_val = self._plug.exit(self._socket_id)
-            except dbus.exceptions.DBusException as err:
-                self.print_message("Error closing tab: %s" % err, MSGCOLOR)
-                ret_val = True
-            finally:
-                self._plug = None
-                return ret_val
+            self._closed = True
+            self._call_plug('exit', self._socket_id)
+            self._plug = None
+            return True
+        elif self._discarded:
+            self._closed = True
+            return True
         else:
             return False
 
-    def _plug_access(func):
-        def wrap_func(self, *args):
-            try:
-                retval = func(self, *args)
-                return retval
-            except Exception as err:
-                self.print_message("Error accessing plug: %s" % err, MSGCOLOR)
-                return None
-        return wrap_func
-
-    @_plug_access
+    def discard(self, callback=None):
+        """ discard(callback=None) -> Save the history and close the
+        browser view to free its memory.  The tab keeps its title and icon
+        until restore is called.  callback is called once the view has been
+        told to close.  Returns False if there is no view to discard.
+
+        """
+
+        if not self._plug or self._closed:
+            return False
+
+        def history_received(history_str=''):
+            if not self._plug or self._closed:
+                return
+
+            # Go to the current history item instead of reloading the uri
+            # when restored.
+            self._history_str = history_str or self.do_get_history()
+            self._history_index = 2
+
+            self._disconnect_receiver()
+            self._closed = True
+            self._discarded = True
+            if self._socket.get_plug_window():
+                self._exit_count += 1
+            self._call_plug('exit', self._socket_id)
+            self._plug = None
+            if callback:
+                callback()
+
+        return self._call_plug('get_history', self._socket_id, 2, 
+                callback=history_received)
+
+    def set_placeholder(self, pid):
+        """ set_placeholder(pid) -> Make the tab a placeholder that gets a
+        browser view when restore is called, like a discarded tab.  pid is
+        the plug the tab was in when it was saved.
+
+        """
+
+        self._plug_pid = pid
+        self._closed = True
+        self._discarded = True
+
+    def restore(self):
+        """ restore -> Get ready for a new browser view after being
+        discarded.  Returns False if the tab was not discarded.
+
+        """
+
+        if not self._discarded:
+            return False
+
+        self._discarded = False
+        self._closed = False
+        self.set_used()
+        return True
+
+    def is_discarded(self):
+        """ is_discarded -> Return True if the browser view was discarded.
+
+        """
+
+        return self._discarded
+
+    def set_used(self):
+        """ set_used -> Remember that the tab was just used.
+
+        """
+
+        self._used_time = time()
+
+    def get_idle_time(self):
+        """ get_idle_time -> Return the seconds since the tab was last
+        used.
+
+        """
+
+        return time() - self._used_time
+
+    def set_usage(self, usage):
+        """ set_usage(usage) -> Set the (rss in bytes, cpu percent) of the
+        plug, or None if it isn't known.
+
+        """
+
+        self._usage = usage
+
+    def get_usage(self):
+        """ get_usage -> Return the (rss in bytes, cpu percent) of the
+        plug, or None if it isn't known.
+
+        """
+
+        return self._usage
+
     def do_zoom(self, direction):
         """ do_zoom(direction) -> Zoom in or out depending on direction.
         
         """
 
-        self._plug.zoom(self._socket_id, direction, 
-                reply_handler=lambda *args:None,
-                error_handler=lambda *args:None)
+        self._call_plug('zoom', self._socket_id, direction)
 
     def do_highlight_toggled(self, find_string, match_case, highlight_match):
-        return self._plug.set_highlight(self._socket_id, find_string, match_case, highlight_match)
+        self._call_plug('set_highlight', self._socket_id, find_string, 
+                match_case, highlight_match)
 
     def do_set_highlight(self, find_string, match_case, highlight):
-        return self._plug.set_highlight(self._socket_id, find_string, match_case, highlight)
+        self._call_plug('set_highlight', self._socket_id, find_string, 
+                match_case, highlight)
 
-    def do_find(self, find_string, match_case, find_direction, wrap_find):
-        return self._plug.find(self._socket_id, find_string, match_case, find_direction, wrap_find)
+    def do_find(self, find_string, match_case, find_direction, wrap_find, 
+            callback):
+        def find_done(found=False):
+            callback(bool(found))
+
+        if not self._call_plug('find', self._socket_id, find_string, 
+                match_case, find_direction, wrap_find, callback=find_done):
+            callback(False)
 
     def do_go_to(self, uri):
         if self._plug:
-            self._plug.load_uri(uri, self._socket_id, 
-                    reply_handler=lambda *args:None, 
-                    error_handler=lambda *args:None)
+            self._call_plug('load_uri', uri, self._socket_id)
             self._page_loading = True
         else:
             self._uri=uri
 
-    @_plug_access
+    # The history getters read the last state snapshot the plug sent, so
+    # they never wait on the plug.
     def do_get_history_length(self):
-        return self._plug.get_history_length(self._socket_id)
+        return self._state.get_history_length()
 
     def do_get_back_forward_item(self, index):
-        return self._plug.get_back_forward_item(self._socket_id, index)
+        return self._state.get_back_forward_item(index)
 
     def do_get_history(self, index=2):
-        return self._plug.get_history(self._socket_id, index)
+        if not self._state.version:
+            # Nothing has been received from the plug yet.
+            return self.get_history_str()
+        return self._state.get_history(index)
 
     def do_get_current_item(self):
-        return self._plug.get_current_item(self._socket_id)
+        return self._state.get_current_item()
 
     def do_get_back_item(self):
-        return self._plug.get_back_item(self._socket_id)
+        return self._state.get_back_item()
 
     def do_get_forward_item(self):
-        return self._plug.get_forward_item(self._socket_id)
+        return self._state.get_forward_item()
 
     def do_get_history_item(self, index):
-        return self._plug.get_history_item(self._socket_id, index)
+        return self._state.get_history_item(index)
 
     def do_go_to_history_item(self, index):
-        self._plug.go_to_history_item(self._socket_id, index,
-                reply_handler=lambda *args:None, 
-                error_handler=lambda *args:None)
+        self._call_plug('go_to_history_item', self._socket_id, index)
 
     def do_go_back(self):
-        self._plug.go_back(self._socket_id, 
-                reply_handler=lambda *args:None,
-                error_handler=lambda *args:None)
+        self._call_plug('go_back', self._socket_id)
 
     def do_go_forward(self):
-        self._plug.go_forward(self._socket_id, 
-                reply_handler=lambda *args:None,
-                error_handler=lambda *args:None)
+        self._call_plug('go_forward', self._socket_id)
 
     def get_save_list(self):
         """ get_save_list() -> Get the information necessary to restore the tab
@@ -241,8 +385,13 @@ class BrowserSock(BrowserTabBase):
 
         """
 
-        return {'pid':str(self.get_pid()), 
-                'history':json.loads(self.get_history_str())}
+        history = json.loads(self.get_history_str())
+
+        # A tab waiting for its load has no history yet, so save its uri.
+        if not history and self._uri and self._uri != 'about:blank':
+            history = [1, [[self._uri, self._uri]]]
+
+        return {'pid':str(self.get_pid()), 'history':history}
 
     def get_pid(self):
         return self._plug_pid
@@ -257,12 +406,24 @@ class BrowserSock(BrowserTabBase):
         self._plug_pid = pid
 
     def _plug_added(self, socket):
-        pass
+        self.emit('browser-plug-added')
         #print(socket.window.get_children()[0].get_user_data())
 
     def _plug_removed(self, socket):
+        if self._exit_count:
+            # A discarded plug has exited.
+            self._exit_count -= 1
+            return True
+
+        if self._closed:
+            # The plug was told to close.
+            return True
+
+        # Go back to the current history item when the plug is restarted,
+        # or load the uri again if there is no history yet.
+        if self._history_str:
+            self._history_index = 2
         self._died = True
-        self._uri = ''
         self._disconnect_receiver()
         self.print_message("browsebox: plug died (pid %d) restarting" % self.get_pid(), MSGCOLOR)
         self.emit('browser-plug-died', self.get_pid())
@@ -271,13 +432,20 @@ class BrowserSock(BrowserTabBase):
     def _connect_receiver(self, pid):
         bus = dbus.SessionBus()
         for signal_name, handler_func in self._bus_receiver_dict.iteritems():
-            bus.add_signal_receiver(handler_func, dbus_interface=BrowserSock.INTERFACE % pid, signal_name=signal_name)
+            if self.transport == 'socket' and signal_name != 'send_pid':
+                ipc_bus.add_signal_receiver(handler_func, signal_name, pid)
+            else:
+                bus.add_signal_receiver(handler_func, dbus_interface=BrowserSock.INTERFACE % pid, signal_name=signal_name)
 
     def _disconnect_receiver(self):
         bus = dbus.SessionBus()
         if self.get_pid():
             for signal_name, handler_func in self._bus_receiver_dict.iteritems():
-                bus.remove_signal_receiver(handler_func, dbus_interface=BrowserSock.INTERFACE % self.get_pid(), signal_name=signal_name)
+                if self.transport == 'socket' and signal_name != 'send_pid':
+                    ipc_bus.remove_signal_receiver(handler_func, 
+                            signal_name, self.get_pid())
+                else:
+                    bus.remove_signal_receiver(handler_func, dbus_interface=BrowserSock.INTERFACE % self.get_pid(), signal_name=signal_name)
 
     def _receive_new_tab(self, uri, flags, socket_id):
         """ _receive_new_tab(uri, flags, socket_id) -> Open
@@ -332,6 +500,26 @@ class BrowserSock(BrowserTabBase):
             if self._died or not self._plug:
                 self.setup_socket(pid)
 
+    def _receive_update(self, progress, hover_uri, can_go_back, 
+            can_go_forward, mask, socket_id):
+        """ _receive_update(progress, hover_uri, can_go_back, 
+        can_go_forward, mask, socket_id) -> Handle the values in a combined
+        update that have their bit set in mask.
+
+        """
+
+        if socket_id == self._socket_id:
+            if mask & UPDATE_BACK_FORWARD:
+                self.do_receive_back_forward(can_go_back, can_go_forward)
+            if mask & UPDATE_PROGRESS:
+                self.do_receive_progress(progress)
+            if mask & UPDATE_HOVER_URI:
+                self.do_receive_hover_uri(hover_uri)
+
+    def _receive_state(self, version, state_str, socket_id):
+        if socket_id == self._socket_id:
+            self.set_state(version, state_str)
+
     def _receive_title(self, title, socket_id):
         if socket_id == self._socket_id:
             self.do_receive_title(title)
@@ -353,27 +541,23 @@ class BrowserSock(BrowserTabBase):
         self._died = False
         self._socket_id = self.get_socket_id()
 
-        bus = dbus.SessionBus()
-        self._plug = bus.get_object('com.browser.plug%d' % pid, '/bplug%d' % pid)
+        if self.transport == 'socket':
+            self._plug = ipc_bus.get_object(pid)
+        else:
+            bus = dbus.SessionBus()
+            self._plug = bus.get_object('com.browser.plug%d' % pid, '/bplug%d' % pid)
+
+        # The new plug starts counting state versions again.
+        self._state = TabState()
 
         if not self._popup:
-            #try:
-            self._plug.set_profile(self._profile, 
-                    reply_handler=lambda *args:None, 
-                    error_handler=lambda *args:None)
-            self._plug.set_socket_id(self._socket_id, 
-                    reply_handler=lambda *args:None, 
-                    error_handler=lambda *args:None)
-            #except:
-                #pass
+            self._call_plug('set_profile', self._profile)
+            self._call_plug('set_log_levels', log_registry.get_levels())
+            self._call_plug('set_socket_id', self._socket_id)
 
         if self._history_str:
-            #try:
-            self._plug.set_history(self._socket_id, self._history_str, 
-                    reply_handler=lambda *args:None, 
-                    error_handler=lambda *args:None)
-            #except:
-                #pass
+            self._call_plug('set_history', self._socket_id, 
+                    self._history_str)
 
         if self._uri:
             if self._history_index == 1:
@@ -398,6 +582,16 @@ class BrowserReceiver(dbus.gobject_service.ExportedGObject):
     def get_socket_id(self, pid):
         return self.emit('get-socket-id', pid)
 
+    @dbus.service.signal(dbus_interface=MAIN_INTERFACE_NAME, 
+                        signature='a{su}')
+    def log_levels_changed(self, level_dict):
+        """ log_levels_changed(level_dict) -> Tell the plugs the new log
+        levels.
+
+        """
+
+        pass
+
 class Browser(BrowserBase):
 
     INTERFACE = "com.browser.main%d"
@@ -433,6 +627,7 @@ class Browser(BrowserBase):
 
         bus_receiver_dict = {
                 'print_message_signal': self._receive_print_message,
+                'print_message_batch': self._receive_print_message_batch,
                 }
 
         for signal_name, handler_func in bus_receiver_dict.iteritems():
@@ -458,6 +653,15 @@ class Browser(BrowserBase):
 
         self.print_message(message, color, data_color)
 
+    def _receive_print_message_batch(self, message_list):
+        """ _receive_print_message_batch(message_list) -> Log each
+        (message, color, data_color) in message_list to the debug console.
+
+        """
+
+        for message, color, data_color in message_list:
+            self.print_message(message, color, data_color)
+
     def _get_socket_id(self, receiver, pid):
         return self.do_open_tab(pid=pid, popup=True).get_socket_id()
 
@@ -519,7 +723,7 @@ class Browser(BrowserBase):
         return browsebox
 
     def do_open_tab(self, flags=0, tab=None, uri=None, popup=False, 
-            pid=None, history_str='', history_index=1):
+            pid=None, history_str='', history_index=1, background=False):
 
         if not tab:
             tab = self._current_tab
@@ -123,8 +123,10 @@ class BrowserTab(BrowserTabBase):
     def do_set_highlight(self, find_string, match_case, highlight):
         return self._browser_view.set_highlight(find_string, match_case, highlight)
 
-    def do_find(self, find_string, match_case, find_direction, wrap_find):
-        return self._browser_view.find(find_string, match_case, find_direction, wrap_find)
+    def do_find(self, find_string, match_case, find_direction, wrap_find, 
+            callback):
+        callback(self._browser_view.find(find_string, match_case, 
+            find_direction, wrap_find))
 
     def do_go_to(self, uri):
         if self._browser_view:
@@ -224,7 +226,7 @@ class Browser(BrowserBase):
         return browsebox
 
     def do_open_tab(self, flags=0, tab=None, uri=None, popup=False, 
-            pid=None, history_str='', history_index=1):
+            pid=None, history_str='', history_index=1, background=False):
 
         if not tab:
             tab = self._current_tab
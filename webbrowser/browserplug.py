@@ -24,9 +24,14 @@ with the main window over dbus.
 
 import warnings
 import os
+import socket
+import threading
+import json
 from sys import argv
+from time import time
 
 import gtk
+import glib
 import gobject
 
 import dbus
@@ -36,7 +41,31 @@ import dbus.mainloop.glib
 
 from browserplug_classes import BrowserView, MSGCOLOR
 from functions import redirect_warnings, print_message
-from defaults import PLUG_INTERFACE_NAME
+from log_levels import log_registry
+from plug_ipc import IPCServer, IPCConnection, socket_path
+from startup_profile import startup_profile
+from defaults import PLUG_INTERFACE_NAME, UPDATE_PROGRESS, UPDATE_HOVER_URI
+from defaults import UPDATE_BACK_FORWARD
+
+startup_profile.mark('imports')
+
+# Debug messages are sent to the main window in batches every
+# MESSAGE_BATCH_INTERVAL milliseconds, or as soon as MESSAGE_BATCH_SIZE are
+# waiting.
+MESSAGE_BATCH_INTERVAL = 100
+MESSAGE_BATCH_SIZE = 200
+
+# Progress, hover uri and back forward changes are merged and sent to each
+# tab at most once every UPDATE_INTERVAL milliseconds.
+UPDATE_INTERVAL = 33
+
+# At most MESSAGE_RATE_LIMIT messages of each category are sent each second.
+# The rest are dropped and counted.
+MESSAGE_RATE_LIMIT = 500
+
+# The pid of the main window.  Plugs forked by the zygote are not its
+# children, so they are given its pid in the environment.
+MAIN_PID = int(os.environ.get('BROWSER_MAIN_PID', os.getppid()))
 
 class PlugBrowser(BrowserView):
     """ A browser class to put in a gtk plug.
@@ -97,7 +126,7 @@ class PlugSender(dbus.gobject_service.ExportedGObject):
 
     # Define the interfaces used to communicate with the tabs and main window.
     TAB_INTERFACE = 'com.browser.tab%d' % os.getpid()
-    MAIN_INTERFACE = 'com.browser.main%d' % os.getppid()
+    MAIN_INTERFACE = 'com.browser.main%d' % MAIN_PID
 
     def __init__(self, bus, object_path):
         """ PlugSender(bus, object_path) -> Setup the dbus bus to communicate
@@ -108,6 +137,25 @@ class PlugSender(dbus.gobject_service.ExportedGObject):
         super(PlugSender, self).__init__(bus, object_path)
         self._pid = os.getpid()
 
+        # Messages waiting to be sent in the next batch.
+        self._message_list = []
+        self._message_lock = threading.Lock()
+        self._flush_id = None
+
+        # The number of messages of each category sent in the current rate
+        # window, and the number dropped since they were last reported.
+        self._rate_start = time()
+        self._rate_dict = {}
+        self._dropped_dict = {}
+        self._summary_time = 0
+
+        self.sent_count = 0
+        self.dropped_count = 0
+
+        # If set, signal_func(signal_name, *args) sends the message batches
+        # instead of dbus.
+        self.signal_func = None
+
     def _showwarning(self, message, category, filename, lineno, file=None, 
             line=None):
         """ _showwarning(message, category, filename, lineno, file=None, 
@@ -127,8 +175,84 @@ class PlugSender(dbus.gobject_service.ExportedGObject):
         
         """
 
-        self.print_message_signal('browserplug %d: %s' % 
-                (self._pid, message), color, data_color)
+        if not log_registry.is_color_enabled(data_color):
+            return
+
+        category = log_registry.get_category(data_color)
+
+        with self._message_lock:
+            now = time()
+            if now - self._rate_start >= 1:
+                self._rate_start = now
+                self._rate_dict.clear()
+            rate_count = self._rate_dict.get(category, 0) + 1
+            self._rate_dict[category] = rate_count
+
+            if rate_count > MESSAGE_RATE_LIMIT:
+                # Too many messages, so just count it.
+                self._dropped_dict[category] = \
+                        self._dropped_dict.get(category, 0) + 1
+                self.dropped_count += 1
+                return
+
+            self._message_list.append(('browserplug %d: %s' % 
+                (self._pid, message), color, data_color))
+
+            flush_now = len(self._message_list) >= MESSAGE_BATCH_SIZE
+            if not flush_now and not self._flush_id:
+                self._flush_id = glib.timeout_add(MESSAGE_BATCH_INTERVAL, 
+                        self.flush_messages, False)
+
+        if flush_now:
+            self.flush_messages(False)
+
+    def flush_messages(self, final=True):
+        """ flush_messages(final=True) -> Send the waiting messages to the
+        main window in one signal.  A line for each category that had
+        messages suppressed is added once a second, or now if final is True.
+
+        """
+
+        with self._message_lock:
+            if self._flush_id:
+                glib.source_remove(self._flush_id)
+                self._flush_id = None
+
+            message_list = self._message_list
+            self._message_list = []
+
+            now = time()
+            if self._dropped_dict and (final or \
+                    now - self._summary_time >= 1):
+                self._summary_time = now
+                for category, count in sorted(self._dropped_dict.iteritems()):
+                    message_list.append(('browserplug %d: warning: %d %s '
+                        'messages suppressed' % (self._pid, count, category),
+                        MSGCOLOR, '38;5;96'))
+                self._dropped_dict.clear()
+
+            if self._dropped_dict and not self._flush_id:
+                # Come back for the suppressed lines.
+                self._flush_id = glib.timeout_add(MESSAGE_BATCH_INTERVAL, 
+                        self.flush_messages, False)
+
+        if message_list:
+            self.sent_count += len(message_list)
+            if self.signal_func:
+                self.signal_func('print_message_batch', message_list)
+            else:
+                self.print_message_batch(message_list)
+
+        return False
+
+    @dbus.service.signal(dbus_interface=MAIN_INTERFACE, signature='a(sus)')
+    def print_message_batch(self, message_list): 
+        """ print_message_batch(message_list) -> Sends a list of 
+        (message, color, data_color) tuples to the main window.
+        
+        """
+
+        pass
 
     @dbus.service.signal(dbus_interface=MAIN_INTERFACE,signature='sus')
     def print_message_signal(self, message, color, data_color): 
@@ -139,6 +263,25 @@ class PlugSender(dbus.gobject_service.ExportedGObject):
 
         pass
 
+    @dbus.service.signal(dbus_interface=MAIN_INTERFACE,signature='u')
+    def plug_ready(self, pid): 
+        """ plug_ready(pid) -> Tell the main window that this process is
+        ready to be given tabs.
+        
+        """
+
+        pass
+
+    @dbus.service.signal(dbus_interface=MAIN_INTERFACE,signature='us')
+    def startup_phases(self, pid, phases_str): 
+        """ startup_phases(pid, phases_str) -> Send the main window how long
+        each phase of starting this process took, as a json list of
+        [name, seconds].
+        
+        """
+
+        pass
+
     @dbus.service.signal(dbus_interface=TAB_INTERFACE)
     def send_new_tab(self, uri, flags, socket_id):
         """ send_new_tab(uri, flags, socket_id) -> Send a request for a new
@@ -198,8 +341,9 @@ class PlugSender(dbus.gobject_service.ExportedGObject):
 
         """
 
-        self.print_message( "sending favicon uri: %s" % uri, MSGCOLOR, 
-                '38;5;138')
+        if log_registry.is_enabled('favicon'):
+            self.print_message( "sending favicon uri: %s" % uri, MSGCOLOR, 
+                    '38;5;138')
 
     @dbus.service.signal(dbus_interface=TAB_INTERFACE,signature='du')
     def send_progress(self, progress, socket_id):
@@ -216,8 +360,9 @@ class PlugSender(dbus.gobject_service.ExportedGObject):
 
         """
 
-        self.print_message( "sending uri: %s (pid: %d, socket_id: %d)" % 
-                (uri, self._pid, socket_id), MSGCOLOR, '38;5;175')
+        if log_registry.is_enabled('send'):
+            self.print_message( "sending uri: %s (pid: %d, socket_id: %d)" % 
+                    (uri, self._pid, socket_id), MSGCOLOR, '38;5;175')
 
     @dbus.service.signal(dbus_interface=TAB_INTERFACE,signature='su')
     def send_title(self, title, socket_id):
@@ -225,8 +370,30 @@ class PlugSender(dbus.gobject_service.ExportedGObject):
 
         """
 
-        self.print_message( "sending title: %s (pid: %d, socket_id: %d)" % 
-                (title, self._pid, socket_id), MSGCOLOR, '38;5;178')
+        if log_registry.is_enabled('title'):
+            self.print_message( "sending title: %s (pid: %d, socket_id: %d)" % 
+                    (title, self._pid, socket_id), MSGCOLOR, '38;5;178')
+
+    @dbus.service.signal(dbus_interface=TAB_INTERFACE,signature='dsbbuu')
+    def send_update(self, progress, hover_uri, can_go_back, can_go_forward, 
+            mask, socket_id):
+        """ send_update(progress, hover_uri, can_go_back, can_go_forward, 
+        mask, socket_id) -> Send the latest progress, hover uri and back 
+        forward state to the tab.  Only the values with their bit set in 
+        mask have changed.
+
+        """
+
+        pass
+
+    @dbus.service.signal(dbus_interface=TAB_INTERFACE,signature='usu')
+    def send_state(self, version, state_str, socket_id):
+        """ send_state(version, state_str, socket_id) -> Send a snapshot of
+        the browser state to the tab.
+
+        """
+
+        pass
 
     @dbus.service.signal(dbus_interface=TAB_INTERFACE,signature='u')
     def send_pid(self, pid):
@@ -307,6 +474,8 @@ class PlugReceiver(dbus.gobject_service.ExportedGObject):
                 (gobject.TYPE_LONG, gobject.TYPE_STRING)),
             'exit' : (gobject.SIGNAL_RUN_LAST, gobject.TYPE_BOOLEAN, 
                     (gobject.TYPE_LONG,)),
+            'set-log-levels' : (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, 
+                    (gobject.TYPE_PYOBJECT,)),
             }
 
     def __init__(self, bus, object_path):
@@ -326,6 +495,16 @@ class PlugReceiver(dbus.gobject_service.ExportedGObject):
 
         self.profile = profile
 
+    @dbus.service.method(dbus_interface=PLUG_INTERFACE_NAME, 
+                        in_signature='a{su}')
+    def set_log_levels(self, level_dict):
+        """ set_log_levels(level_dict) -> Set the level of each log 
+        category in level_dict.
+
+        """
+
+        self.emit('set-log-levels', level_dict)
+
     @dbus.service.method(dbus_interface=PLUG_INTERFACE_NAME, in_signature='u')
     def print_page(self, socket_id):
         """ print_page -> Tell the main signal handler that the browser wants
@@ -572,9 +751,12 @@ class PlugMain(object):
 
     """
 
-    def __init__(self, bus, main_path=''):
-        """ PlugMain(bus) -> Setup the sender and receiver of dbus messages,
-        and open and close tab plugs.
+    def __init__(self, bus, main_path='', transport='dbus'):
+        """ PlugMain(bus, main_path='', transport='dbus') -> Setup the 
+        sender and receiver of dbus messages, and open and close tab plugs.
+        If transport is 'socket' the main window talks to this process
+        over a unix socket instead, and dbus is only used to announce the
+        pid.
 
         """
 
@@ -582,6 +764,17 @@ class PlugMain(object):
 
         self._pid = os.getpid()
         self._plug_dict = {}
+
+        # The changes waiting to be sent to each tab as 
+        # socket_id: [mask, progress, hover_uri, can_go_back, can_go_forward]
+        self._update_dict = {}
+        self._update_id = None
+
+        # The number of updates sent, and the number of changes that were
+        # replaced by a newer one before they were sent.
+        self.updates_sent = 0
+        self.events_coalesced = 0
+
         self._plug_connect_dict = {
             'new-tab' : self.plug_new_tab,
             'message' : self.plug_message,
@@ -592,6 +785,7 @@ class PlugMain(object):
             'back-forward' : self.plug_back_forward,
             'download-uri' : self.plug_download_uri,
             'title-changed' : self.plug_title_changed,
+            'state-changed' : self.plug_state_changed,
             'embed-mime-uri' : self.plug_embed_mime_uri,
             'progress-changed' : self.plug_progress_changed,
             'show-hide-download' : self.plug_show_hide_download,
@@ -601,10 +795,33 @@ class PlugMain(object):
         self._receiver = PlugReceiver(bus, '/bplug%d' % self._pid)
         self._connect_receiver()
 
+        # Follow the log levels set in the main window.
+        bus.add_signal_receiver(self._log_levels_changed, 
+                signal_name='log_levels_changed', 
+                dbus_interface=PlugSender.MAIN_INTERFACE, 
+                path=self._main_path)
+
         # Setup the message sender.
         self._sender = PlugSender(dbus.SessionBus(), 
                 '/bplug_sender%s' % main_path)
+
+        # Listen for the main window on a unix socket.  Until it connects
+        # the signals are sent over dbus.
+        self._connection_list = []
+        self._server = None
+        if transport == 'socket':
+            try:
+                self._server = IPCServer(socket_path(self._pid), 
+                        self._new_connection)
+                self._sender.signal_func = self._emit
+            except (socket.error, OSError) as err:
+                print_message("browserplug %d: unable to listen on socket: "
+                        "%s" % (self._pid, err), MSGCOLOR)
+
+        startup_profile.mark('plug-main')
+
         self._sender.send_pid(self._pid)
+        self._sender.plug_ready(self._pid)
 
     def run(self):
         """ run -> Start a new gtk main loop.
@@ -616,6 +833,48 @@ class PlugMain(object):
         with redirect_warnings(self._sender._showwarning):
             gtk.main()
 
+    def _new_connection(self, sock):
+        """ _new_connection(sock) -> Start handling method calls from
+        the main window on sock, and send it signals from now on.
+
+        """
+
+        connection = IPCConnection(sock, method_func=self._call_method, 
+                close_func=self._connection_closed)
+        connection.emit_signal('hello', (self._main_path,))
+        self._connection_list.append(connection)
+
+    def _connection_closed(self, connection):
+        """ _connection_closed(connection) -> Forget a closed connection.
+
+        """
+
+        if connection in self._connection_list:
+            self._connection_list.remove(connection)
+
+    def _call_method(self, method_name, args):
+        """ _call_method(method_name, args) -> Call the receiver's dbus
+        method method_name with args and return its result.
+
+        """
+
+        method = getattr(self._receiver, method_name, None)
+        if not getattr(method, '_dbus_is_method', False):
+            raise AttributeError("no method %s" % method_name)
+        return method(*args)
+
+    def _emit(self, signal_name, *args):
+        """ _emit(signal_name, *args) -> Send a signal to the main window
+        over the socket if it is connected, otherwise over dbus.
+
+        """
+
+        if self._connection_list:
+            for connection in self._connection_list:
+                connection.emit_signal(signal_name, args)
+        else:
+            getattr(self._sender, signal_name)(*args)
+
     def _connect_receiver(self):
         """ _connect_receiver -> Connect signal handlers to the signals
         emitted by the message receiver.
@@ -648,6 +907,7 @@ class PlugMain(object):
                 'go-to-history-item' : self.go_to_history_item,
                 'get-back-forward-item' : self.get_back_forward_item,
                 'get-current-history-index' : self.get_current_history_index,
+                'set-log-levels' : self.set_log_levels,
                 }
 
         for signal, callback in connect_dict.iteritems():
@@ -681,8 +941,19 @@ class PlugMain(object):
 
         """
 
+        startup_profile.mark('wait-for-tab')
+
         browser_plug = PlugBrowser(socket_id, self._receiver.profile)
         self._plug_dict[socket_id] = browser_plug
+
+        # Tell the main window how long the first browser view took to
+        # show up.
+        if not startup_profile.is_finished():
+            startup_profile.mark('browser-view')
+            self._sender.startup_phases(self._pid, 
+                    json.dumps(startup_profile.get_phases()))
+            startup_profile.finish()
+
         return browser_plug
 
     ######################
@@ -697,6 +968,7 @@ class PlugMain(object):
         """
 
         browser_plug = self._plug_dict.pop(socket_id, None)
+        self._update_dict.pop(socket_id, None)
         if self._plug_dict:
             if browser_plug:
                 self._sender.print_message("removing socket (%d)" % 
@@ -705,7 +977,12 @@ class PlugMain(object):
             else:
                 return False
         else:
-            self._sender.print_message("exiting...", MSGCOLOR)
+            self._sender.print_message("exiting... (%d updates sent, %d "
+                    "changes coalesced)" % (self.updates_sent, 
+                        self.events_coalesced), MSGCOLOR)
+            self._sender.flush_messages()
+            if self._server:
+                self._server.close()
             print_message("browserplug %d: exiting..." % self._pid, MSGCOLOR)
             gtk.main_quit()
             return browser_plug.close()
@@ -917,6 +1194,22 @@ class PlugMain(object):
         browser_plug = self.get_plug(socket_id)
         browser_plug.set_history(history_str)
 
+    def set_log_levels(self, receiver, level_dict):
+        """ set_log_levels(receiver, level_dict) -> Use the log levels in
+        level_dict.
+
+        """
+
+        log_registry.set_levels(level_dict)
+
+    def _log_levels_changed(self, level_dict):
+        """ _log_levels_changed(level_dict) -> Handle the main window
+        changing the log levels.
+
+        """
+
+        log_registry.set_levels(level_dict)
+
     def set_socket_id(self, receiver=None, socket_id=None):
         """ set_socket_id(receiver, socket_id) -> Create a new browser plug
         embedded in the socket owning 'socket_id.'
@@ -936,7 +1229,7 @@ class PlugMain(object):
         """
 
         new_bus = dbus.SessionBus()
-        obj = new_bus.get_object('com.browser.main%d' % os.getppid(), 
+        obj = new_bus.get_object('com.browser.main%d' % MAIN_PID, 
                 self._main_path)
         socket_id = obj.get_socket_id(self._pid)
         return socket_id
@@ -959,7 +1252,7 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_new_tab(uri, int(flags), 
+        self._emit('send_new_tab', uri, int(flags), 
                 browser_plug.get_socket_id())
 
     def plug_title_changed(self, browser_plug, title):
@@ -968,7 +1261,16 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_title(title, browser_plug.get_socket_id())
+        self._emit('send_title', title, browser_plug.get_socket_id())
+
+    def plug_state_changed(self, browser_plug, version, state_str):
+        """ plug_state_changed(browser_plug, version, state_str) -> Send
+        the new state snapshot to the parent tab.
+
+        """
+
+        self._emit('send_state', version, state_str, 
+                browser_plug.get_socket_id())
 
     def plug_back_forward(self, browser_plug, can_go_back, can_go_forward):
         """ plug_back_forward(browser_plug, can_go_back, can_go_forward) -> 
@@ -977,8 +1279,8 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_back_forward(can_go_back, can_go_forward, 
-                browser_plug.get_socket_id())
+        self._queue_update(browser_plug.get_socket_id(), UPDATE_BACK_FORWARD,
+                can_go_back=can_go_back, can_go_forward=can_go_forward)
 
     def plug_download_uri(self, browser_plug, filename, uri):
         """ plug_download_uri(browser_plug, filename, uri) -> Send the uri
@@ -986,7 +1288,7 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_download_uri(filename, uri, 
+        self._emit('send_download_uri', filename, uri, 
                 browser_plug.get_socket_id())
 
     def plug_embed_mime_uri(self, browser_plug, mimetype, uri, 
@@ -997,7 +1299,7 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_embed_mime_uri(mimetype, uri, handler_cmd_str, 
+        self._emit('send_embed_mime_uri', mimetype, uri, handler_cmd_str, 
                 browser_plug.get_socket_id())
 
     def plug_uri_changed(self, browser_plug, uri):
@@ -1006,7 +1308,7 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_uri(uri, browser_plug.get_socket_id())
+        self._emit('send_uri', uri, browser_plug.get_socket_id())
 
     def plug_hover_uri(self, browser_plug, uri):
         """ plug_hover_uri(browser_plug, uri) -> Send the current uri that
@@ -1014,7 +1316,8 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_hover_uri(uri, browser_plug.get_socket_id())
+        self._queue_update(browser_plug.get_socket_id(), UPDATE_HOVER_URI, 
+                hover_uri=uri)
 
     def plug_favicon_uri(self, browser_plug, uri):
         """ plug_favicon_uri(browser_plug, uri) -> Send the favicon uri of
@@ -1022,7 +1325,7 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_favicon_uri(uri, browser_plug.get_socket_id())
+        self._emit('send_favicon_uri', uri, browser_plug.get_socket_id())
 
     def plug_progress_changed(self, browser_plug, progress):
         """ plug_progress_changed(browser_plug, progress) -> Send the current
@@ -1030,7 +1333,52 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_progress(progress, browser_plug.get_socket_id())
+        self._queue_update(browser_plug.get_socket_id(), UPDATE_PROGRESS, 
+                progress=progress)
+
+    def _queue_update(self, socket_id, mask, progress=None, hover_uri=None,
+            can_go_back=None, can_go_forward=None):
+        """ _queue_update(socket_id, mask, progress=None, hover_uri=None,
+        can_go_back=None, can_go_forward=None) -> Merge the changed values 
+        into the update waiting to be sent to the tab at socket_id.
+
+        """
+
+        update = self._update_dict.setdefault(socket_id, 
+                [0, 0.0, '', False, False])
+        if update[0] & mask:
+            self.events_coalesced += 1
+        update[0] |= mask
+
+        if mask & UPDATE_PROGRESS:
+            update[1] = progress
+        if mask & UPDATE_HOVER_URI:
+            update[2] = hover_uri
+        if mask & UPDATE_BACK_FORWARD:
+            update[3] = can_go_back
+            update[4] = can_go_forward
+
+        if not self._update_id:
+            self._update_id = glib.timeout_add(UPDATE_INTERVAL, 
+                    self._send_updates)
+
+    def _send_updates(self):
+        """ _send_updates -> Send each tab one update with the latest of
+        its changes.
+
+        """
+
+        self._update_id = None
+        update_dict = self._update_dict
+        self._update_dict = {}
+
+        for socket_id, update in update_dict.iteritems():
+            mask, progress, hover_uri, can_go_back, can_go_forward = update
+            self._emit('send_update', progress, hover_uri, can_go_back, 
+                    can_go_forward, mask, socket_id)
+            self.updates_sent += 1
+
+        return False
 
     def plug_show_hide_download(self, browser_plug):
         """ plug_show_hide_download(browser_plug) -> Tell the parent tab
@@ -1038,7 +1386,7 @@ class PlugMain(object):
 
         """
 
-        self._sender.send_show_hide_download(browser_plug.get_socket_id())
+        self._emit('send_show_hide_download', browser_plug.get_socket_id())
 
     def plug_message(self, browser_plug, message, color, data_color):
         """ plug_message(browser_plug, message, color, data_color) -> Send
@@ -1048,11 +1396,20 @@ class PlugMain(object):
 
         self._sender.print_message(message, color, data_color)
 
-if __name__ == '__main__':
-    if argv[1:]:
-        main_path = argv[1]
+def main(args):
+    """ main(args) -> Start a plug for the main window at path args[0] that
+    talks to it over the transport args[1], and run it until it exits.
+
+    """
+
+    if args[0:]:
+        main_path = args[0]
     else:
         main_path = ''
+    if args[1:]:
+        transport = args[1]
+    else:
+        transport = 'dbus'
     # Setup the dbus main loop.
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
@@ -1060,7 +1417,11 @@ if __name__ == '__main__':
     # and the parent tabs.
     bus = dbus.SessionBus()
     dbusname = dbus.service.BusName(PLUG_INTERFACE_NAME, bus)
+    startup_profile.mark('dbus')
 
     # Start the main signal handler of this tab process.
-    plug = PlugMain(bus, main_path)
+    plug = PlugMain(bus, main_path, transport)
     plug.run()
+
+if __name__ == '__main__':
+    main(argv[1:])
@@ -43,6 +43,9 @@ import urllib2
 from classes import SearchMenu, SaveDialog, Config
 from file_watch import FileWatcher
 from plugin_loader import Plugins
+from resource_filter import ResourceFilterChain, FILTER_PASS, DEFAULT_PRIORITY
+from log_levels import log_registry
+from tab_state import TabState
 from functions import extern_load_uri
 from defaults import APP_NAME
 
@@ -91,6 +94,8 @@ class BrowserView(gtk.HPaned):
                 gobject.TYPE_PYOBJECT, (gobject.TYPE_STRING,)),
             'load-status' : (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE,
                 (gobject.TYPE_INT, )),
+            'state-changed' : (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE,
+                (gobject.TYPE_UINT, gobject.TYPE_STRING)),
             }
 
     def __init__(self, profile='default'):
@@ -102,6 +107,16 @@ class BrowserView(gtk.HPaned):
 
         super(BrowserView, self).__init__()
 
+        # Plugins add filters to this chain to see resource requests.  The 
+        # old 'resource-request' signal is only emitted if something 
+        # connected to it.
+        self._resource_filters = ResourceFilterChain(self._filter_error)
+        self._emit_resource_request = False
+
+        # The last state snapshot sent to the parent, and the idle callback
+        # that sends the next one.
+        self._state = TabState()
+        self._state_idle_id = None
 
         # We need to setup the proxy before we create the browser object.
         try:
@@ -201,6 +216,36 @@ class BrowserView(gtk.HPaned):
 
         self._web_inspector = None
 
+    def connect(self, signal, *args):
+        """ connect(signal, *args) -> Connect to signal, noting if anyone 
+        still uses the 'resource-request' signal.
+
+        """
+
+        if signal == 'resource-request':
+            self._emit_resource_request = True
+        return super(BrowserView, self).connect(signal, *args)
+
+    def add_resource_filter(self, name, filter_func, 
+            priority=DEFAULT_PRIORITY, observer=False):
+        """ add_resource_filter(name, filter_func, priority=DEFAULT_PRIORITY,
+        observer=False) -> Add filter_func to the resource filter chain.  It
+        is called with a ResourceRequest and returns FILTER_PASS, 
+        FILTER_BLOCK or a uri to load instead.  An observer sees every
+        request, even blocked ones, and its verdict is ignored.
+
+        """
+
+        self._resource_filters.add(name, filter_func, priority, observer)
+
+    def remove_resource_filter(self, name):
+        """ remove_resource_filter(name) -> Remove the named filter from the
+        resource filter chain.
+
+        """
+
+        self._resource_filters.remove(name)
+
     def _build_mime_handlers(self):
         """ _build_mime_handlers() -> Build and return a dictionary of mime
         types and the applications to handle them.
@@ -397,6 +442,19 @@ class BrowserView(gtk.HPaned):
                     menu_item.connect('toggled', callback)
             self._settings_menu.add(menu_item)
 
+        # Show the time spent in each resource filter.
+        stats_list = self._resource_filters.get_stats_list()
+        if stats_list:
+            filter_menu = gtk.Menu()
+            for stats_str in stats_list:
+                menu_item = gtk.MenuItem(stats_str)
+                menu_item.set_sensitive(False)
+                filter_menu.add(menu_item)
+            menu_item = gtk.MenuItem('Resource _Filters', True)
+            menu_item.set_submenu(filter_menu)
+            self._settings_menu.add(gtk.SeparatorMenuItem())
+            self._settings_menu.add(menu_item)
+
         self._settings_menu.show_all()
 
         settings_item = self._make_menu_item('gtk-preferences', 
@@ -504,6 +562,14 @@ class BrowserView(gtk.HPaned):
             #del self._browser
         #print("browser removed")
 
+    def _filter_error(self, message):
+        """ _filter_error(message) -> Log an error raised by a resource
+        filter as a warning.
+
+        """
+
+        self.print_message(message, MSGCOLOR, '38;5;96')
+
     def print_message(self, message, color=0, data_color=''): 
         """ print_message(message, color=0, data_color='') -> Send a message
         to the parent object.  color is used to distinguish between different
@@ -511,7 +577,10 @@ class BrowserView(gtk.HPaned):
 
         """
 
-        self.emit('message', message, color, data_color)
+        # Drop messages from disabled categories that the caller didn't
+        # check for itself.
+        if log_registry.is_color_enabled(data_color):
+            self.emit('message', message, color, data_color)
 
     def set_browser_setting(self, setting, value, save=True):
         """ set_browser_setting(setting, value, save=True) -> Set the browser 
@@ -815,11 +884,15 @@ class BrowserView(gtk.HPaned):
         if uri.startswith('javascript:'):
             # Execute if uri is a javascript.
             glib.idle_add(self._browser.execute_script, uri[11:])
-            self.print_message("Executing script: %s" % uri, MSGCOLOR, '38;5;64')
+            if log_registry.is_enabled('uri'):
+                self.print_message("Executing script: %s" % uri, MSGCOLOR, 
+                        '38;5;64')
         elif uri.startswith('mailto:'):
             extern_load_uri(uri)
         else:
-            self.print_message("Loading uri: %s" % uri, MSGCOLOR, '38;5;64')
+            if log_registry.is_enabled('uri'):
+                self.print_message("Loading uri: %s" % uri, MSGCOLOR, 
+                        '38;5;64')
             glib.idle_add(self._browser.load_uri, uri)
 
         return str(uri)
@@ -1058,6 +1131,49 @@ class BrowserView(gtk.HPaned):
         can_go_back = self._browser.can_go_back()
         can_go_forward = self._browser.can_go_forward()
         self.emit('back-forward', can_go_back, can_go_forward)
+        self._queue_state()
+
+    def _queue_state(self):
+        """ _queue_state() -> Send a new state snapshot to the parent once
+        the current changes are done.
+
+        """
+
+        if not self._state_idle_id:
+            self._state_idle_id = glib.idle_add(self._send_state)
+
+    def _send_state(self):
+        """ _send_state() -> Send a snapshot of the uri, title, load 
+        status and back forward history to the parent.
+
+        """
+
+        self._state_idle_id = None
+        if not self._browser:
+            return False
+
+        state = self._state
+        hist_list = self._browser.get_back_forward_list()
+        back_hist_length = hist_list.get_back_length()
+        forward_hist_length = hist_list.get_forward_length()
+
+        history_list = []
+        for i in xrange(-back_hist_length, forward_hist_length+1):
+            item = hist_list.get_nth_item(i)
+            if item:
+                history_list.append((item.get_title(), item.get_uri()))
+
+        state.version += 1
+        state.uri = self.get_uri()
+        state.title = self.get_title()
+        state.load_status = self.get_load_status()
+        state.can_go_back = self._browser.can_go_back()
+        state.can_go_forward = self._browser.can_go_forward()
+        state.history_list = history_list
+        state.back_length = back_hist_length
+
+        self.emit('state-changed', state.version, state.to_json())
+        return False
 
     def _browser_toggle_developer_extras(self, toggle_item):
         """ _browser_toggle_developer_extras -> Enable/Disable the developer
@@ -1109,14 +1225,16 @@ class BrowserView(gtk.HPaned):
 
         """
 
-        self.print_message("icon loaded: %s" % icon_uri, MSGCOLOR)
+        if log_registry.is_enabled('favicon'):
+            self.print_message("icon loaded: %s" % icon_uri, MSGCOLOR)
 
         # Send the icon_uri to the parent.
         self.emit('favicon-uri', icon_uri)
 
     def _browser_resource_request_starting(self, webview, webframe, resource, 
             request, response):
-        """ _browser_resource_request_starting -> Logs all resource requests.  
+        """ _browser_resource_request_starting -> Runs resource requests 
+        through the filter chain and logs them.
 
         """
 
@@ -1124,8 +1242,12 @@ class BrowserView(gtk.HPaned):
         if 'stream.php' in uri:
             print(resource.get_data())
 
-        result = self.emit('resource-request', uri)
-        self.print_message("resource request: %s" % uri, MSGCOLOR, '38;5;69')
+        result = self._resource_filters.run(uri)
+        if result is FILTER_PASS and self._emit_resource_request:
+            result = self.emit('resource-request', uri)
+        if log_registry.is_enabled('resource'):
+            self.print_message("resource request: %s" % uri, MSGCOLOR, 
+                    '38;5;69')
 
         if type(result) == str:
             request.set_uri(result)
@@ -1137,8 +1259,9 @@ class BrowserView(gtk.HPaned):
 
         """
 
-        self.print_message("mime requested: %s (uri=%s)" % (mimetype, 
-            request.get_uri()), MSGCOLOR, '38;5;202')
+        if log_registry.is_enabled('mime'):
+            self.print_message("mime requested: %s (uri=%s)" % (mimetype, 
+                request.get_uri()), MSGCOLOR, '38;5;202')
         if not webview.can_show_mime_type(mimetype):
             handler_cmd_str = self._mime_handler_dict.get(mimetype, None)
             if handler_cmd_str and \
@@ -1164,8 +1287,9 @@ class BrowserView(gtk.HPaned):
                     nav_action.get_modifier_state())
             return True
 
-        self.print_message("navigation policy requested: %s" % \
-                request.get_uri(), MSGCOLOR, '38;5;93')
+        if log_registry.is_enabled('navigation'):
+            self.print_message("navigation policy requested: %s" % \
+                    request.get_uri(), MSGCOLOR, '38;5;93')
 
         return False
 
@@ -1175,8 +1299,9 @@ class BrowserView(gtk.HPaned):
         """
 
         result = self.emit('plugin-request', uri)
-        self.print_message("plugin requested: %s mime %s" % (uri, \
-                mime_type), MSGCOLOR, '38;5;88')
+        if log_registry.is_enabled('plugin'):
+            self.print_message("plugin requested: %s mime %s" % (uri, \
+                    mime_type), MSGCOLOR, '38;5;88')
         if type(result) == gtk.Widget:
             return result
 
@@ -1195,8 +1320,9 @@ class BrowserView(gtk.HPaned):
 
         """
 
-        self.print_message("console message: line %d: %s (id %s)" % (line, \
-                message, source_id), MSGCOLOR, '38;5;196')
+        if log_registry.is_enabled('console'):
+            self.print_message("console message: line %d: %s (id %s)" % \
+                    (line, message, source_id), MSGCOLOR, '38;5;196')
         return True
 
     def _browser_property_changed(self, webview, property):
@@ -1235,8 +1361,9 @@ class BrowserView(gtk.HPaned):
 
         """
 
-        self.print_message('new window request: %s' % request.get_uri(), 
-                MSGCOLOR, '38;5;64')
+        if log_registry.is_enabled('uri'):
+            self.print_message('new window request: %s' % request.get_uri(), 
+                    MSGCOLOR, '38;5;64')
 
     def _browser_popup(self, webview, menu):
         """ _browser_popup -> Add and customize items in the browsers popup
@@ -1499,6 +1626,7 @@ class BrowserView(gtk.HPaned):
 
         title = webview.get_property(property.name)
         self._send_title(title)
+        self._queue_state()
 
         # This tabs web-inspector object.
         if self._web_inspector:
@@ -1573,9 +1701,11 @@ class BrowserView(gtk.HPaned):
         self.emit('progress-changed', progress)
         if progress == 0:
             self._send_title('Loading...')
+            self._queue_state()
         elif progress == 1:
             self._send_title(webview.get_property('title'))
             self.emit('load-status', 2)
+            self._queue_state()
 
     def _browser_view_ready(self, webview):
         print "ready"
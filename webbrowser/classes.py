@@ -25,6 +25,7 @@ import string
 import subprocess
 import json
 import threading
+from collections import deque
 from time import strftime, sleep
 
 import gtk
@@ -397,9 +398,10 @@ class LogView(gtk.ScrolledWindow):
     
     """
 
-    def __init__(self, font='', font_size=10):
-        """ LogView(font='Terminus', font_size=10) -> Create a scrolled text
-        view for logging debug output of the browser.
+    def __init__(self, font='', font_size=10, max_lines=5000):
+        """ LogView(font='Terminus', font_size=10, max_lines=5000) -> Create
+        a scrolled text view for logging debug output of the browser.  Only
+        the last max_lines messages are kept.
 
         """
 
@@ -441,6 +443,14 @@ class LogView(gtk.ScrolledWindow):
         # The lock used to keep messages from becoming scrambled.
         self._lock = threading.Lock()
 
+        # The last max_lines messages as (date, message, color, data_color)
+        # records, and the ones that haven't been added to the buffer yet.
+        # Both drop their oldest record when they are full.
+        self._max_lines = max_lines
+        self._record_list = deque(maxlen=max_lines)
+        self._pending_list = deque(maxlen=max_lines)
+        self._idle_id = None
+
         # Create a right-gravity mark to scroll to the end.
         end = self._text_buffer.get_end_iter()
         self._end_mark = self._text_buffer.create_mark('end', end, False)
@@ -468,6 +478,7 @@ class LogView(gtk.ScrolledWindow):
                 '38;5;175': 'send-uri',
                 '38;5;196': 'console-msg',
                 '1;38;5;196': 'block',
+                '38;5;30': 'monitor',
                 }
 
     def _setup_tags(self):
@@ -491,6 +502,7 @@ class LogView(gtk.ScrolledWindow):
                 'plugin': {'foreground': '#870000'},
                 'warning': {'foreground': '#875F87'},
                 'favicon': {'foreground': '#AF8787'},
+                'monitor': {'foreground': '#008787'},
                 'send-uri': {'foreground': '#D787AF'},
                 'download': {'foreground': '#5F00D7'},
                 'resource': {'foreground': '#5F87FF'},
@@ -504,14 +516,52 @@ class LogView(gtk.ScrolledWindow):
         for tag_name, properties in tag_dict.iteritems():
             self.add_tag(tag_name, **properties)
 
-    def _append_text_with_tag_name(self, text, tag_name=None):
-        """ _append_text_with_tab_name(text, tab_name=None) -> Append 'text'
-        to the text view.  If the view is scrolled to the bottom before the
-        text is added than scroll it to the bottom after adding it, otherwise
-        just leave it where it was.
+    def _split_record(self, date, message, color, data_color):
+        """ _split_record(date, message, color, data_color) -> Return a list
+        of (text, tag_name) pieces to display a message.
+
+        Split the message at colons into two or three pieces.  Use the first
+        color on the first piece, the second color on the second piece and no 
+        color on the third piece.  Add the date and time to the start of the 
+        message.
 
         """
 
+        tag_name1 = self._tag1_dict.get(color, None)
+        tag_name2 = self._tag2_dict.get(data_color, data_color)
+
+        if tag_name2 == '':
+            tag_name2 = None
+
+        message_group = [('%s ' % date, 'date-time')]
+
+        message_list = message.split(':',2 )
+        if message_list[1:]:
+            message_group.append((message_list[0], tag_name1))
+            message_group.append((':', None))
+            message_group.append((message_list[1], tag_name2))
+            if message_list[2:]:
+                message_group.append((':%s' % ''.join(message_list[2:]), None))
+        else:
+            message_group.append((message, None))
+
+        message_group.append(('\n', None))
+
+        return message_group
+
+    def _append_pending(self):
+        """ _append_pending -> Add all the waiting messages to the text 
+        view and trim the oldest lines.  If the view is scrolled to the 
+        bottom before the text is added than scroll it to the bottom after
+        adding it, otherwise just leave it where it was.
+
+        """
+
+        with self._lock:
+            self._idle_id = None
+            record_list = list(self._pending_list)
+            self._pending_list.clear()
+
         # Get the 'y' position of the last visible line.
         visible_rect = self._text_view.get_visible_rect()
         visible_y = visible_rect.y + visible_rect.height
@@ -521,10 +571,22 @@ class LogView(gtk.ScrolledWindow):
         # Get the last 'y' posisiton of the last line.
         end_y = self._text_view.get_line_yrange(end)
 
-        tag_name_list = ['default']
-        if tag_name:
-            tag_name_list.append(tag_name)
-        self._text_buffer.insert_with_tags_by_name(end, text, *tag_name_list)
+        for record in record_list:
+            for text, tag_name in self._split_record(*record):
+                if tag_name:
+                    self._text_buffer.insert_with_tags_by_name(end, text, 
+                            'default', tag_name)
+                else:
+                    self._text_buffer.insert_with_tags_by_name(end, text, 
+                            'default')
+
+        # Remove the oldest lines.  Messages can have newlines in them so
+        # this keeps a few more lines than messages.
+        extra_lines = self._text_buffer.get_line_count() - \
+                self._max_lines - 1
+        if extra_lines > 0:
+            self._text_buffer.delete(self._text_buffer.get_start_iter(), 
+                    self._text_buffer.get_iter_at_line(extra_lines))
 
         # Scroll on output if the last line is visible, or the views parent
         # is not visible.
@@ -532,6 +594,8 @@ class LogView(gtk.ScrolledWindow):
             # Scroll to the end of the buffer.
             self._text_view.scroll_mark_onscreen(self._end_mark)
 
+        return False
+
     def add_tag(self, tag_name, **tag_properties):
         """ add_tab(tab_name, **tag_properties) -> Add a new tag 'tag_name'
         with the properties from 'tag_properties.'
@@ -550,40 +614,27 @@ class LogView(gtk.ScrolledWindow):
 
     def log_message(self, message, color=None, data_color=None):
         """ log_message(message, color=None, data_color=None) -> Log
-        messages.
-
-        Split the message at colons into two or three pieces.  Use the first
-        color on the first piece, the second color on the second piece and no 
-        color on the third piece.  Add the date and time to the start of the 
-        message.
+        messages.  The message is queued and added to the text view with
+        any others that arrive before the main loop is idle.
 
         """
 
-        tag_name1 = self._tag1_dict.get(color, None)
-        tag_name2 = self._tag2_dict.get(data_color, data_color)
-
-        if tag_name2 == '':
-            tag_name2 = None
+        record = (strftime('%h %e %H:%M:%S'), message, color, data_color)
 
-        date = strftime('%h %e %H:%M:%S')
-        message_group = [('%s ' % date, 'date-time')]
+        with self._lock:
+            self._record_list.append(record)
+            self._pending_list.append(record)
+            if not self._idle_id:
+                self._idle_id = glib.idle_add(self._append_pending)
 
-        message_list = message.split(':',2 )
-        if message_list[1:]:
-            message_group.append((message_list[0], tag_name1))
-            message_group.append((':', None))
-            message_group.append((message_list[1], tag_name2))
-            if message_list[2:]:
-                message_group.append((':%s' % ''.join(message_list[2:]), None))
-        else:
-            message_group.append((message, None))
+    def get_records(self):
+        """ get_records -> Return a list of the kept messages as
+        (date, message, color, data_color) records, oldest first.
 
-        message_group.append(('\n', None))
+        """
 
-        self._lock.acquire()
-        for msg_tup in message_group:
-            glib.idle_add(self._append_text_with_tag_name, *msg_tup)
-        self._lock.release()
+        with self._lock:
+            return list(self._record_list)
 
     def write(self, data):
         """ write(data) -> A write method so we can use a LogView instead of
@@ -30,3 +30,9 @@ MAIN_INTERFACE_NAME = "com.browser.main%d" % os.getpid()
 # Define the interface used when connecting to a tab over dbus.
 PLUG_INTERFACE_NAME = "com.browser.plug%d" % os.getpid()
 
+
+# The bits of the mask sent with a combined tab update, saying which of its
+# values changed.
+UPDATE_PROGRESS = 1
+UPDATE_HOVER_URI = 2
+UPDATE_BACK_FORWARD = 4
@@ -0,0 +1,107 @@
+# This file is part of browser, and contains the browser launcher.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Starts the browser, or sends the uri to the one already running.
+
+Opening a link from another application while the browser is running only
+has to hand the uri to the running browser.  The launcher checks the pid
+file of the profile and makes the dbus load_uri call itself, without
+importing gtk, webkit or the rest of the browser.  The browser is only
+imported when it isn't running in the profile, or the call fails, and then
+it checks the profile again itself.
+
+"""
+
+import os
+import sys
+from optparse import OptionParser
+
+from defaults import APP_NAME
+
+
+def get_options():
+    """ Get the command line arguments.
+
+    """
+
+    opts = OptionParser("usage: %prog [options] [Address/Search Phrase]")
+    opts.add_option("-u", "--uri", action="store", type="string", dest="uri",
+            default='', help="Load uri")
+    opts.add_option("-p", "--profile", action="store", type="string", dest="profile",
+            default='default', help="Set profile")
+    opts.add_option("--startup-summary", action="store_true",
+            dest="startup_summary", default=False,
+            help="Print a summary of the recent startup times and exit")
+
+    options, args = opts.parse_args()
+    if args and not options.uri:
+        options.uri = ' '.join(args)
+
+    return options
+
+def get_running_pid(profile):
+    """ get_running_pid(profile) -> Return the pid of the browser running in
+    profile, or 0 if there isn't one.  The same as ProfileManager.first,
+    but without glib, and it leaves stale pid files for it to remove.
+
+    """
+
+    config_dir = os.environ.get('XDG_CONFIG_HOME', '') or \
+            os.path.expanduser('~/.config')
+    pid_file = '%s/%s/%s.pid' % (config_dir, APP_NAME, profile)
+
+    try:
+        with open(pid_file, 'r') as pid_file:
+            pid = int(pid_file.read())
+        # If the pid is still in use this will not raise an exception.
+        os.kill(pid, 0)
+        return pid
+    except (IOError, ValueError, OSError):
+        return 0
+
+def forward_uri(profile, uri):
+    """ forward_uri(profile, uri) -> Ask the browser running in profile to
+    load uri.  Returns True if it was sent.
+
+    """
+
+    import dbus
+
+    try:
+        bus = dbus.SessionBus()
+        bus.get_object('com.browser.main', '/%s' % profile).load_uri(uri)
+        return True
+    except dbus.DBusException as err:
+        print("Unable to send %s to the running browser: %s" % (uri, err))
+        return False
+
+def main():
+    """ main -> Send the uri to the running browser, or start a new one.
+
+    """
+
+    options = get_options()
+
+    if not options.startup_summary and get_running_pid(options.profile):
+        if forward_uri(options.profile, options.uri):
+            return
+
+    import browser
+    browser.main(options)
+
+if __name__ == '__main__':
+    main()
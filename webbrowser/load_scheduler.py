@@ -0,0 +1,186 @@
+# This file is part of browser, and contains the background load scheduler.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Queues the page loads of background tabs so only a few run at once.
+
+Opening a bookmark folder, reopening every closed tab, or pasting a list of
+tabs used to start every load at once.  The scheduler is shared by every
+window.  It starts queued loads in the order they were added, while fewer
+than max_loads of them are running and no window is loading its current
+tab.  A load is running until its tab says it has finished, or for
+LOAD_TIMEOUT seconds.  A current tab that is still loading after
+LOAD_TIMEOUT seconds, like a page that streams, stops holding up the queue.
+
+Tabs the user selects or opens one at a time are loaded at once, and don't
+wait in the queue.
+
+"""
+
+from time import time
+
+import glib
+
+# The default number of background loads that can run at once.
+MAX_LOADS = 4
+
+# Seconds before a load that hasn't finished stops counting.
+LOAD_TIMEOUT = 30
+
+# Seconds between checks for finished loads and a quiet foreground.
+CHECK_INTERVAL = 1
+
+
+class LoadScheduler(object):
+    """ LoadScheduler -> Start background loads a few at a time.
+
+    """
+
+    def __init__(self, is_busy, max_loads=MAX_LOADS):
+        """ LoadScheduler(is_busy, max_loads=MAX_LOADS) -> Run at most
+        max_loads background loads at once, and none while is_busy()
+        returns True.
+
+        """
+
+        self._is_busy = is_busy
+        self._max_loads = max(1, max_loads)
+
+        # (tab, start_func, time queued) of the loads waiting to start.
+        self._queue_list = []
+
+        # tab: (time started, load-finished handler id) of running loads.
+        self._loading_dict = {}
+
+        self._check_id = None
+
+        # When is_busy() started returning True, or 0 if it doesn't.
+        self._busy_time = 0
+
+        self.started = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def add(self, tab, start_func):
+        """ add(tab, start_func) -> Queue a background load of tab.
+        start_func(wait) is called with the seconds it waited to start the
+        load, and returns True if it started one.
+
+        """
+
+        self.remove(tab)
+        self._queue_list.append((tab, start_func, time()))
+        self._run()
+
+    def remove(self, tab):
+        """ remove(tab) -> Forget tab, because it was closed or selected.
+
+        """
+
+        self._queue_list = [item for item in self._queue_list if
+                item[0] != tab]
+        self._finished(tab)
+
+    def close(self):
+        """ close -> Forget every load.
+
+        """
+
+        for tab in self._loading_dict.keys():
+            self._finished(tab)
+        self._queue_list = []
+        if self._check_id:
+            glib.source_remove(self._check_id)
+            self._check_id = None
+
+    def get_stats_list(self):
+        """ get_stats_list -> Return a list of strings describing the queue.
+
+        """
+
+        average = self.total_wait / self.started if self.started else 0.0
+        return ["load scheduler: %d queued, %d loading, %d started, wait "
+                "%.1f s average, %.1f s max" % (len(self._queue_list),
+                    len(self._loading_dict), self.started, average,
+                    self.max_wait)]
+
+    def _run(self):
+        """ _run -> Start queued loads while there is room, and check back
+        later if anything is still queued or loading.
+
+        """
+
+        now = time()
+        for tab, (start_time, handler_id) in self._loading_dict.items():
+            if now - start_time > LOAD_TIMEOUT:
+                self._finished(tab)
+
+        while self._queue_list and not self._is_waiting(now) and \
+                len(self._loading_dict) < self._max_loads:
+            tab, start_func, queue_time = self._queue_list.pop(0)
+            wait = now - queue_time
+            handler_id = tab.connect('load-finished', self._load_finished)
+            self._loading_dict[tab] = (now, handler_id)
+            if not start_func(wait):
+                self._finished(tab)
+                continue
+            self.started += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        if (self._queue_list or self._loading_dict) and not self._check_id:
+            self._check_id = glib.timeout_add_seconds(CHECK_INTERVAL,
+                    self._check, priority=glib.PRIORITY_LOW)
+
+    def _is_waiting(self, now):
+        """ _is_waiting(now) -> Return True if the foreground has been busy
+        for less than LOAD_TIMEOUT seconds.
+
+        """
+
+        if not self._is_busy():
+            self._busy_time = 0
+            return False
+
+        if not self._busy_time:
+            self._busy_time = now
+        return now - self._busy_time < LOAD_TIMEOUT
+
+    def _check(self):
+        """ _check -> Run the queue from a timeout.
+
+        """
+
+        self._check_id = None
+        self._run()
+        return False
+
+    def _load_finished(self, tab):
+        """ _load_finished(tab) -> Make room for the next load.
+
+        """
+
+        self._finished(tab)
+        self._run()
+
+    def _finished(self, tab):
+        """ _finished(tab) -> Stop counting the load of tab.
+
+        """
+
+        if tab in self._loading_dict:
+            start_time, handler_id = self._loading_dict.pop(tab)
+            tab.disconnect(handler_id)
@@ -0,0 +1,195 @@
+# This file is part of browser, and contains the log level registry.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" A registry of log message categories and the level each one is shown at.
+
+Every debug message belongs to a category (resource, navigation, console,
+...) and has a level.  A message is only formatted and sent if its level is
+at least the level set for its category, so hot paths should check
+is_enabled before building their message:
+
+    if log_registry.is_enabled('resource'):
+        self.print_message("resource request: %s" % uri, ...)
+
+The main window owns the levels, and sends them to the plug processes when
+they change so each process keeps its own copy to check against.
+
+"""
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+# The names shown in the log level menu, in menu order.
+LEVEL_NAME_LIST = [
+        (OFF, 'Off'),
+        (ERROR, 'Error'),
+        (WARNING, 'Warning'),
+        (INFO, 'Info'),
+        (DEBUG, 'Debug'),
+        ]
+
+# category: (data_color, level its messages are logged at)
+CATEGORY_DICT = {
+        'resource': ('38;5;69', DEBUG),
+        'navigation': ('38;5;93', DEBUG),
+        'console': ('38;5;196', INFO),
+        'block': ('1;38;5;196', INFO),
+        'favicon': ('38;5;138', DEBUG),
+        'mime': ('38;5;202', DEBUG),
+        'plugin': ('38;5;88', DEBUG),
+        'uri': ('38;5;64', INFO),
+        'download': ('38;5;56', INFO),
+        'title': ('38;5;178', DEBUG),
+        'send': ('38;5;175', DEBUG),
+        'pid': ('38;5;180', INFO),
+        'monitor': ('38;5;30', DEBUG),
+        'warning': ('38;5;96', WARNING),
+        'general': ('', INFO),
+        }
+
+# Everything is shown by default.
+DEFAULT_LEVEL = DEBUG
+
+
+class LogRegistry(object):
+    """ LogRegistry -> Keep the level of each log category and tell
+    callbacks when they change.
+
+    """
+
+    def __init__(self):
+        """ Create a registry with every category at DEFAULT_LEVEL.
+
+        """
+
+        self._level_dict = dict.fromkeys(CATEGORY_DICT, DEFAULT_LEVEL)
+        self._color_dict = dict((data_color, category) for category,
+                (data_color, level) in CATEGORY_DICT.iteritems())
+        self._callback_list = []
+
+        # category: whether messages at the category's own level are shown.
+        self._enabled_dict = {}
+        self._update_enabled()
+
+    def _update_enabled(self):
+        """ _update_enabled -> Recompute which categories are enabled at
+        their default level.
+
+        """
+
+        self._enabled_dict = dict((category,
+            CATEGORY_DICT[category][1] >= level) for category, level in
+            self._level_dict.iteritems())
+
+    def is_enabled(self, category, level=None):
+        """ is_enabled(category, level=None) -> Return True if messages of
+        category at level should be logged.  If level is None the
+        category's own level is used.
+
+        """
+
+        if level is None:
+            return self._enabled_dict.get(category, True)
+        return level >= self._level_dict.get(category, DEFAULT_LEVEL)
+
+    def is_color_enabled(self, data_color):
+        """ is_color_enabled(data_color) -> Return True if messages with
+        data_color should be logged.  Used to filter messages that were
+        not checked by their caller.
+
+        """
+
+        category = self._color_dict.get(data_color, 'general')
+        return self._enabled_dict.get(category, True)
+
+    def get_category(self, data_color):
+        """ get_category(data_color) -> Return the category that messages
+        with data_color belong to.
+
+        """
+
+        return self._color_dict.get(data_color, 'general')
+
+    def get_level(self, category):
+        """ get_level(category) -> Return the level category is shown at.
+
+        """
+
+        return self._level_dict.get(category, DEFAULT_LEVEL)
+
+    def set_level(self, category, level):
+        """ set_level(category, level) -> Only show messages of category
+        that are at level or above.
+
+        """
+
+        self.set_levels({category: level})
+
+    def get_levels(self):
+        """ get_levels -> Return a dictionary of every category and its
+        level.
+
+        """
+
+        return self._level_dict.copy()
+
+    def set_levels(self, level_dict, notify=True):
+        """ set_levels(level_dict, notify=True) -> Set the level of each
+        category in level_dict.  Unknown categories are ignored.  If notify
+        is True the callbacks are called with the new levels.
+
+        """
+
+        changed = False
+        for category, level in level_dict.iteritems():
+            category = str(category)
+            if category in self._level_dict and \
+                    self._level_dict[category] != int(level):
+                self._level_dict[category] = int(level)
+                changed = True
+
+        if not changed:
+            return
+
+        self._update_enabled()
+        if notify:
+            for callback in self._callback_list:
+                callback(self.get_levels())
+
+    def add_callback(self, callback):
+        """ add_callback(callback) -> Call callback with the dictionary of
+        levels whenever a level changes.
+
+        """
+
+        if callback not in self._callback_list:
+            self._callback_list.append(callback)
+
+    def remove_callback(self, callback):
+        """ remove_callback(callback) -> Stop calling callback.
+
+        """
+
+        if callback in self._callback_list:
+            self._callback_list.remove(callback)
+
+
+# The levels used in this process.
+log_registry = LogRegistry()
@@ -0,0 +1,196 @@
+# This file is part of browser, and contains a log file writer.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Writes log records to a file from a background thread.
+
+Each record is written as one json list per line:
+
+    [timestamp, source, category, message]
+
+When the file grows past max_size it is rotated to filename.1.gz,
+filename.2.gz, ... keeping backup_count compressed files.
+
+"""
+
+import os
+import gzip
+import json
+import shutil
+import threading
+from time import time
+from Queue import Queue, Full, Empty
+
+# The default largest size of the log file before it is rotated.
+MAX_SIZE = 10 * 1024 * 1024
+
+# The default number of rotated files kept.
+BACKUP_COUNT = 5
+
+# The most records that can wait to be written before new ones are dropped.
+QUEUE_SIZE = 10000
+
+
+class LogSink(object):
+    """ LogSink -> Queue log records and write them to a file in a
+    background thread.
+
+    """
+
+    def __init__(self, filename, max_size=MAX_SIZE,
+            backup_count=BACKUP_COUNT):
+        """ LogSink(filename, max_size=MAX_SIZE, backup_count=BACKUP_COUNT)
+        -> Write records to filename and rotate it when it is bigger than
+        max_size bytes.
+
+        """
+
+        self._filename = filename
+        self._max_size = max_size
+        self._backup_count = backup_count
+
+        self._queue = Queue(QUEUE_SIZE)
+        self._thread = None
+
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        """ start -> Start the writer thread.
+
+        """
+
+        if self._thread:
+            return
+
+        self._thread = threading.Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ stop -> Write the waiting records and stop the writer thread.
+
+        """
+
+        if not self._thread:
+            return
+
+        # Don't hang the main loop if the writer has stopped taking records.
+        try:
+            self._queue.put(None, True, 5)
+        except Full:
+            print("Log writer for %s is not responding" % self._filename)
+        self._thread.join(5)
+        self._thread = None
+
+    def write(self, source, category, message, timestamp=None):
+        """ write(source, category, message, timestamp=None) -> Queue a
+        record to be written.  This never blocks; if the writer has fallen
+        behind the record is dropped and counted.
+
+        """
+
+        try:
+            self._queue.put_nowait((timestamp or time(), source, category,
+                message))
+        except Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        """ _write_loop -> Write records as they are queued until None is
+        queued.
+
+        """
+
+        log_file = self._open()
+        running = True
+
+        while running:
+            record_list = [self._queue.get()]
+
+            # Write everything that is waiting at once.
+            try:
+                while True:
+                    record_list.append(self._queue.get_nowait())
+            except Empty:
+                pass
+
+            if None in record_list:
+                running = False
+                record_list = record_list[:record_list.index(None)]
+
+            if not record_list:
+                continue
+
+            if not log_file:
+                self.dropped += len(record_list)
+                continue
+
+            rotate = False
+            try:
+                log_file.write(''.join('%s\n' % json.dumps(record,
+                    separators=(',', ':')) for record in record_list))
+                log_file.flush()
+                self.written += len(record_list)
+                rotate = log_file.tell() >= self._max_size
+            except (IOError, OSError, ValueError) as err:
+                print("Error writing log file %s: %s" % (self._filename,
+                    err))
+                self.dropped += len(record_list)
+
+            if rotate:
+                log_file.close()
+                try:
+                    self._rotate()
+                except (IOError, OSError) as err:
+                    print("Error rotating log file %s: %s" % (self._filename,
+                        err))
+                finally:
+                    # Keep writing even if it couldn't be rotated.
+                    log_file = self._open()
+
+        if log_file:
+            log_file.close()
+
+    def _open(self):
+        """ _open -> Open the log file for appending, or return None if it
+        can't be opened.
+
+        """
+
+        try:
+            return open(self._filename, 'a')
+        except IOError as err:
+            print("Error opening log file %s: %s" % (self._filename, err))
+            return None
+
+    def _rotate(self):
+        """ _rotate -> Compress the log file to filename.1.gz, moving the
+        older ones up and removing the oldest.
+
+        """
+
+        for index in range(self._backup_count - 1, 0, -1):
+            old_name = '%s.%d.gz' % (self._filename, index)
+            if os.path.exists(old_name):
+                os.rename(old_name, '%s.%d.gz' % (self._filename, index + 1))
+
+        if self._backup_count > 0:
+            with open(self._filename, 'rb') as log_file:
+                with gzip.open('%s.1.gz' % self._filename, 'wb') as gz_file:
+                    shutil.copyfileobj(log_file, gz_file)
+
+        os.remove(self._filename)
@@ -0,0 +1,226 @@
+# This file is part of browser, and contains the plug process freezer.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Stops plug processes that nobody is looking at, and starts them again.
+
+If the browser is running in a cgroup v2 hierarchy it is allowed to change,
+each frozen plug is moved into a cgroup of its own under the browser's and
+frozen with cgroup.freeze.  Otherwise the plug is sent SIGSTOP, and SIGCONT
+to thaw it.
+
+A frozen plug doesn't answer calls or send signals, so it has to be thawed
+before anything is asked of it.
+
+"""
+
+import os
+import signal
+
+# The ways to freeze a process.
+METHOD_AUTO = 'auto'
+METHOD_SIGNAL = 'signal'
+METHOD_CGROUP = 'cgroup'
+
+# Where the cgroup v2 hierarchy is mounted.
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def own_cgroup():
+    """ own_cgroup -> Return the directory of this process's cgroup v2 group,
+    or '' if there isn't one.
+
+    """
+
+    try:
+        with open('/proc/self/mounts') as mounts_file:
+            if not [line for line in mounts_file if 
+                    line.split()[1:3] == [CGROUP_ROOT, 'cgroup2']]:
+                return ''
+
+        with open('/proc/self/cgroup') as cgroup_file:
+            for line in cgroup_file:
+                hierarchy, _, path = line.strip().split(':', 2)
+                if hierarchy == '0':
+                    return ('%s%s' % (CGROUP_ROOT, path)).rstrip('/')
+    except (IOError, ValueError):
+        pass
+    return ''
+
+
+class PlugFreezer(object):
+    """ PlugFreezer -> Freeze and thaw plug processes.
+
+    """
+
+    def __init__(self, method=METHOD_AUTO):
+        """ PlugFreezer(method=METHOD_AUTO) -> Freeze processes using
+        method, which is 'signal', 'cgroup', or 'auto' to use cgroups when
+        they can be used.
+
+        """
+
+        self._cgroup_path = ''
+        if method in (METHOD_AUTO, METHOD_CGROUP):
+            path = own_cgroup()
+            if path and os.access(path, os.W_OK):
+                self._cgroup_path = path
+            elif method == METHOD_CGROUP:
+                print("Unable to use the cgroup freezer, using signals")
+
+        # pid: the cgroup directory it was moved to, or ''.
+        self._frozen_dict = {}
+        self._group_dict = {}
+
+        self.freezes = 0
+
+    def get_method(self):
+        """ get_method -> Return the method used to freeze processes.
+
+        """
+
+        return METHOD_CGROUP if self._cgroup_path else METHOD_SIGNAL
+
+    def is_frozen(self, pid):
+        """ is_frozen(pid) -> Return True if process pid is frozen.
+
+        """
+
+        return pid in self._frozen_dict
+
+    def get_frozen(self):
+        """ get_frozen -> Return a list of the frozen pids.
+
+        """
+
+        return self._frozen_dict.keys()
+
+    def freeze(self, pid):
+        """ freeze(pid) -> Freeze process pid.  Returns True if it was
+        frozen.
+
+        """
+
+        if not pid or pid in self._frozen_dict:
+            return False
+
+        group_path = self._get_group(pid)
+        try:
+            if group_path:
+                self._write('%s/cgroup.freeze' % group_path, '1')
+            else:
+                os.kill(pid, signal.SIGSTOP)
+        except (IOError, OSError) as err:
+            print("Error freezing process %d: %s" % (pid, err))
+            return False
+
+        self._frozen_dict[pid] = group_path
+        self.freezes += 1
+        return True
+
+    def thaw(self, pid):
+        """ thaw(pid) -> Thaw process pid if it is frozen.  Returns True if
+        it was frozen.
+
+        """
+
+        if pid not in self._frozen_dict:
+            return False
+
+        group_path = self._frozen_dict.pop(pid)
+        try:
+            if group_path:
+                self._write('%s/cgroup.freeze' % group_path, '0')
+            else:
+                os.kill(pid, signal.SIGCONT)
+        except (IOError, OSError) as err:
+            print("Error thawing process %d: %s" % (pid, err))
+        return True
+
+    def thaw_all(self):
+        """ thaw_all -> Thaw every frozen process.
+
+        """
+
+        for pid in self._frozen_dict.keys():
+            self.thaw(pid)
+
+    def forget(self, pid):
+        """ forget(pid) -> Thaw process pid and remove its cgroup once it
+        has exited.  Call this when the process has exited or is about to.
+
+        """
+
+        self.thaw(pid)
+        self.clean()
+
+    def clean(self):
+        """ clean -> Remove the cgroups of processes that have exited.
+
+        """
+
+        for pid, group_path in self._group_dict.items():
+            if pid in self._frozen_dict or os.path.exists('/proc/%d' % pid):
+                continue
+            try:
+                os.rmdir(group_path)
+            except OSError:
+                # It still has processes in it, so leave it for later.
+                continue
+            del self._group_dict[pid]
+
+    def _get_group(self, pid):
+        """ _get_group(pid) -> Return the cgroup directory of process pid,
+        moving it into a new one if it doesn't have one yet.  Returns ''
+        if cgroups are not used.
+
+        """
+
+        if not self._cgroup_path:
+            return ''
+
+        group_path = self._group_dict.get(pid, '')
+        if group_path:
+            return group_path
+
+        group_path = '%s/webbrowser-plug%d' % (self._cgroup_path, pid)
+        try:
+            if not os.path.isdir(group_path):
+                os.mkdir(group_path)
+            if not os.path.exists('%s/cgroup.freeze' % group_path):
+                raise OSError("no cgroup.freeze in %s" % group_path)
+            self._write('%s/cgroup.procs' % group_path, str(pid))
+        except (IOError, OSError) as err:
+            print("Unable to use the cgroup freezer, using signals: %s" % \
+                    err)
+            self._cgroup_path = ''
+            try:
+                os.rmdir(group_path)
+            except OSError:
+                pass
+            return ''
+
+        self._group_dict[pid] = group_path
+        return group_path
+
+    def _write(self, filename, value):
+        """ _write(filename, value) -> Write value to the cgroup file
+        filename.
+
+        """
+
+        with open(filename, 'w') as cgroup_file:
+            cgroup_file.write(value)
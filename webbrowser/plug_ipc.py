@@ -0,0 +1,573 @@
+# This file is part of browser, and contains a unix socket transport between
+# the main window and the browser plugs.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" A direct transport between the main window and the browser plugs.
+
+Each plug process listens on its own unix socket, and the main window
+connects to it once the plug has announced its pid over dbus.  The methods
+and signals are the same ones used over dbus, but they go straight to the
+other process instead of through the session bus daemon.
+
+Every frame is a 4 byte big endian length followed by a marshalled tuple:
+
+    ('call', serial, method_name, args)
+    ('reply', serial, result)
+    ('error', serial, error_string)
+    ('signal', signal_name, args)
+
+Method calls are asynchronous, so any number can be waiting for replies at
+once.
+
+"""
+
+import os
+import stat
+import errno
+import socket
+import struct
+import marshal
+import tempfile
+from time import time
+from select import select
+
+import glib
+
+_LENGTH = struct.Struct('>I')
+
+# The largest frame that will be accepted.
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# How long a blocking call waits for its reply, in seconds.
+CALL_TIMEOUT = 25
+
+
+class IPCError(Exception):
+    """ IPCError -> A call failed or the connection was lost.
+
+    """
+
+    pass
+
+
+def socket_path(pid):
+    """ socket_path(pid) -> Return the path of the socket plug process pid
+    listens on, in a directory in $XDG_RUNTIME_DIR or the temp directory
+    that is only accessible by this user.  Raises OSError if the directory
+    belongs to someone else or others can use it.
+
+    """
+
+    base = os.environ.get('XDG_RUNTIME_DIR', '') or tempfile.gettempdir()
+    directory = '%s/webbrowser-%d' % (base, os.getuid())
+    try:
+        os.mkdir(directory, 0700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+    # Anyone can make the directory first in the temp directory, and plant
+    # sockets that send frames to marshal.loads.
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            stat.S_IMODE(info.st_mode) != 0700:
+        raise OSError(errno.EACCES, "%s is not a private directory" % \
+                directory)
+    return '%s/plug%d.sock' % (directory, pid)
+
+
+class IPCConnection(object):
+    """ IPCConnection -> One end of a connection between two processes.
+
+    """
+
+    def __init__(self, sock, method_func=None, signal_func=None,
+            close_func=None):
+        """ IPCConnection(sock, method_func=None, signal_func=None,
+        close_func=None) -> Handle frames on sock.  method_func(name, args)
+        is called for method calls and its return value is sent back,
+        signal_func(connection, name, args) is called for signals, and
+        close_func(connection) is called when the connection is lost.
+
+        """
+
+        self._sock = sock
+        self._sock.setblocking(False)
+
+        self._method_func = method_func
+        self._signal_func = signal_func
+        self._close_func = close_func
+
+        self._read_buffer = ''
+        self._write_buffer = ''
+        self._write_id = None
+
+        # serial: (reply_handler, error_handler, deadline)
+        self._serial = 0
+        self._pending_dict = {}
+
+        # Frames read while waiting for a blocking call's reply.
+        self._deferred_list = []
+
+        self._closed = False
+        self._read_id = glib.io_add_watch(sock, glib.IO_IN | glib.IO_HUP |
+                glib.IO_ERR, self._readable)
+
+        # Anything the owner wants to remember about the connection.
+        self.pid = None
+        self.path = None
+
+    def is_closed(self):
+        """ is_closed -> Returns True if the connection was lost.
+
+        """
+
+        return self._closed
+
+    def call(self, method_name, args, reply_handler=None,
+            error_handler=None, timeout=CALL_TIMEOUT):
+        """ call(method_name, args, reply_handler=None, error_handler=None,
+        timeout=CALL_TIMEOUT) -> Call method_name on the other end.  If a
+        reply_handler is given return at once and call it with the result
+        later, otherwise wait for the result and return it.
+
+        """
+
+        if self._closed:
+            error = IPCError("connection closed")
+            if error_handler:
+                error_handler(error)
+                return None
+            raise error
+
+        self._serial += 1
+        serial = self._serial
+
+        if reply_handler:
+            self._pending_dict[serial] = (reply_handler, error_handler,
+                    time() + timeout)
+            self._send(('call', serial, method_name, tuple(args)))
+            return None
+
+        self._send(('call', serial, method_name, tuple(args)))
+        return self._wait_reply(serial, timeout)
+
+    def emit_signal(self, signal_name, args):
+        """ emit_signal(signal_name, args) -> Send a signal to the other
+        end.
+
+        """
+
+        if not self._closed:
+            self._send(('signal', signal_name, tuple(args)))
+
+    def close(self):
+        """ close -> Close the connection and fail every call waiting for
+        a reply.
+
+        """
+
+        if self._closed:
+            return
+        self._closed = True
+
+        glib.source_remove(self._read_id)
+        if self._write_id:
+            glib.source_remove(self._write_id)
+            self._write_id = None
+
+        try:
+            self._sock.close()
+        except socket.error:
+            pass
+
+        pending_dict = self._pending_dict
+        self._pending_dict = {}
+        for reply_handler, error_handler, deadline in pending_dict.values():
+            if error_handler:
+                error_handler(IPCError("connection closed"))
+
+        if self._close_func:
+            self._close_func(self)
+
+    def check_timeouts(self):
+        """ check_timeouts -> Fail the calls that have waited too long for
+        a reply.
+
+        """
+
+        now = time()
+        for serial, (reply_handler, error_handler, deadline) in \
+                self._pending_dict.items():
+            if deadline < now:
+                del self._pending_dict[serial]
+                if error_handler:
+                    error_handler(IPCError("call timed out"))
+
+    def _send(self, frame):
+        """ _send(frame) -> Queue frame to be written.
+
+        """
+
+        data = marshal.dumps(frame)
+        self._write_buffer += _LENGTH.pack(len(data)) + data
+        self._flush()
+
+    def _flush(self):
+        """ _flush -> Write as much of the write buffer as the socket will
+        take, and watch for it to be writable if there is more.
+
+        """
+
+        try:
+            sent = self._sock.send(self._write_buffer)
+            self._write_buffer = self._write_buffer[sent:]
+        except socket.error as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                glib.idle_add(self.close)
+                return False
+
+        if self._write_buffer and not self._write_id:
+            self._write_id = glib.io_add_watch(self._sock, glib.IO_OUT,
+                    self._writable)
+        return bool(self._write_buffer)
+
+    def _writable(self, sock, condition):
+        """ _writable(sock, condition) -> Keep writing the write buffer.
+
+        """
+
+        more = self._flush()
+        if not more:
+            self._write_id = None
+        return more
+
+    def _read_frames(self):
+        """ _read_frames -> Read what is available from the socket and
+        return the list of complete frames.  Returns None if the other end
+        closed the connection.
+
+        """
+
+        try:
+            data = self._sock.recv(65536)
+        except socket.error as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            return None
+
+        if not data:
+            return None
+
+        self._read_buffer += data
+        frame_list = []
+        while len(self._read_buffer) >= _LENGTH.size:
+            length, = _LENGTH.unpack_from(self._read_buffer)
+            if length > MAX_FRAME_SIZE:
+                return None
+            end = _LENGTH.size + length
+            if len(self._read_buffer) < end:
+                break
+            frame_list.append(marshal.loads(self._read_buffer[_LENGTH.size:
+                end]))
+            self._read_buffer = self._read_buffer[end:]
+        return frame_list
+
+    def _readable(self, sock, condition):
+        """ _readable(sock, condition) -> Read and handle frames.
+
+        """
+
+        frame_list = self._read_frames()
+        if frame_list is None:
+            self.close()
+            return False
+
+        for frame in frame_list:
+            self._handle_frame(frame)
+        return not self._closed
+
+    def _handle_frame(self, frame):
+        """ _handle_frame(frame) -> Call the handler for frame.
+
+        """
+
+        kind = frame[0]
+        if kind == 'signal':
+            if self._signal_func:
+                self._signal_func(self, frame[1], frame[2])
+        elif kind == 'call':
+            serial, method_name, args = frame[1:]
+            try:
+                if not self._method_func:
+                    raise IPCError("no methods")
+                result = self._method_func(method_name, args)
+                self._send(('reply', serial, result))
+            except Exception as err:
+                self._send(('error', serial, '%s: %s' % \
+                        (err.__class__.__name__, err)))
+        elif kind in ('reply', 'error'):
+            handlers = self._pending_dict.pop(frame[1], None)
+            if not handlers:
+                return
+            reply_handler, error_handler, deadline = handlers
+            if kind == 'reply':
+                if frame[2] is None:
+                    reply_handler()
+                else:
+                    reply_handler(frame[2])
+            elif error_handler:
+                error_handler(IPCError(frame[2]))
+
+    def _wait_reply(self, serial, timeout):
+        """ _wait_reply(serial, timeout) -> Block until the reply to call
+        serial arrives and return its result.  Other frames are handled
+        once the main loop is idle again.
+
+        """
+
+        deadline = time() + timeout
+        while True:
+            # Make sure the call has been written.
+            if self._write_buffer:
+                select([], [self._sock], [], max(0, deadline - time()))
+                self._flush()
+
+            remaining = deadline - time()
+            if remaining <= 0:
+                raise IPCError("call timed out")
+
+            readable = select([self._sock], [], [], remaining)[0]
+            if not readable:
+                continue
+
+            frame_list = self._read_frames()
+            if frame_list is None:
+                glib.idle_add(self.close)
+                raise IPCError("connection closed")
+
+            for frame in frame_list:
+                if frame[0] in ('reply', 'error') and frame[1] == serial:
+                    if frame[0] == 'error':
+                        raise IPCError(frame[2])
+                    result = frame[2]
+                    if self._deferred_list:
+                        glib.idle_add(self._handle_deferred)
+                    return result
+                self._deferred_list.append(frame)
+
+    def _handle_deferred(self):
+        """ _handle_deferred -> Handle the frames that were read while
+        waiting for a reply.
+
+        """
+
+        deferred_list = self._deferred_list
+        self._deferred_list = []
+        for frame in deferred_list:
+            self._handle_frame(frame)
+        return False
+
+
+class IPCServer(object):
+    """ IPCServer -> Listen on a unix socket and accept connections.
+
+    """
+
+    def __init__(self, path, connection_func):
+        """ IPCServer(path, connection_func) -> Listen on path and call
+        connection_func(sock) for every new connection.
+
+        """
+
+        self._path = path
+        if os.path.exists(path):
+            os.unlink(path)
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(path)
+        self._sock.listen(5)
+        self._connection_func = connection_func
+        self._accept_id = glib.io_add_watch(self._sock, glib.IO_IN,
+                self._accept)
+
+    def _accept(self, sock, condition):
+        """ _accept(sock, condition) -> Accept a new connection.
+
+        """
+
+        try:
+            new_sock, address = self._sock.accept()
+        except socket.error:
+            return True
+
+        self._connection_func(new_sock)
+        return True
+
+    def close(self):
+        """ close -> Stop listening and remove the socket file.
+
+        """
+
+        glib.source_remove(self._accept_id)
+        self._sock.close()
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+
+class IPCProxy(object):
+    """ IPCProxy -> Call methods of a plug like a dbus proxy object.
+
+        proxy.load_uri(uri, socket_id, reply_handler=..., error_handler=...)
+
+    """
+
+    def __init__(self, connection):
+        """ IPCProxy(connection) -> Make a proxy for the methods on the
+        other end of connection.
+
+        """
+
+        self._connection = connection
+
+    def __getattr__(self, method_name):
+        """ Return a function that calls method_name.
+
+        """
+
+        if method_name.startswith('_'):
+            raise AttributeError(method_name)
+
+        connection = self._connection
+
+        def call_method(*args, **kwargs):
+            return connection.call(method_name, args,
+                    kwargs.get('reply_handler'), kwargs.get('error_handler'),
+                    kwargs.get('timeout', CALL_TIMEOUT))
+        return call_method
+
+
+class IPCBus(object):
+    """ IPCBus -> The main window's connections to the plugs, with signal
+    receivers like a dbus bus.
+
+    """
+
+    def __init__(self):
+        """ Create a bus with no connections.
+
+        """
+
+        self._connection_dict = {}
+
+        # (handler, signal_name, pid, path) for each receiver.
+        self._receiver_list = []
+        self._timeout_id = None
+
+    def get_object(self, pid):
+        """ get_object(pid) -> Return a proxy for plug process pid,
+        connecting to it if there isn't a connection already.
+
+        """
+
+        connection = self._connection_dict.get(pid)
+        if not connection or connection.is_closed():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(socket_path(pid))
+            except (socket.error, OSError) as err:
+                sock.close()
+                raise IPCError("unable to connect to plug %d: %s" % \
+                        (pid, err))
+            connection = IPCConnection(sock, signal_func=self._signal,
+                    close_func=self._closed)
+            connection.pid = pid
+            self._connection_dict[pid] = connection
+
+            if not self._timeout_id:
+                self._timeout_id = glib.timeout_add_seconds(1,
+                        self._check_timeouts)
+
+        return IPCProxy(connection)
+
+    def add_signal_receiver(self, handler, signal_name, pid=None, path=None):
+        """ add_signal_receiver(handler, signal_name, pid=None, path=None) ->
+        Call handler with the arguments of signal_name when it comes from
+        plug pid, or any plug if pid is None.  If path is given only plugs
+        started by the main window at path are listened to.
+
+        """
+
+        self._receiver_list.append((handler, signal_name, pid, path))
+
+    def remove_signal_receiver(self, handler, signal_name, pid=None,
+            path=None):
+        """ remove_signal_receiver(handler, signal_name, pid=None,
+        path=None) -> Stop calling handler for signal_name.
+
+        """
+
+        receiver = (handler, signal_name, pid, path)
+        if receiver in self._receiver_list:
+            self._receiver_list.remove(receiver)
+
+    def _signal(self, connection, signal_name, args):
+        """ _signal(connection, signal_name, args) -> Call the receivers of
+        signal_name.
+
+        """
+
+        if signal_name == 'hello':
+            # The plug says which main window started it.
+            connection.path = args[0]
+            return
+
+        for handler, name, pid, path in list(self._receiver_list):
+            if name != signal_name:
+                continue
+            if pid is not None and pid != connection.pid:
+                continue
+            if path is not None and path != connection.path:
+                continue
+            handler(*args)
+
+    def _closed(self, connection):
+        """ _closed(connection) -> Forget a lost connection.
+
+        """
+
+        if self._connection_dict.get(connection.pid) is connection:
+            del self._connection_dict[connection.pid]
+
+    def _check_timeouts(self):
+        """ _check_timeouts -> Fail calls that have waited too long.
+
+        """
+
+        for connection in self._connection_dict.values():
+            connection.check_timeouts()
+
+        if not self._connection_dict:
+            self._timeout_id = None
+            return False
+        return True
+
+
+# The connections of this process.
+ipc_bus = IPCBus()
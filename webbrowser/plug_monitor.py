@@ -0,0 +1,232 @@
+# This file is part of browser, and contains the plug resource monitor.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Watches how much memory and cpu each plug process uses.
+
+Each sample reads the resident memory from /proc/<pid>/status and the cpu
+time from /proc/<pid>/stat.  The cpu percent is the cpu time used since
+the last sample over the time between them, so a process needs two samples
+before it has one.
+
+A process is over its limits when its memory is over the memory limit, or
+its cpu percent has been over the cpu limit for CPU_SAMPLES samples in a
+row.  The actions taken then are:
+
+    warn        Print a warning in the debug console.
+    discard     Discard the process's background tabs.
+    restart     Move the process's tabs into a new one and kill it.
+
+Each process is only acted on once until it is back under its limits.
+
+"""
+
+import os
+from time import time
+
+from process_policy import get_rss
+
+ACTION_WARN = 'warn'
+ACTION_DISCARD = 'discard'
+ACTION_RESTART = 'restart'
+
+ACTION_LIST = [ACTION_WARN, ACTION_DISCARD, ACTION_RESTART]
+
+# The default seconds between samples.
+SAMPLE_INTERVAL = 5
+
+# How many samples in a row the cpu has to be over its limit.
+CPU_SAMPLES = 3
+
+try:
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except (ValueError, OSError, AttributeError):
+    CLOCK_TICKS = 100
+
+
+def get_cpu_time(pid):
+    """ get_cpu_time(pid) -> Return the user and system cpu time process pid
+    has used in seconds, or None if it can't be read.
+
+    """
+
+    try:
+        with open('/proc/%d/stat' % pid) as stat_file:
+            stat = stat_file.read()
+        # The command name can have spaces in it, so start after it.
+        field_list = stat[stat.rindex(')') + 2:].split()
+        return (int(field_list[11]) + int(field_list[12])) / \
+                float(CLOCK_TICKS)
+    except (IOError, ValueError, IndexError):
+        return None
+
+
+def get_age(pid):
+    """ get_age(pid) -> Return the seconds since process pid started, or
+    None if it can't be read.
+
+    """
+
+    try:
+        with open('/proc/uptime') as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        with open('/proc/%d/stat' % pid) as stat_file:
+            stat = stat_file.read()
+        field_list = stat[stat.rindex(')') + 2:].split()
+        return uptime - int(field_list[19]) / float(CLOCK_TICKS)
+    except (IOError, ValueError, IndexError):
+        return None
+
+
+class PlugMonitor(object):
+    """ PlugMonitor -> Sample the memory and cpu used by plug processes.
+
+    """
+
+    def __init__(self, rss_limit=0, cpu_limit=0, action=ACTION_WARN):
+        """ PlugMonitor(rss_limit=0, cpu_limit=0, action=ACTION_WARN) ->
+        Watch for processes using more than rss_limit megabytes or cpu_limit
+        percent of a cpu, and take action on them.  A limit of 0 is not
+        checked.
+
+        """
+
+        if action not in ACTION_LIST:
+            print("Unknown monitor action %s, using %s" % (action,
+                ACTION_WARN))
+            action = ACTION_WARN
+
+        self.action = action
+        self._rss_limit = rss_limit * 1024 * 1024
+        self._cpu_limit = cpu_limit
+
+        # pid: (time sampled, cpu time) of the last sample.
+        self._last_dict = {}
+
+        # pid: (rss in bytes, cpu percent) of the last sample.
+        self._usage_dict = {}
+
+        # pid: the number of samples in a row the cpu was over its limit.
+        self._over_dict = {}
+
+        # The processes that have been acted on.
+        self._acted_set = set()
+
+        # pid: (rss over its limit, cpu over its limit) of the last sample.
+        self._limit_dict = {}
+
+        # The processes whose last sample went over or under a limit.
+        self._changed_list = []
+
+    def sample(self, pid_list):
+        """ sample(pid_list) -> Sample each process in pid_list, forgetting
+        any others, and return a list of the pids that have just gone over
+        their limits.
+
+        """
+
+        for pid in self._last_dict.keys():
+            if pid not in pid_list:
+                self.forget(pid)
+
+        now = time()
+        over_list = []
+        self._changed_list = []
+        for pid in pid_list:
+            cpu_time = get_cpu_time(pid)
+            if cpu_time is None:
+                self.forget(pid)
+                continue
+
+            cpu = 0.0
+            if pid in self._last_dict:
+                last_time, last_cpu_time = self._last_dict[pid]
+                if now > last_time:
+                    cpu = (cpu_time - last_cpu_time) * 100 / \
+                            (now - last_time)
+            self._last_dict[pid] = (now, cpu_time)
+
+            rss = get_rss(pid)
+            self._usage_dict[pid] = (rss, cpu)
+
+            if self._cpu_limit > 0 and cpu > self._cpu_limit:
+                self._over_dict[pid] = self._over_dict.get(pid, 0) + 1
+            else:
+                self._over_dict.pop(pid, None)
+
+            limit_tup = (self._rss_limit > 0 and rss > self._rss_limit,
+                    pid in self._over_dict)
+            if limit_tup != self._limit_dict.get(pid, (False, False)):
+                self._changed_list.append(pid)
+            self._limit_dict[pid] = limit_tup
+
+            if self.is_over(pid):
+                if pid not in self._acted_set:
+                    self._acted_set.add(pid)
+                    over_list.append(pid)
+            else:
+                self._acted_set.discard(pid)
+
+        return over_list
+
+    def is_over(self, pid):
+        """ is_over(pid) -> Return True if process pid is over its limits.
+
+        """
+
+        rss, cpu = self._usage_dict.get(pid, (0, 0.0))
+        if self._rss_limit > 0 and rss > self._rss_limit:
+            return True
+        return self._over_dict.get(pid, 0) >= CPU_SAMPLES
+
+    def get_usage(self, pid):
+        """ get_usage(pid) -> Return the (rss in bytes, cpu percent) of
+        process pid, or None if it hasn't been sampled.
+
+        """
+
+        return self._usage_dict.get(pid, None)
+
+    def forget(self, pid):
+        """ forget(pid) -> Forget the samples of process pid.
+
+        """
+
+        self._last_dict.pop(pid, None)
+        self._usage_dict.pop(pid, None)
+        self._over_dict.pop(pid, None)
+        self._acted_set.discard(pid)
+        self._limit_dict.pop(pid, None)
+
+    def get_changed_list(self):
+        """ get_changed_list -> Return a list of the pids whose last sample
+        went over or back under one of their limits.
+
+        """
+
+        return self._changed_list[:]
+
+    def get_stats_list(self, pid_list=None):
+        """ get_stats_list(pid_list=None) -> Return a list of strings
+        describing each sampled process in pid_list, or every sampled
+        process if it is None.
+
+        """
+
+        return ["plug %d: %.1f MB, %.0f%% cpu%s" % (pid, rss / 1048576.0,
+                    cpu, ' (over limit)' if self.is_over(pid) else '')
+                for pid, (rss, cpu) in sorted(self._usage_dict.items())
+                if pid_list is None or pid in pid_list]
@@ -0,0 +1,266 @@
+# This file is part of browser, and contains the pool of waiting plugs.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" A pool of plug processes that have been started before they are needed.
+
+Starting a plug means starting python, importing gtk, webkit and dbus and
+exporting the plug's objects, which is most of the time it takes to open an
+external tab.  The pool keeps a few plugs that have done all of that and
+announced their pid, so a new tab only has to give one its socket id.
+
+The pool is refilled one plug at a time from low priority timeouts so it
+doesn't slow down the tabs that are being opened.
+
+"""
+
+import os
+import signal
+from time import time
+
+import glib
+
+# The default number of plugs kept waiting.
+POOL_SIZE = 1
+
+# Seconds to wait after the window opens, or a plug is taken, before
+# starting another plug.
+START_DELAY = 3
+REFILL_DELAY = 1
+
+# Seconds a plug has to announce its pid before it is given up on.
+READY_TIMEOUT = 30
+
+
+def is_running(pid):
+    """ is_running(pid) -> Return True if process pid is running and
+    hasn't exited waiting to be reaped.
+
+    """
+
+    try:
+        with open('/proc/%d/stat' % pid) as stat_file:
+            stat = stat_file.read()
+        # The command name can have spaces in it, so start after it.
+        return stat[stat.rindex(')') + 2] not in 'ZX'
+    except (IOError, ValueError, IndexError):
+        return False
+
+
+class PlugPool(object):
+    """ PlugPool -> Keep plug processes started and waiting for a tab.
+
+    """
+
+    def __init__(self, bus, start_func, size=POOL_SIZE):
+        """ PlugPool(bus, start_func, size=POOL_SIZE) -> Keep size plugs
+        waiting.  start_func is called to start a plug and returns its pid,
+        and bus is used to hear when it is ready.
+
+        """
+
+        self._bus = bus
+        self._start_func = start_func
+        self._size = size
+
+        # Plugs that are ready, oldest first.
+        self._ready_list = []
+
+        # pid: (time started, pid signal handler) of plugs still starting.
+        self._starting_dict = {}
+
+        self._refill_id = None
+
+        self.hits = 0
+        self.misses = 0
+
+        # The time from opening a tab until its plug was embedded.
+        self._paint_dict = {True: [0, 0.0], False: [0, 0.0]}
+
+    def __len__(self):
+        """ Return the number of plugs that are ready.
+
+        """
+
+        return len(self._ready_list)
+
+    def start(self):
+        """ start -> Start filling the pool after the window has had time to
+        open.
+
+        """
+
+        self._queue_refill(START_DELAY)
+
+    def close(self):
+        """ close -> Stop filling the pool and stop the waiting plugs.
+
+        """
+
+        if self._refill_id:
+            glib.source_remove(self._refill_id)
+            self._refill_id = None
+
+        pid_list = self._ready_list + self._starting_dict.keys()
+        for pid in self._starting_dict.keys():
+            self._forget_starting(pid)
+        self._ready_list = []
+
+        for pid in pid_list:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def take(self):
+        """ take -> Return the pid of a ready plug, or None if there isn't
+        one.
+
+        """
+
+        if self._size <= 0:
+            return None
+
+        pid = None
+        while self._ready_list:
+            pid = self._ready_list.pop(0)
+            if is_running(pid):
+                break
+            # It died while it was waiting.
+            pid = None
+
+        if pid:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        self._queue_refill(REFILL_DELAY)
+        return pid
+
+    def add_first_paint(self, pooled, seconds):
+        """ add_first_paint(pooled, seconds) -> Record how long a tab took
+        to show its plug, and whether the plug came from the pool.
+
+        """
+
+        paint = self._paint_dict[bool(pooled)]
+        paint[0] += 1
+        paint[1] += seconds
+
+    def get_stats(self):
+        """ get_stats -> Return a dictionary of the pool's size, hits,
+        misses, and the average time to first paint of pooled and new plugs
+        in seconds.
+
+        """
+
+        def average(pooled):
+            count, seconds = self._paint_dict[pooled]
+            return seconds / count if count else 0.0
+
+        return {
+                'size': self._size,
+                'ready': len(self._ready_list),
+                'starting': len(self._starting_dict),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_first_paint': average(True),
+                'miss_first_paint': average(False),
+                }
+
+    def get_stats_list(self):
+        """ get_stats_list -> Return a list of strings describing the pool.
+
+        """
+
+        stats = self.get_stats()
+        return ["plug pool: %d of %d ready, %d starting" % (stats['ready'],
+                    stats['size'], stats['starting']),
+                "plug pool: %d hits, %d misses" % (stats['hits'],
+                    stats['misses']),
+                "plug pool: first paint %.0f ms from the pool, %.0f ms "
+                "from a new plug" % (stats['hit_first_paint'] * 1000,
+                    stats['miss_first_paint'] * 1000)]
+
+    def _queue_refill(self, delay):
+        """ _queue_refill(delay) -> Refill the pool in delay seconds unless
+        a refill is already waiting.
+
+        """
+
+        if self._size > 0 and not self._refill_id:
+            self._refill_id = glib.timeout_add_seconds(delay, self._refill,
+                    priority=glib.PRIORITY_LOW)
+
+    def _refill(self):
+        """ _refill -> Start one plug if the pool isn't full.
+
+        """
+
+        self._refill_id = None
+
+        # Give up on plugs that never said they were ready.
+        now = time()
+        for pid, (start_time, handler) in self._starting_dict.items():
+            if now - start_time > READY_TIMEOUT:
+                self._forget_starting(pid)
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+        if len(self._ready_list) + len(self._starting_dict) >= self._size:
+            return False
+
+        pid = self._start_func()
+
+        def plug_ready(ready_pid):
+            if ready_pid == pid:
+                self._plug_ready(pid)
+
+        self._bus.add_signal_receiver(plug_ready, signal_name='send_pid',
+                dbus_interface='com.browser.tab%d' % pid)
+        self._starting_dict[pid] = (now, plug_ready)
+
+        # Check back in case the plug never becomes ready.
+        self._queue_refill(READY_TIMEOUT + 1)
+        return False
+
+    def _plug_ready(self, pid):
+        """ _plug_ready(pid) -> Move plug pid into the ready list and start
+        the next one.
+
+        """
+
+        if pid not in self._starting_dict:
+            return
+
+        self._forget_starting(pid)
+        self._ready_list.append(pid)
+
+        if self._refill_id:
+            glib.source_remove(self._refill_id)
+            self._refill_id = None
+        self._queue_refill(REFILL_DELAY)
+
+    def _forget_starting(self, pid):
+        """ _forget_starting(pid) -> Stop waiting for plug pid to be ready.
+
+        """
+
+        start_time, handler = self._starting_dict.pop(pid)
+        self._bus.remove_signal_receiver(handler, signal_name='send_pid',
+                dbus_interface='com.browser.tab%d' % pid)
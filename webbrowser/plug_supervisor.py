@@ -0,0 +1,246 @@
+# This file is part of browser, and contains the plug supervisor.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Keeps track of the plugs a window starts, and of the ones that crash.
+
+A plug sends plug_ready to its main window once it has exported its
+objects, so tabs can be given to it without asking it over and over.  A plug
+that isn't ready START_TIMEOUT seconds after it was started is killed and
+counted as a crash.
+
+Each crash adds to the crashes of the plug it came from, and a plug that
+keeps crashing is restarted after a delay that doubles each time, up to
+BACKOFF_MAX seconds.  A crash is only blamed on a uri when it was the only
+uri the plug showed, so the tabs that just shared its process aren't.  A
+uri blamed for QUARANTINE_COUNT crashes in QUARANTINE_TIME seconds is
+quarantined, and its tabs are not restarted until the oldest of those
+crashes is QUARANTINE_TIME seconds old.
+
+"""
+
+import os
+import signal
+from time import time
+
+import glib
+
+from process_policy import registrable_domain
+
+# Seconds a plug has to say it is ready.
+START_TIMEOUT = 30
+
+# The restart delay after the second crash, doubled for each one after it,
+# and the most it can be, in seconds.  The first crash restarts at once.
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+# Crashes of a uri in QUARANTINE_TIME seconds before it is quarantined.
+QUARANTINE_COUNT = 3
+QUARANTINE_TIME = 300
+
+
+class PlugSupervisor(object):
+    """ PlugSupervisor -> Watch plugs start, and decide how to restart the
+    ones that die.
+
+    """
+
+    def __init__(self, timeout_func):
+        """ PlugSupervisor(timeout_func) -> Watch the plugs of a window.
+        timeout_func(pid) is called after a plug that didn't start in time
+        has been killed.
+
+        """
+
+        self._timeout_func = timeout_func
+
+        # pid: the start timeout id of plugs that are not ready yet.
+        self._starting_dict = {}
+        self._ready_set = set()
+
+        # pid: the times its plug and the plugs it replaced crashed.
+        self._crash_dict = {}
+
+        # uri: the times it crashed a plug it was alone in.
+        self._uri_crash_dict = {}
+
+        # site: the number of times its plugs were restarted.
+        self._site_restart_dict = {}
+
+        self.restarts = 0
+        self.timeouts = 0
+
+    def close(self):
+        """ close -> Stop waiting for plugs to start.
+
+        """
+
+        for timeout_id in self._starting_dict.values():
+            glib.source_remove(timeout_id)
+        self._starting_dict = {}
+
+    def plug_started(self, pid):
+        """ plug_started(pid) -> Start waiting for plug pid to be ready.
+
+        """
+
+        self._starting_dict[pid] = glib.timeout_add_seconds(START_TIMEOUT,
+                self._start_timed_out, pid, priority=glib.PRIORITY_LOW)
+
+    def plug_ready(self, pid):
+        """ plug_ready(pid) -> Remember that plug pid is ready.
+
+        """
+
+        timeout_id = self._starting_dict.pop(pid, None)
+        if timeout_id:
+            glib.source_remove(timeout_id)
+        self._ready_set.add(pid)
+
+    def is_ready(self, pid):
+        """ is_ready(pid) -> Return True unless plug pid was started and
+        hasn't said it is ready.
+
+        """
+
+        return pid not in self._starting_dict
+
+    def add_crash(self, pid, uri_list):
+        """ add_crash(pid, uri_list) -> Record that plug pid died while
+        showing the uris in uri_list.  Each tab of the plug can report it,
+        but only the first report is counted.
+
+        """
+
+        if pid not in self._ready_set and pid not in self._starting_dict:
+            # The crash has already been counted.
+            return
+
+        now = time()
+        self._forget(pid)
+        self._crash_dict.setdefault(pid, []).append(now)
+
+        # Only blame the uri if nothing else was in the plug.
+        uri_set = set(uri for uri in uri_list if uri and 
+                not uri.startswith('about:'))
+        if len(uri_set) == 1:
+            crash_list = self._uri_crash_dict.setdefault(uri_set.pop(), [])
+            crash_list.append(now)
+            crash_list[:] = [crash_time for crash_time in crash_list if
+                    now - crash_time < QUARANTINE_TIME]
+
+    def is_quarantined(self, uri):
+        """ is_quarantined(uri) -> Return True if uri has crashed its plug
+        too often to be restarted yet.
+
+        """
+
+        now = time()
+        crash_list = [crash_time for crash_time in
+                self._uri_crash_dict.get(uri, []) if
+                now - crash_time < QUARANTINE_TIME]
+        return len(crash_list) >= QUARANTINE_COUNT
+
+    def get_restart_delay(self, pid):
+        """ get_restart_delay(pid) -> Return the seconds to wait before
+        restarting dead plug pid.
+
+        """
+
+        now = time()
+        crash_count = len([crash_time for crash_time in
+            self._crash_dict.get(pid, []) if
+            now - crash_time < QUARANTINE_TIME])
+        if crash_count <= 1:
+            return 0
+        return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (crash_count - 2))
+
+    def plug_restarted(self, old_pid, new_pid, uri_list):
+        """ plug_restarted(old_pid, new_pid, uri_list) -> Give the new plug
+        the crashes of the one it replaced, and count a restart for the site
+        of each uri in uri_list.
+
+        """
+
+        self.restarts += 1
+        crash_list = self._crash_dict.pop(old_pid, [])
+        if new_pid:
+            self._crash_dict[new_pid] = crash_list
+
+        for site in set(registrable_domain(uri) for uri in uri_list):
+            if site:
+                self._site_restart_dict[site] = \
+                        self._site_restart_dict.get(site, 0) + 1
+
+    def forget(self, pid):
+        """ forget(pid) -> Forget plug pid, which has exited without
+        crashing.
+
+        """
+
+        self._forget(pid)
+        self._crash_dict.pop(pid, None)
+
+    def get_stats_list(self):
+        """ get_stats_list -> Return a list of strings describing the
+        restarts and the sites that caused the most of them.
+
+        """
+
+        quarantined = len([uri for uri in self._uri_crash_dict if
+            self.is_quarantined(uri)])
+        stats_list = ["supervisor: %d restarts, %d start timeouts, %d uris "
+                "quarantined" % (self.restarts, self.timeouts, quarantined)]
+
+        site_list = sorted(self._site_restart_dict.items(),
+                key=lambda (site, count): count, reverse=True)[:5]
+        if site_list:
+            stats_list.append("supervisor: flaky sites: %s" % \
+                    ', '.join('%s (%d)' % item for item in site_list))
+        return stats_list
+
+    def _forget(self, pid):
+        """ _forget(pid) -> Stop waiting for plug pid and forget that it was
+        ready.
+
+        """
+
+        timeout_id = self._starting_dict.pop(pid, None)
+        if timeout_id:
+            glib.source_remove(timeout_id)
+        self._ready_set.discard(pid)
+
+    def _start_timed_out(self, pid):
+        """ _start_timed_out(pid) -> Kill plug pid, which hasn't said it is
+        ready in time.
+
+        """
+
+        if self._starting_dict.pop(pid, None) is None:
+            return False
+
+        # Count it as a crash of the plug.
+        self._ready_set.add(pid)
+        self.timeouts += 1
+        print("Plug %d did not start in %d seconds" % (pid, START_TIMEOUT))
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+        self._timeout_func(pid)
+        return False
@@ -0,0 +1,362 @@
+# This file is part of browser, and contains the plug fork server.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" A zygote process that starts plugs by forking itself.
+
+The zygote imports dbus, the gobject bindings and the modules of the plugs
+that don't use gtk once.  It keeps one forked child, the spare, waiting for
+a plug to run, and writes the spare's pid as a json line on the reply pipe
+given as its first argument:
+
+    {"spare": 1234}
+
+The main window reads the replies with an io watch.  To start a plug it
+takes the spare's pid without waiting and writes a request for it on the
+zygote's stdin:
+
+    {"pid": 1234, "main_path": "...", "transport": "dbus", "env": {}}
+
+The zygote hands the request to the spare, which runs the plug, and forks
+a new spare.  The children share the zygote's memory until they change it,
+so they start faster and use less of it than plugs started by running
+browserplug.py.
+
+Importing gtk or webkit initializes gtk and opens the display, which the
+children mustn't share, so the zygote never imports them, or browserplug or
+the tab plugins, which use them.  Each child imports them after the fork,
+with its own display and bus connection.
+
+"""
+
+import os
+import sys
+import json
+import fcntl
+import signal
+import subprocess
+
+import glib
+
+# The modules imported by the zygote so the plugs don't have to.  None of
+# them may import gtk.
+PRELOAD_MODULE_LIST = [
+        'json',
+        're',
+        'socket',
+        'threading',
+        'tempfile',
+        'urllib2',
+        'glib',
+        'gobject',
+        'pango',
+        'dbus',
+        'dbus.service',
+        'dbus.gobject_service',
+        'dbus.mainloop.glib',
+        'block_matcher',
+        'file_watch',
+        'log_levels',
+        'plug_ipc',
+        'plugin_loader',
+        'resource_filter',
+        'tab_state',
+        'verdict_cache',
+        ]
+
+
+class PlugZygote(object):
+    """ PlugZygote -> Start a zygote process and ask it for plugs.
+
+    """
+
+    def __init__(self, pyexec, path):
+        """ PlugZygote(pyexec, path) -> Run the zygote in path with the
+        python executable pyexec.
+
+        """
+
+        self._pyexec = pyexec
+        self._path = path
+
+        self._process = None
+        self._reply_fd = None
+        self._watch_id = None
+
+        # The pid of the child waiting for a plug to run, or None.
+        self._spare_pid = None
+
+        # The reply text that hasn't made a whole line yet.
+        self._reply_buffer = ''
+
+        self.forks = 0
+
+    def start(self):
+        """ start -> Start the zygote.  It can't start plugs until it has
+        finished importing and sent the pid of its spare.
+
+        """
+
+        read_fd, write_fd = os.pipe()
+        fcntl.fcntl(read_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        self._process = subprocess.Popen([self._pyexec,
+            '%s/plug_zygote.py' % self._path, str(write_fd)],
+            stdin=subprocess.PIPE)
+        os.close(write_fd)
+
+        # Plugs started without the zygote mustn't keep its stdin open, or
+        # it won't see it close.
+        fcntl.fcntl(self._process.stdin.fileno(), fcntl.F_SETFD, 
+                fcntl.FD_CLOEXEC)
+
+        self._reply_fd = read_fd
+        self._reply_buffer = ''
+        self._watch_id = glib.io_add_watch(read_fd, 
+                glib.IO_IN | glib.IO_HUP, self._reply_ready)
+
+    def stop(self):
+        """ stop -> Tell the zygote to exit.  The plugs it started keep
+        running, and the spare exits with it.
+
+        """
+
+        if not self._process:
+            return
+
+        try:
+            self._process.stdin.close()
+        except IOError:
+            pass
+
+        if self._watch_id:
+            glib.source_remove(self._watch_id)
+            self._watch_id = None
+        os.close(self._reply_fd)
+        self._reply_fd = None
+
+        # It exits once it reads the end of its stdin.
+        self._process.wait()
+
+        self._process = None
+        self._spare_pid = None
+
+    def is_ready(self):
+        """ is_ready -> Return True if the zygote is running and has a spare
+        to run a plug in.
+
+        """
+
+        if not self._process or self._process.poll() is not None:
+            return False
+
+        return bool(self._spare_pid)
+
+    def fork_plug(self, main_path, transport, env_dict):
+        """ fork_plug(main_path, transport, env_dict) -> Run a plug for the
+        main window at main_path in the spare and return its pid, or None
+        if there is no spare yet.  env_dict is added to the plug's
+        environment.
+
+        """
+
+        if not self.is_ready():
+            return None
+
+        pid = self._spare_pid
+        self._spare_pid = None
+        request = {
+                'pid': pid,
+                'main_path': main_path,
+                'transport': transport,
+                'env': env_dict,
+                }
+        try:
+            self._process.stdin.write('%s\n' % json.dumps(request))
+            self._process.stdin.flush()
+        except IOError as err:
+            print("Error sending request to zygote: %s" % err)
+            return None
+
+        self.forks += 1
+        return pid
+
+    def _reply_ready(self, reply_fd, condition):
+        """ _reply_ready(reply_fd, condition) -> Read the replies from the
+        zygote when they come.
+
+        """
+
+        data = ''
+        if condition & glib.IO_IN:
+            data = os.read(reply_fd, 4096)
+        if not data:
+            # The zygote has exited.
+            self._spare_pid = None
+            self._watch_id = None
+            return False
+
+        self._reply_buffer += data
+        while '\n' in self._reply_buffer:
+            line, self._reply_buffer = self._reply_buffer.split('\n', 1)
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                continue
+
+            if 'error' in reply:
+                print("Error forking plug: %s" % reply['error'])
+            if reply.get('spare', None):
+                self._spare_pid = reply['spare']
+        return True
+
+
+def preload():
+    """ preload -> Import the modules the plugs use that don't
+    initialize gtk.
+
+    """
+
+    for module_name in PRELOAD_MODULE_LIST:
+        try:
+            __import__(module_name)
+        except Exception as err:
+            print("zygote: unable to preload %s: %s" % (module_name, err))
+
+    if 'gtk' in sys.modules:
+        print("zygote: gtk was imported while preloading")
+
+
+def run_plug(request):
+    """ run_plug(request) -> Run a plug in a forked child.
+
+    """
+
+    os.environ.update(request.get('env', {}))
+
+    # gtk opens the display and the plug connects to the bus after the
+    # fork, so they are the child's own.
+    import defaults
+    from startup_profile import startup_profile
+
+    # Time this plug from the fork, not from when the zygote started.
+    startup_profile.reset()
+
+    # The interface names are made from the pid, which is the zygote's in
+    # the modules it imported.
+    reload(defaults)
+    import browserplug
+
+    browserplug.main([request.get('main_path', ''),
+        request.get('transport', 'dbus')])
+
+
+def fork_spare(reply_file):
+    """ fork_spare(reply_file) -> Fork a child that waits for a request,
+    and return its pid and the file to write the request to.
+
+    """
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(read_fd)
+        return pid, os.fdopen(write_fd, 'w')
+
+    # The child doesn't talk to the main window this way.
+    os.close(write_fd)
+    reply_file.close()
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.close(null_fd)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    with os.fdopen(read_fd, 'r') as request_file:
+        line = request_file.readline()
+
+    # The zygote exited without using it.
+    if not line:
+        os._exit(0)
+
+    status = 0
+    try:
+        run_plug(json.loads(line))
+    except Exception as err:
+        print("zygote child %d: %s" % (os.getpid(), err))
+        status = 1
+    sys.stdout.flush()
+    os._exit(status)
+
+
+def serve(reply_fd):
+    """ serve(reply_fd) -> Hand each request read from stdin to the
+    spare, and write the pid of the next spare to reply_fd, until stdin is
+    closed.
+
+    """
+
+    preload()
+
+    # Let the children be reaped without waiting for them.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    reply_file = os.fdopen(reply_fd, 'w')
+
+    def reply(reply_dict):
+        reply_file.write('%s\n' % json.dumps(reply_dict))
+        reply_file.flush()
+
+    try:
+        spare_pid, spare_file = fork_spare(reply_file)
+    except OSError as err:
+        reply({'error': str(err)})
+        return
+    reply({'spare': spare_pid})
+
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+
+        try:
+            request = json.loads(line)
+        except ValueError as err:
+            reply({'error': str(err)})
+            continue
+
+        if request.get('pid', None) != spare_pid:
+            reply({'error': 'plug %s is not the spare' % \
+                    request.get('pid', None)})
+            continue
+
+        try:
+            spare_file.write(line)
+            spare_file.close()
+        except IOError as err:
+            reply({'error': 'spare %d: %s' % (spare_pid, err)})
+
+        try:
+            spare_pid, spare_file = fork_spare(reply_file)
+        except OSError as err:
+            # Without a spare the main window starts its plugs itself.
+            reply({'error': str(err)})
+            return
+        reply({'spare': spare_pid})
+
+    # The spare exits when it reads the end of its request pipe.
+    spare_file.close()
+
+if __name__ == '__main__':
+    serve(int(sys.argv[1]))
@@ -31,6 +31,7 @@ import json
 import gobject
 import glib
 
+from startup_profile import startup_profile, monotonic
 from defaults import APP_NAME
 
 class Plugins(gobject.GObject):
@@ -115,7 +116,10 @@ class Plugins(gobject.GObject):
                             'module':None,
                             'plugin':None
                             }
+                    start = monotonic()
                     self._load(plugin_name)
+                    startup_profile.add_task('plugin %s' % plugin_name, 
+                            monotonic() - start)
                 else:
                     # Keep track of which plugins still exist.
                     if plugin_name in plug_name_list:
@@ -25,6 +25,7 @@ import threading
 from time import strftime
 
 from classes import LogView
+from log_levels import log_registry, LEVEL_NAME_LIST
 
 class MessageView(object):
 
@@ -37,6 +38,7 @@ class MessageView(object):
         # Start debug view
         self._debug_view = LogView()
         self._browser.connect('message', self.print_message)
+        self._debug_view._text_view.connect('populate-popup', self._popup)
         self._browser._term_book.new_tab(self._debug_view)
         self._browser._term_book.reorder_child(self._debug_view, 0)
 
@@ -49,6 +51,7 @@ class MessageView(object):
     def exit(self):
         try:
             self._browser.disconnect_by_func(self.print_message)
+            self._debug_view._text_view.disconnect_by_func(self._popup)
             self._browser._accels.disconnect_by_func(self._toggle_terminal_key_pressed)
         except Exception as err:
             print(err)
@@ -62,6 +65,43 @@ class MessageView(object):
 
         return True
 
+    def _popup(self, text_view, menu):
+        """ _popup(text_view, menu) -> Add a menu to set the level of each
+        log category.  The levels are sent to every plug process.
+
+        """
+
+        level_menu = gtk.Menu()
+        for category in sorted(log_registry.get_levels()):
+            category_menu = gtk.Menu()
+            group = None
+            for level, name in LEVEL_NAME_LIST:
+                menu_item = gtk.RadioMenuItem(group, name)
+                group = menu_item
+                menu_item.set_active(level == \
+                        log_registry.get_level(category))
+                menu_item.connect('toggled', self._set_level, category, 
+                        level)
+                category_menu.append(menu_item)
+            menu_item = gtk.MenuItem(category.capitalize())
+            menu_item.set_submenu(category_menu)
+            level_menu.append(menu_item)
+
+        menu_item = gtk.MenuItem('Log _Levels')
+        menu_item.set_submenu(level_menu)
+        menu.append(gtk.SeparatorMenuItem())
+        menu.append(menu_item)
+        menu.show_all()
+
+    def _set_level(self, menu_item, category, level):
+        """ _set_level(menu_item, category, level) -> Set the level of
+        category when its menu item is selected.
+
+        """
+
+        if menu_item.get_active():
+            log_registry.set_level(category, level)
+
     def _toggle_terminal_key_pressed(self, accels=None, window=None, 
             keyval=None, flags=None):
         """ _toggle_terminal_key_pressed() -> Toggle visibility of terminal
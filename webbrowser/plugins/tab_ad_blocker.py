@@ -19,13 +19,17 @@
 
 """
 
-import re
 import os
 
 import gtk
 import pango
 from glib import get_user_config_dir, timeout_add
 
+from block_matcher import load_matcher
+from verdict_cache import verdict_cache, cache_key
+from resource_filter import FILTER_PASS, FILTER_BLOCK
+from log_levels import log_registry
+
 class AdBlock(object):
     """ AdBlock -> Load ad patterns from a file and block requests to uris
     that match any of those patterns.
@@ -38,6 +42,7 @@ class AdBlock(object):
         """
 
         self._path = '%s/webbrowser' % get_user_config_dir()
+        self._index_filename = '%s/block.idx' % tab._config_path
         self._ad_pat = None
         self._tab = tab
         self._log_func = tab.print_message
@@ -59,7 +64,7 @@ class AdBlock(object):
         self._toggle_file_watch()
 
         # Connect the ad blocker to browser.
-        self._tab.connect('resource-request', self._block_resource) 
+        self._tab.add_resource_filter('adblock', self._block_resource, 10)
         self._tab.connect('plugin-request', self._block_plugin) 
         self._tab.connect('populate-popup', self._popup) 
 
@@ -70,7 +75,7 @@ class AdBlock(object):
 
         try:
             self._toggle_file_watch()
-            self._tab.disconnect_by_func(self._block_resource)
+            self._tab.remove_resource_filter('adblock')
             self._tab.disconnect_by_func(self._block_plugin)
             self._tab.disconnect_by_func(self._popup)
         except:
@@ -78,18 +83,15 @@ class AdBlock(object):
             pass
 
     def setup_ad_pat(self):
-        """ setup_ad_pat -> Setup the ad regex pattern.
+        """ setup_ad_pat -> Setup the ad rule matcher.  The rules are
+        compiled into an index in the profile directory that is shared by
+        every tab and only rebuilt when block.uri changes.
 
         """
 
-        pattern_list = []
-        with open('%s/block.uri' % self._path, 'r') as block_file:
-            for line in block_file.readlines():
-                if line[0] != '#' and line.strip():
-                    pattern_list.append(line.strip())
-
-        ad_str = r'|'.join(pattern_list)
-        self._ad_pat = re.compile(r'(%s)' % ad_str, re.I)
+        self._ad_pat = load_matcher('%s/block.uri' % self._path, 
+                self._index_filename, lambda msg: self._log_func(
+                    "(Ad Block plugin) %s" % msg, 32, '1;38;5;196'))
 
     def _toggle_file_watch(self):
         """ _toggle_file_watch -> Toggle the file watcher.
@@ -112,37 +114,59 @@ class AdBlock(object):
                 32, '1;38;5;196')
         self.setup_ad_pat()
 
+        # Cached verdicts are from the old rules.
+        verdict_cache.clear('adblock')
+        self._log_func("(Ad Block plugin) Filter cache: %s" % \
+                verdict_cache.get_stats_str(), 32, '1;38;5;196')
+
+    def _is_blocked(self, uri, key):
+        """ _is_blocked(uri, key) -> Return True if uri matches the ad rules,
+        using the verdict cache entry for key when possible.
+
+        """
+
+        if key:
+            blocked = verdict_cache.get('adblock', key)
+            if blocked is not None:
+                return blocked
+
+        blocked = bool(self._ad_pat.search(uri))
+        if key:
+            verdict_cache.set('adblock', key, blocked)
+        return blocked
+
     def _block_plugin(self, tab, uri):
-        """ _block_plugin -> Check plugin uris against the ad retext pattern,
-        and if they match it blocks them.
+        """ _block_plugin -> Check plugin uris against the ad rules, and if
+        they match it blocks them.
 
         """
 
         if not self._enabled:
             return
 
-        match = self._ad_pat.search(uri)
-        if match:
-            self._log_func("(Ad Block plugin) blocking plugin: %s" % uri, 
-                    32, '1;38;5;196')
+        if self._is_blocked(uri, cache_key(uri)):
+            if log_registry.is_enabled('block'):
+                self._log_func("(Ad Block plugin) blocking plugin: %s" % 
+                        uri, 32, '1;38;5;196')
             pl = gtk.Label("Blocked: %s" % uri)
             pl.set_line_wrap_mode(pango.WRAP_WORD_CHAR)
 
-    def _block_resource(self, tab, uri):
-        """ _block_resource -> Watches resource requests and blocks the ones 
-        that match a certain pattern.
+    def _block_resource(self, request):
+        """ _block_resource(request) -> Resource filter that blocks the
+        requests that match the ad rules.
 
         """
 
         if not self._enabled:
-            return
+            return FILTER_PASS
 
-        match = self._ad_pat.search(uri)
-        if match:
-            if self._log_func:
+        if self._is_blocked(request.uri, request.key):
+            if log_registry.is_enabled('block'):
                 self._log_func("(Ad Block plugin) blocking resource: %s" % 
-                        uri, 32, '1;38;5;196')
-            return 'about:blank'
+                        request.uri, 32, '1;38;5;196')
+            return FILTER_BLOCK
+
+        return FILTER_PASS
 
     def _toggle_adblocker(self, menuitem):
         """ _toggle_adblocker -> Enable/disable the ad-blocker.
@@ -152,6 +176,7 @@ class AdBlock(object):
         self._enabled = menuitem.get_active()
         if self._enabled:
             self.setup_ad_pat()
+            verdict_cache.clear('adblock')
         self._toggle_file_watch()
 
     def _popup(self, tab, menu):
@@ -166,6 +191,13 @@ class AdBlock(object):
             menu_item.connect('toggled', self._toggle_adblocker)
             menu_item.show_all()
             self._tab._settings_menu.add(menu_item)
+
+            # Show how well the verdict cache is working.
+            menu_item = gtk.MenuItem('Filter cache: %s' % \
+                    verdict_cache.get_stats_str())
+            menu_item.set_sensitive(False)
+            menu_item.show_all()
+            self._tab._settings_menu.add(menu_item)
         except Exception as err:
             self._log_func("(Ad Block plugin): Error adding menu item: %s" % err, 32, '1;38;5;196')
 
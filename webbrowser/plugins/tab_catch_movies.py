@@ -25,6 +25,9 @@ import os
 import gtk
 from glib import get_user_config_dir
 
+from verdict_cache import verdict_cache
+from resource_filter import FILTER_PASS
+
 class CatchMovie(object):
     """ CatchMovie -> Watch resource requests and catches movies based on
     a regex pattern.
@@ -45,6 +48,7 @@ class CatchMovie(object):
         self._path = '%s/webbrowser' % get_user_config_dir()
 
         self._tab = tab
+        self._file_watch = tab._file_watcher
 
     def run(self):
         """ run -> Finish initializing and run the movie catcher.
@@ -57,9 +61,12 @@ class CatchMovie(object):
 
         self._log_func("(Movie Catcher plugin): Running.", 32, '38;5;69')
         self.setup_movie_pat()
+        self._toggle_file_watch()
 
-        # Connect the movie catcher to webview.
-        self._tab.connect('resource-request', self._catch_movies) 
+        # Connect the movie catcher to webview.  It watches every request,
+        # even the ones the ad blocker blocks.
+        self._tab.add_resource_filter('movie', self._catch_movies, 20, 
+                observer=True)
         self._tab.connect('populate-popup', self._popup) 
 
     def exit(self):
@@ -68,7 +75,8 @@ class CatchMovie(object):
         """
 
         try:
-            self._tab.disconnect_by_func(self._catch_movies) 
+            self._toggle_file_watch()
+            self._tab.remove_resource_filter('movie')
             self._tab.disconnect_by_func(self._popup) 
         except:
             # Ignore errors.
@@ -90,15 +98,69 @@ class CatchMovie(object):
         self._movie_pat = re.compile(r'(%s)' % movie_str, re.I)
         self._vid_ext_pat = re.compile(r'.*[\/=&]*?([^\/=&]*\.(fl.{1}|ogg|mp4|avi|mov|rm|mp3|wav))([^a-zA-Z0-9]|$)', re.I)
 
-    def _catch_movies(self, tab, uri):
-        """ catch_movies -> Watches resource requests and catches movie requests.
+    def _toggle_file_watch(self):
+        """ _toggle_file_watch -> Toggle the file watcher.
+
+        """
+
+        if self._file_watch:
+            filename = '%s/movie.uri' % self._path
+            if not self._file_watch.has_file(filename):
+                self._file_watch.add_file(filename, self._reload_movie_pat)
+            else:
+                self._file_watch.remove_file(filename)
+
+    def _reload_movie_pat(self, *args):
+        """ _reload_movie_pat -> Re-load the movie patterns from the file.
+
+        """
+
+        self._log_func("(Movie Catcher plugin) Re-loading movie patterns.",
+                32, '38;5;69')
+        self.setup_movie_pat()
+
+        # Cached verdicts are from the old patterns.
+        verdict_cache.clear('movie')
+
+    def _is_movie(self, uri, key):
+        """ _is_movie(uri, key) -> Return True if uri matches the movie
+        pattern, using the verdict cache entry for key when possible.
+
+        """
+
+        if key:
+            is_movie = verdict_cache.get('movie', key)
+            if is_movie is not None:
+                return is_movie
+
+        is_movie = bool(self._movie_pat.search(uri))
+        if key:
+            verdict_cache.set('movie', key, is_movie)
+        return is_movie
+
+    def _catch_movies(self, request):
+        """ _catch_movies(request) -> Resource filter that catches movie 
+        requests.  It always lets the request through.
+
+        """
+
+        if self._enabled:
+            self._send_movie(request)
+
+        return FILTER_PASS
+
+    def _send_movie(self, request):
+        """ _send_movie(request) -> Send a download for request if it is a
+        movie.
 
         """
 
-        if not self._enabled:
-            return False
+        uri = request.uri
 
-        match = self._movie_pat.search(uri)
+        # Most uris are not movies, so only search again for the match
+        # groups when it is one.
+        match = self._is_movie(uri, request.key) and \
+                self._movie_pat.search(uri)
         if match:
             self._log_func("movie: uri %s" % uri, 32, '38;5;69')
 
@@ -0,0 +1,225 @@
+# This file is part of browser, and contains the tab process policy.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Decides which plug process a new external tab goes in.
+
+The policies are:
+
+    per-tab     Every tab gets its own process.
+    per-site    Tabs of the same site, by registrable domain, share a
+                process.
+    fixed       At most process-count processes, new tabs go in the one
+                with the fewest tabs.
+    memory      Tabs share the newest process until it uses more than
+                memory-limit megabytes, then a new one is started.
+
+Tabs the user asks to share a process, and views a page opens itself, are
+not decided by the policy.
+
+"""
+
+import json
+
+from resource_filter import ResourceRequest
+
+POLICY_PER_TAB = 'per-tab'
+POLICY_PER_SITE = 'per-site'
+POLICY_FIXED = 'fixed'
+POLICY_MEMORY = 'memory'
+
+POLICY_LIST = [POLICY_PER_TAB, POLICY_PER_SITE, POLICY_FIXED, POLICY_MEMORY]
+
+# The default number of processes for the fixed policy.
+PROCESS_COUNT = 4
+
+# The default megabytes a process can use before the memory policy stops
+# putting new tabs in it.
+MEMORY_LIMIT = 300
+
+# Suffixes that domains are registered under, besides top level domains.
+# This is not the whole public suffix list, just the common ones.
+SECOND_LEVEL_SET = set([
+    'ac.uk', 'co.uk', 'gov.uk', 'ltd.uk', 'me.uk', 'net.uk', 'org.uk',
+    'plc.uk', 'sch.uk', 'com.au', 'net.au', 'org.au', 'edu.au', 'gov.au',
+    'asn.au', 'id.au', 'co.nz', 'net.nz', 'org.nz', 'govt.nz', 'ac.nz',
+    'co.jp', 'ne.jp', 'or.jp', 'ac.jp', 'go.jp', 'co.kr', 'or.kr',
+    'com.br', 'net.br', 'org.br', 'gov.br', 'com.cn', 'net.cn', 'org.cn',
+    'gov.cn', 'edu.cn', 'com.mx', 'org.mx', 'gob.mx', 'co.in', 'net.in',
+    'org.in', 'gov.in', 'ac.in', 'co.za', 'org.za', 'gov.za', 'com.ar',
+    'com.tr', 'com.tw', 'com.hk', 'com.sg', 'co.il', 'co.id', 'com.my',
+    'com.ua', 'com.ru', 'com.pl', 'com.es',
+    ])
+
+
+def registrable_domain(uri):
+    """ registrable_domain(uri) -> Return the domain uri is registered
+    under, like example.co.uk for www.example.co.uk, or '' if it doesn't
+    have one.
+
+    """
+
+    host = ResourceRequest(uri).host.rstrip('.')
+    if not host:
+        return ''
+
+    # Addresses are their own site.
+    if host.startswith('[') or host.replace('.', '').isdigit():
+        return host
+
+    label_list = host.split('.')
+    if len(label_list) <= 2:
+        return host
+
+    if '.'.join(label_list[-2:]) in SECOND_LEVEL_SET:
+        return '.'.join(label_list[-3:])
+    return '.'.join(label_list[-2:])
+
+
+def history_item(history_str):
+    """ history_item(history_str) -> Return the (title, uri) of the current
+    item of a history json string, or ('', '') if there isn't one.
+
+    """
+
+    try:
+        index, history_list = json.loads(history_str)
+        # An index of 1 means the newest item.
+        if index == 1:
+            index = 0
+        title, uri = history_list[len(history_list) - 1 + index]
+        return title, uri
+    except (ValueError, TypeError, IndexError):
+        return '', ''
+
+
+def history_uri(history_str):
+    """ history_uri(history_str) -> Return the uri of the current item of a
+    history json string, or '' if there isn't one.
+
+    """
+
+    return history_item(history_str)[1]
+
+
+def get_rss(pid):
+    """ get_rss(pid) -> Return the resident memory of process pid in bytes,
+    or 0 if it can't be read.
+
+    """
+
+    try:
+        with open('/proc/%d/status' % pid) as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        pass
+    return 0
+
+
+class ProcessPolicy(object):
+    """ ProcessPolicy -> Choose the plug process each new tab goes in.
+
+    """
+
+    def __init__(self, policy=POLICY_PER_TAB, process_count=PROCESS_COUNT,
+            memory_limit=MEMORY_LIMIT):
+        """ ProcessPolicy(policy=POLICY_PER_TAB, process_count=PROCESS_COUNT,
+        memory_limit=MEMORY_LIMIT) -> Choose processes using policy.
+        process_count is used by the fixed policy and memory_limit, in
+        megabytes, by the memory policy.
+
+        """
+
+        if policy not in POLICY_LIST:
+            print("Unknown process policy %s, using %s" % (policy,
+                POLICY_PER_TAB))
+            policy = POLICY_PER_TAB
+
+        self.policy = policy
+        self._process_count = max(1, process_count)
+        self._memory_limit = memory_limit * 1024 * 1024
+
+        # pid: the site each process was started for, in start order.
+        self._site_dict = {}
+        self._pid_list = []
+
+    def choose_pid(self, uri, tab_list):
+        """ choose_pid(uri, tab_list) -> Return the pid of the process a new
+        tab loading uri should share, or None if it should get a new
+        process.  tab_list is a list of the (pid, uri) of the open external
+        tabs.
+
+        """
+
+        tab_count_dict = {}
+        for pid, tab_uri in tab_list:
+            if pid:
+                tab_count_dict[pid] = tab_count_dict.get(pid, 0) + 1
+
+        # Forget the processes that have no tabs left.
+        for pid in self._pid_list[:]:
+            if pid not in tab_count_dict:
+                self._pid_list.remove(pid)
+                self._site_dict.pop(pid, None)
+
+        if not tab_count_dict or self.policy == POLICY_PER_TAB:
+            return None
+
+        if self.policy == POLICY_PER_SITE:
+            site = registrable_domain(uri)
+            if not site:
+                return None
+            for pid in self._pid_list:
+                if self._site_dict.get(pid) == site:
+                    return pid
+            return None
+
+        if self.policy == POLICY_FIXED:
+            if len(tab_count_dict) < self._process_count:
+                return None
+            return min(tab_count_dict, key=tab_count_dict.get)
+
+        # POLICY_MEMORY: fill the newest process first.  A process whose
+        # memory can't be read has exited, or is exiting.
+        for pid in reversed(self._pid_list):
+            rss = get_rss(pid)
+            if rss and rss < self._memory_limit:
+                return pid
+        return None
+
+    def add_process(self, pid, uri):
+        """ add_process(pid, uri) -> Remember that process pid was started
+        for a tab loading uri.
+
+        """
+
+        if pid in self._site_dict:
+            return
+
+        self._site_dict[pid] = registrable_domain(uri)
+        self._pid_list.append(pid)
+
+    def replace_process(self, old_pid, new_pid):
+        """ replace_process(old_pid, new_pid) -> Give the process that
+        replaced a dead one its site.
+
+        """
+
+        if old_pid in self._site_dict and new_pid not in self._site_dict:
+            self._site_dict[new_pid] = self._site_dict.pop(old_pid)
+            self._pid_list[self._pid_list.index(old_pid)] = new_pid
@@ -0,0 +1,229 @@
+# This file is part of browser, and contains the resource filter chain.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" An ordered chain of filters that every resource request is run through.
+
+Filters are functions that take a ResourceRequest and return FILTER_PASS
+(None) to let the next filter look at it, FILTER_BLOCK to replace it with a
+blank page, or any other uri string to load that instead.  The first filter
+that doesn't pass decides, so lower priority numbers should be given to
+filters that are cheap and likely to decide.
+
+Observers are filters that only watch, like the movie catcher.  They see
+every request, even ones an earlier filter has decided, and what they
+return is ignored.
+
+"""
+
+from time import time
+
+from verdict_cache import cache_key
+
+FILTER_PASS = None
+FILTER_BLOCK = 'about:blank'
+
+# The priority used if none is given.
+DEFAULT_PRIORITY = 50
+
+
+class ResourceRequest(object):
+    """ ResourceRequest -> A resource uri split into its parts once for
+    all the filters.
+
+    """
+
+    __slots__ = ('uri', 'scheme', 'host', 'port', 'path', 'query', 
+            'fragment', '_key')
+
+    def __init__(self, uri):
+        """ ResourceRequest(uri) -> Split uri into scheme, host, port, path,
+        query and fragment.  The scheme and host are lowercased.
+
+        """
+
+        self.uri = uri
+        self.host = self.port = ''
+        self._key = False
+
+        rest, _, self.fragment = uri.partition('#')
+        rest, _, self.query = rest.partition('?')
+
+        scheme_end = rest.find('://')
+        if scheme_end == -1:
+            self.scheme, _, self.path = rest.partition(':')
+            self.scheme = self.scheme.lower()
+            return
+
+        self.scheme = rest[:scheme_end].lower()
+        host_start = scheme_end + 3
+        path_start = rest.find('/', host_start)
+        if path_start == -1:
+            path_start = len(rest)
+        self.path = rest[path_start:] or '/'
+
+        host = rest[host_start:path_start].lower()
+        host = host[host.rfind('@') + 1:]
+        port_start = host.rfind(':')
+        if port_start > host.rfind(']'):
+            host, self.port = host[:port_start], host[port_start + 1:]
+        self.host = host
+
+    def __repr__(self):
+        """ Return a string representation of the request.
+
+        """
+
+        return 'ResourceRequest(%r)' % self.uri
+
+    @property
+    def key(self):
+        """ The verdict cache key for this request or None if it shouldn't
+        be cached.
+
+        """
+
+        if self._key is False:
+            self._key = cache_key(self.uri)
+        return self._key
+
+
+class ResourceFilterChain(object):
+    """ ResourceFilterChain -> Run resource requests through an ordered
+    list of filters and keep track of the time each filter takes.
+
+    """
+
+    def __init__(self, error_func=None):
+        """ ResourceFilterChain(error_func=None) -> Create an empty filter
+        chain.  error_func(message) is called with the errors raised by
+        filters, which are printed if it is None.
+
+        """
+
+        self._error_func = error_func
+        self._filter_list = []
+        self._order = 0
+
+        # name: [calls, seconds, blocked, rewritten]
+        self._stats_dict = {}
+
+    def __len__(self):
+        """ Return the number of filters.
+
+        """
+
+        return len(self._filter_list)
+
+    def add(self, name, filter_func, priority=DEFAULT_PRIORITY, 
+            observer=False):
+        """ add(name, filter_func, priority=DEFAULT_PRIORITY, observer=False)
+        -> Add filter_func to the chain, replacing any filter with the same
+        name.  Filters run in order of priority, then in the order they were
+        added.  If observer is True it sees every request, and its verdict
+        is ignored.
+
+        """
+
+        self.remove(name)
+
+        self._order += 1
+        self._filter_list.append((priority, self._order, name, filter_func,
+            observer))
+        self._filter_list.sort()
+        self._stats_dict.setdefault(name, [0, 0.0, 0, 0])
+
+    def remove(self, name):
+        """ remove(name) -> Remove the named filter from the chain.
+
+        """
+
+        self._filter_list = [i for i in self._filter_list if i[2] != name]
+
+    def run(self, uri):
+        """ run(uri) -> Run uri through the filters and return the first
+        verdict that is not FILTER_PASS, or FILTER_PASS.  Observers are run
+        even after the verdict.
+
+        """
+
+        if not self._filter_list:
+            return FILTER_PASS
+
+        request = ResourceRequest(uri)
+        stats_dict = self._stats_dict
+        verdict = FILTER_PASS
+
+        for priority, order, name, filter_func, observer in \
+                self._filter_list:
+            if verdict is not FILTER_PASS and not observer:
+                continue
+
+            start = time()
+            try:
+                result = filter_func(request)
+            except Exception as err:
+                message = "Error in resource filter %s: %s" % (name, err)
+                if self._error_func:
+                    self._error_func(message)
+                else:
+                    print(message)
+                result = FILTER_PASS
+            stats = stats_dict[name]
+            stats[0] += 1
+            stats[1] += time() - start
+
+            if result is not FILTER_PASS and not observer:
+                if result == FILTER_BLOCK:
+                    stats[2] += 1
+                else:
+                    stats[3] += 1
+                verdict = result
+
+        return verdict
+
+    def get_stats(self):
+        """ get_stats -> Return a dictionary of each filter's name and a
+        dictionary of its calls, total time, blocked and rewritten counts.
+
+        """
+
+        stats_dict = {}
+        for name, (calls, seconds, blocked, rewritten) in \
+                self._stats_dict.iteritems():
+            stats_dict[name] = {
+                    'calls': calls,
+                    'seconds': seconds,
+                    'blocked': blocked,
+                    'rewritten': rewritten,
+                    }
+        return stats_dict
+
+    def get_stats_list(self):
+        """ get_stats_list -> Return a list of strings describing the time
+        spent in each filter, in chain order.
+
+        """
+
+        stats_list = []
+        for priority, order, name, filter_func, observer in \
+                self._filter_list:
+            calls, seconds, blocked, rewritten = self._stats_dict[name]
+            average = (1000000.0 * seconds / calls) if calls else 0.0
+            stats_list.append("%s: %d calls, %.1f ms total, %.1f us each, "
+                    "%d blocked, %d rewritten" % (name, calls,
+                        seconds * 1000, average, blocked, rewritten))
+        return stats_list
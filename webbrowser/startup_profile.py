@@ -0,0 +1,271 @@
+# This file is part of browser, and contains the startup profiler.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Times the phases of starting the browser and its plugs.
+
+Each process has a startup_profile, timed from when the process started.  A
+phase is marked when it ends, and lasts from the end of the one before it,
+or from when the process started for the first one.  Work that isn't part
+of the sequence, like loading each plugin or importing the tab list in a
+thread, is added as a task with its own duration, from any thread.
+
+The main window adds the phases of the first plug to its own, and appends
+the profile to the history file as a json line once the first tab has
+painted.  summary_list makes a table of the history.
+
+"""
+
+import os
+import json
+import ctypes
+import ctypes.util
+import threading
+from time import time
+
+from plug_monitor import get_age
+
+# How many startups the summary covers.
+SUMMARY_COUNT = 20
+
+# The history file is cut to this many startups when it gets twice as big.
+MAX_HISTORY = 200
+
+CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+try:
+    _clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt') or
+            ctypes.util.find_library('c'), use_errno=True).clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+except (OSError, AttributeError, TypeError):
+    _clock_gettime = None
+
+
+def monotonic():
+    """ monotonic -> Return the seconds on the monotonic clock, which is
+    the same for every process.  Falls back to the wall clock.
+
+    """
+
+    if _clock_gettime:
+        spec = _timespec()
+        if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec)) == 0:
+            return spec.tv_sec + spec.tv_nsec * 1e-9
+    return time()
+
+
+class StartupProfile(object):
+    """ StartupProfile -> Record how long each part of starting up takes.
+
+    """
+
+    def __init__(self):
+        """ Start timing from when the process was started.
+
+        """
+
+        self.reset()
+
+    def reset(self):
+        """ reset -> Forget everything and start timing again from when the
+        process was started.  A process forked from one that had already
+        started calls this.
+
+        """
+
+        # A forked child can't use a lock another thread held at the fork.
+        self._lock = threading.Lock()
+
+        now = monotonic()
+        self._start = now - (get_age(os.getpid()) or 0)
+        self._last = self._start
+
+        # [name, seconds] of each phase and task, in the order they ended.
+        self._phase_list = []
+        self._task_list = []
+        self._plug_list = []
+
+        self._finished = False
+
+    def is_finished(self):
+        """ is_finished -> Return True if startup has finished.
+
+        """
+
+        return self._finished
+
+    def mark(self, name):
+        """ mark(name) -> End the phase name.  Phases marked again are
+        ignored.
+
+        """
+
+        with self._lock:
+            if self._finished or name in dict(self._phase_list):
+                return
+
+            now = monotonic()
+            self._phase_list.append([name, now - self._last])
+            self._last = now
+
+    def add_task(self, name, seconds):
+        """ add_task(name, seconds) -> Record that task name took seconds.
+        Tasks added again are ignored.
+
+        """
+
+        with self._lock:
+            if self._finished or name in dict(self._task_list):
+                return
+
+            self._task_list.append([name, seconds])
+
+    def add_plug(self, phase_list):
+        """ add_plug(phase_list) -> Add the [name, seconds] phases of the
+        first plug, unless a plug has already added its phases.
+
+        """
+
+        with self._lock:
+            if not self._finished and not self._plug_list:
+                self._plug_list = [list(phase) for phase in phase_list]
+
+    def get_phases(self):
+        """ get_phases -> Return the phases and tasks as a list of
+        [name, seconds], prefixed 'task' or 'plug' if they are not phases.
+
+        """
+
+        with self._lock:
+            return self._phase_list + \
+                    [['task %s' % name, seconds] for name, seconds in
+                        self._task_list] + \
+                    [['plug %s' % name, seconds] for name, seconds in
+                        self._plug_list]
+
+    def get_total(self):
+        """ get_total -> Return the seconds from the start of the process to
+        the last phase.
+
+        """
+
+        return self._last - self._start
+
+    def finish(self, filename=''):
+        """ finish(filename='') -> Stop recording, and append the profile to
+        the history file filename if it is set.
+
+        """
+
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+
+        if not filename:
+            return
+
+        entry = {
+                'time': time(),
+                'total': self.get_total(),
+                'phases': self.get_phases(),
+                }
+        try:
+            with open(filename, 'a') as history_file:
+                history_file.write('%s\n' % json.dumps(entry))
+            trim_history(filename)
+        except IOError as err:
+            print("Unable to write startup history %s: %s" % (filename, err))
+
+
+def read_history(filename):
+    """ read_history(filename) -> Return the list of startups in the history
+    file filename, oldest first.
+
+    """
+
+    entry_list = []
+    try:
+        with open(filename, 'r') as history_file:
+            for line in history_file:
+                try:
+                    entry_list.append(json.loads(line))
+                except ValueError:
+                    continue
+    except IOError:
+        pass
+    return entry_list
+
+
+def trim_history(filename):
+    """ trim_history(filename) -> Cut the history file filename down to the
+    last MAX_HISTORY startups if it has twice that many.
+
+    """
+
+    entry_list = read_history(filename)
+    if len(entry_list) < MAX_HISTORY * 2:
+        return
+
+    with open(filename, 'w') as history_file:
+        for entry in entry_list[-MAX_HISTORY:]:
+            history_file.write('%s\n' % json.dumps(entry))
+
+
+def summary_list(filename, count=SUMMARY_COUNT):
+    """ summary_list(filename, count=SUMMARY_COUNT) -> Return the lines of a
+    table of the last count startups in the history file filename, with the
+    last, mean, min and max milliseconds of each phase.
+
+    """
+
+    entry_list = read_history(filename)[-count:]
+    if not entry_list:
+        return ["No startups recorded in %s" % filename]
+
+    # name: the seconds it took in each startup, in the order first seen.
+    name_list = []
+    time_dict = {}
+    for entry in entry_list:
+        for name, seconds in entry.get('phases', []) + \
+                [['total', entry.get('total', 0)]]:
+            if name not in time_dict:
+                name_list.append(name)
+                time_dict[name] = []
+            time_dict[name].append(seconds)
+
+    # Keep the total at the bottom.
+    name_list.remove('total')
+    name_list.append('total')
+
+    width = max(len(name) for name in name_list)
+    line_list = ["Startup times of the last %d startups in ms" % \
+            len(entry_list), '',
+            '%-*s %6s %8s %8s %8s %8s' % (width, 'phase', 'runs', 'last',
+                'mean', 'min', 'max')]
+    for name in name_list:
+        ms_list = [seconds * 1000 for seconds in time_dict[name]]
+        line_list.append('%-*s %6d %8.1f %8.1f %8.1f %8.1f' % (width, name,
+            len(ms_list), ms_list[-1], sum(ms_list) / len(ms_list),
+            min(ms_list), max(ms_list)))
+    return line_list
+
+# The profile of this process.
+startup_profile = StartupProfile()
@@ -30,6 +30,7 @@ import pango
 import vte
 
 from classes import OpenDialog, SaveDialog
+from startup_profile import startup_profile, monotonic
 
 class TermBox(gtk.HBox):
 
@@ -1006,6 +1007,21 @@ class BrowserTabs(TabBase):
                 gtk.SeparatorMenuItem(),
                 )
 
+        # Show what the tab's plug process is using.
+        usage = None
+        if hasattr(clicked_tab, 'get_usage'):
+            usage = clicked_tab.get_usage()
+        if usage:
+            rss, cpu = usage
+            item_tup += (
+                    ('_usage_item', ('utilities-system-monitor', 
+                        'Plug %d: %.1f MB, %.0f%% CPU' % \
+                                (clicked_tab.get_pid(), rss / 1048576.0, 
+                                    cpu), False, None, lambda *a: None, 
+                                ())),
+                    gtk.SeparatorMenuItem(),
+                    )
+
         accel_group = gtk.AccelGroup()
         menu.set_accel_group(accel_group)
 
@@ -1300,8 +1316,8 @@ class TabList(gtk.ScrolledWindow):
 
         # Add some extra non-visible column data types.  These columns are
         # used to hold the pid, tab_index, history_index, and history_list 
-        # of each tab.
-        col_types.extend((str, object))
+        # of each tab, and whether it was saved when the browser last ran.
+        col_types.extend((str, object, bool))
 
         # Create the liststore using the data types in col_types list.
         self._tab_store = gtk.ListStore(*col_types)
@@ -1524,12 +1540,16 @@ class TabList(gtk.ScrolledWindow):
         """
 
         def reopen_list(tab_list, flags):
+            # Only a list of tabs is a session restore, reopening a single
+            # tab loads it straight away.
+            bulk = len(tab_list) > 1
             for row in tab_list:
                 if type(row) == tuple:
                     iter = self._tab_store.get_iter(row)
                 else:
                     iter = row.iter
                 tab_dict = self._get_tab_dict(iter)
+                tab_dict['bulk'] = bulk
                 self.emit('reopen-tab', tab_dict, flags)
 
         reopen_thread = threading.Thread(target=reopen_list, 
@@ -1608,8 +1628,11 @@ class TabList(gtk.ScrolledWindow):
 
         index = self._get_index(iter)
         info_list = self._get_info_list(iter)
+        icon = self._tab_store.get_value(iter, 0)
+        session = self._tab_store.get_value(iter, 5)
 
-        return {'info_list':info_list, 'index':index}
+        return {'info_list':info_list, 'index':index, 'icon':icon, 
+                'session':session}
 
     def _get_title(self, iter):
         """ _get_title(iter) -> Return the title of the item pointed to by
@@ -1659,19 +1682,25 @@ class TabList(gtk.ScrolledWindow):
 
         self._tab_store.set_value(iter, 2, uri)
 
-    def import_list(self, filename):
-        """ import_list(filename) -> Start a thread to import a list of tabs 
-        from a file.
+    def import_list(self, filename, session=False):
+        """ import_list(filename, session=False) -> Start a thread to import 
+        a list of tabs from a file.  session is True for the tabs saved when
+        the browser last ran.
 
         """
 
-        import_thread = threading.Thread(target=self._import_list_thread,
-                args=(filename,))
+        def import_thread_func():
+            start = monotonic()
+            self._import_list_thread(filename, session)
+            startup_profile.add_task('import-list', monotonic() - start)
+
+        import_thread = threading.Thread(target=import_thread_func)
         import_thread.daemon = True
         import_thread.start()
 
-    def _import_list_thread(self, filename):
-        """ _import_list_thread(filename) -> Import a list of tabs from a file.
+    def _import_list_thread(self, filename, session=False):
+        """ _import_list_thread(filename, session=False) -> Import a list of
+        tabs from a file.
 
         The format of the tab file is as follows:
 
@@ -1727,7 +1756,7 @@ class TabList(gtk.ScrolledWindow):
                         gtk.ICON_LOOKUP_USE_BUILTIN)
 
                 # Add the information about the tab to the list.
-                self.add_tab(icon, info_list, tab_index)
+                self.add_tab(icon, info_list, tab_index, session)
         except:
             # It is an old style file.
             for (tab_index, line) in enumerate(info_str.splitlines()):
@@ -1755,18 +1784,20 @@ class TabList(gtk.ScrolledWindow):
                             gtk.ICON_LOOKUP_USE_BUILTIN)
 
                     # Add the information about the tab to the list.
-                    self.add_tab(icon, info_list, tab_index)
+                    self.add_tab(icon, info_list, tab_index, session)
 
-    def add_tab(self, icon, info_list, index):
-        """ add_tab(icon, info_list, index) -> Add an event 
+    def add_tab(self, icon, info_list, index, session=False):
+        """ add_tab(icon, info_list, index, session=False) -> Add an event 
         to add a closed tab to the list when the main glib thread is idle.
+        session is True if the tab was saved when the browser last ran.
 
         """
 
-        glib.idle_add(self._add_tab, icon, info_list, index)
+        glib.idle_add(self._add_tab, icon, info_list, index, session)
     
-    def _add_tab(self, icon, info_list, index):
-        """ _add_tab(icon, info_list, index) -> Add a new item to the list.
+    def _add_tab(self, icon, info_list, index, session=False):
+        """ _add_tab(icon, info_list, index, session=False) -> Add a new 
+        item to the list.
 
         """
 
@@ -1805,7 +1836,7 @@ class TabList(gtk.ScrolledWindow):
             title, uri = ('Blank', 'about:blank')
 
         self._tab_store.append((icon, title.strip(), uri.strip(), index, 
-            info_list))
+            info_list, session))
 
         # Scroll the the last item.
         self._tab_view.scroll_to_cell((len(self._tab_store) - 1,))
@@ -0,0 +1,192 @@
+# This file is part of browser, and contains the tab state snapshot.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" A snapshot of the state of a browser view.
+
+The browser view sends a new snapshot to its tab whenever its uri, title,
+load status or back forward history changes, so the tab can answer all of
+its history questions without asking the browser view.  Each snapshot has a
+version so an old snapshot that arrives late is ignored.
+
+"""
+
+import json
+
+
+class TabState(object):
+    """ TabState -> The uri, title, load status and back forward history of
+    a browser view.
+
+    """
+
+    def __init__(self):
+        """ Create an empty state with version 0.
+
+        """
+
+        self.version = 0
+        self.uri = ''
+        self.title = ''
+        self.load_status = 0
+        self.can_go_back = False
+        self.can_go_forward = False
+
+        # The (title, uri) of every history item from the farthest back to
+        # the farthest forward, and how many of them are back items.
+        self.history_list = []
+        self.back_length = 0
+
+    def to_json(self):
+        """ to_json -> Return the state as a json string.
+
+        """
+
+        return json.dumps({
+            'version': self.version,
+            'uri': self.uri,
+            'title': self.title,
+            'load_status': self.load_status,
+            'can_go_back': self.can_go_back,
+            'can_go_forward': self.can_go_forward,
+            'history_list': self.history_list,
+            'back_length': self.back_length,
+            })
+
+    def update(self, version, state_str):
+        """ update(version, state_str) -> Load the state from the json
+        string state_str if version is newer than this state.  Returns True
+        if the state was changed.
+
+        """
+
+        if version <= self.version:
+            return False
+
+        try:
+            state_dict = json.loads(state_str)
+        except ValueError:
+            return False
+
+        self.version = version
+        self.uri = state_dict.get('uri', '')
+        self.title = state_dict.get('title', '')
+        self.load_status = state_dict.get('load_status', 0)
+        self.can_go_back = state_dict.get('can_go_back', False)
+        self.can_go_forward = state_dict.get('can_go_forward', False)
+        self.history_list = [tuple(i) for i in
+                state_dict.get('history_list', [])]
+        self.back_length = state_dict.get('back_length', 0)
+        return True
+
+    def get_history_length(self):
+        """ get_history_length -> Return the length of the back history
+        and the forward history.
+
+        """
+
+        if not self.history_list:
+            return 0, 0
+        return self.back_length, len(self.history_list) - \
+                self.back_length - 1
+
+    def get_history(self, index=2):
+        """ get_history(index=2) -> Return the history as a json string of
+        the current index followed by a list of (title, uri) items.  If
+        index is 1 the forward history is left out, and if index is not 2 it
+        is used as the current index.
+
+        """
+
+        back_length, forward_length = self.get_history_length()
+        if index == 1:
+            forward_length = 0
+
+        if index == 2:
+            current_index = -forward_length
+        else:
+            current_index = index
+
+        return json.dumps([current_index,
+            self.history_list[:back_length + forward_length + 1]])
+
+    def _get_item(self, offset):
+        """ _get_item(offset) -> Return the (title, uri) of the history item
+        offset items from the current one or None if there isn't one.
+
+        """
+
+        position = self.back_length + offset
+        if self.history_list and 0 <= position < len(self.history_list):
+            return self.history_list[position]
+        return None
+
+    def _get_uri_index(self, offset):
+        """ _get_uri_index(offset) -> Return the uri and the index of the
+        item offset items from the current one.  The index counts back from
+        zero at the farthest forward item.  If there is no item return
+        about:blank and 0.
+
+        """
+
+        item = self._get_item(offset)
+        if not item:
+            return 'about:blank', 0
+        return item[1], self.back_length + offset - \
+                (len(self.history_list) - 1)
+
+    def get_back_forward_item(self, index):
+        """ get_back_forward_item(index) -> Return the uri and title of the
+        item index items from the current one.
+
+        """
+
+        item = self._get_item(index)
+        if not item:
+            return 'about:blank', ''
+        return item[1], item[0]
+
+    def get_history_item(self, index):
+        """ get_history_item(index) -> Return the uri and index of the item
+        index items from the current one.
+
+        """
+
+        return self._get_uri_index(index)
+
+    def get_current_item(self):
+        """ get_current_item -> Return the uri and index of the current
+        item.
+
+        """
+
+        return self._get_uri_index(0)
+
+    def get_back_item(self):
+        """ get_back_item -> Return the uri and index of the first back
+        item.
+
+        """
+
+        return self._get_uri_index(-1)
+
+    def get_forward_item(self):
+        """ get_forward_item -> Return the uri and index of the first
+        forward item.
+
+        """
+
+        return self._get_uri_index(1)
@@ -0,0 +1,156 @@
+# This file is part of browser, and contains a cache for filter verdicts.
+#
+# Copyright (C) 2009-2010  Josiah Gordon <josiahg@gmail.com>
+#
+# browser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" A bounded LRU cache for resource filter verdicts.
+
+Pages request the same resources from the same third-party hosts over and
+over, so the filtering plugins remember what they decided for each
+(scheme, host, path prefix).  There is one cache per process shared by all
+the filters in it; each filter uses its own name in the keys.
+
+"""
+
+from collections import OrderedDict
+
+# Uris with a path (including the query) longer than this are not cached, so
+# a cached verdict is always the verdict the full uri would get.
+PATH_PREFIX_LENGTH = 256
+
+# The default number of verdicts kept.
+CACHE_SIZE = 4096
+
+
+def cache_key(uri):
+    """ cache_key(uri) -> Return a (scheme, host, path) tuple with the
+    scheme and host lowercased, or None if uri should not be cached.
+
+    """
+
+    scheme_end = uri.find('://')
+    if scheme_end == -1:
+        return None
+
+    host_start = scheme_end + 3
+    host_end = len(uri)
+    for char in '/?#':
+        index = uri.find(char, host_start)
+        if index != -1 and index < host_end:
+            host_end = index
+
+    path = uri[host_end:]
+    if len(path) > PATH_PREFIX_LENGTH:
+        return None
+
+    return (uri[:scheme_end].lower(), uri[host_start:host_end].lower(), path)
+
+
+class VerdictCache(object):
+    """ VerdictCache -> A least recently used cache of filter verdicts
+    that counts its hits and misses.
+
+    """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        """ VerdictCache(max_size=CACHE_SIZE) -> Create a cache that holds
+        at most max_size verdicts.
+
+        """
+
+        self._max_size = max_size
+        self._cache_dict = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clears = 0
+
+    def __len__(self):
+        """ Return the number of cached verdicts.
+
+        """
+
+        return len(self._cache_dict)
+
+    def get(self, name, key):
+        """ get(name, key) -> Return the verdict filter name gave for key or
+        None if it is not cached.
+
+        """
+
+        try:
+            verdict = self._cache_dict.pop((name, key))
+        except KeyError:
+            self.misses += 1
+            return None
+
+        # Move it to the most recently used end.
+        self._cache_dict[(name, key)] = verdict
+        self.hits += 1
+        return verdict
+
+    def set(self, name, key, verdict):
+        """ set(name, key, verdict) -> Remember the verdict filter name gave
+        for key.  verdict must not be None.
+
+        """
+
+        self._cache_dict.pop((name, key), None)
+        self._cache_dict[(name, key)] = verdict
+        if len(self._cache_dict) > self._max_size:
+            self._cache_dict.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self, name=None):
+        """ clear(name=None) -> Forget the verdicts of filter name, or every
+        verdict if name is None, because the rules changed.
+
+        """
+
+        if name is None:
+            self._cache_dict.clear()
+        else:
+            for key in [i for i in self._cache_dict if i[0] == name]:
+                del self._cache_dict[key]
+        self.clears += 1
+
+    def get_stats(self):
+        """ get_stats -> Return a dictionary of the cache counters.
+
+        """
+
+        return {
+                'size': len(self._cache_dict),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'clears': self.clears,
+                }
+
+    def get_stats_str(self):
+        """ get_stats_str -> Return the cache counters as a string.
+
+        """
+
+        total = self.hits + self.misses
+        hit_rate = (100.0 * self.hits / total) if total else 0.0
+        return "%d hits, %d misses (%.1f%%), %d cached, %d evicted" % \
+                (self.hits, self.misses, hit_rate, len(self._cache_dict),
+                        self.evictions)
+
+
+# The cache shared by every filter in this process.
+verdict_cache = VerdictCache()